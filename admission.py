@@ -0,0 +1,137 @@
+"""
+Admission Control: who gets a model slot, in what order, and who is told
+to come back later.
+
+- At most `max_concurrency` requests generate at once (a full decode batch);
+  the rest wait in a bounded priority queue: pro, then free, then batch jobs.
+- A request whose estimated wait exceeds its tier's deadline is rejected
+  right away with Retry-After (503) instead of timing out in the queue.
+- Free traffic may only fill part of the queue; past that it is shed (429)
+  so pro requests still find room.
+
+The wait estimate is an EWMA of slot hold times times the number of
+"rounds" ahead: ceil((requests ahead + 1) / max_concurrency).
+"""
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from typing import List, Optional
+from metrics import ADMISSION_QUEUE_DEPTH, ADMISSION_IN_FLIGHT, ADMISSION_REJECTED, ADMISSION_WAIT
+
+PRIORITY = {"pro": 0, "free": 1, "batch": 2}
+
+
+class Overloaded(Exception):
+    """Request rejected by admission control; carries the HTTP status and Retry-After."""
+    def __init__(self, detail: str, retry_after: float, status_code: int = 503):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class Ticket:
+    """A held slot. release() is idempotent, so error paths can call it unconditionally."""
+    def __init__(self, controller: "AdmissionController"):
+        self._controller = controller
+        self._started = time.monotonic()
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._controller._release(time.monotonic() - self._started)
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        max_concurrency: int,
+        max_queue: int,
+        max_wait: Optional[dict] = None,
+        free_queue_share: float = 0.5,
+        initial_service_time: float = 2.0,
+    ):
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue = max_queue
+        self.max_wait = max_wait or {}  # tier -> seconds; missing = wait as long as it takes
+        self.free_queue_share = free_queue_share
+        self.service_time = initial_service_time
+        self.in_flight = 0
+        self._waiters: List[list] = []  # heap of [priority, seq, future, tier]
+        self._seq = itertools.count()
+
+    def estimated_wait(self, ahead: int) -> float:
+        if self.in_flight < self.max_concurrency and ahead == 0:
+            return 0.0
+        return self.service_time * math.ceil((ahead + 1) / self.max_concurrency)
+
+    async def acquire(self, tier: str) -> Ticket:
+        """Waits for a slot or raises Overloaded. Batch work is never rejected, only queued last."""
+        if self.in_flight < self.max_concurrency and not self._waiters:
+            self._grant()
+            ADMISSION_WAIT.labels(tier=tier).observe(0)
+            return Ticket(self)
+
+        priority = PRIORITY.get(tier, PRIORITY["free"])
+        if tier != "batch":
+            self._check(tier, priority)
+
+        future = asyncio.get_running_loop().create_future()
+        entry = [priority, next(self._seq), future, tier]
+        heapq.heappush(self._waiters, entry)
+        ADMISSION_QUEUE_DEPTH.labels(tier=tier).inc()
+        started = time.monotonic()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Granted in the same tick the caller went away: hand the slot on
+                self._release(0.0, observe=False)
+            elif entry in self._waiters:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+                ADMISSION_QUEUE_DEPTH.labels(tier=tier).dec()
+            raise
+        ADMISSION_WAIT.labels(tier=tier).observe(time.monotonic() - started)
+        return Ticket(self)
+
+    def _check(self, tier: str, priority: int):
+        # Batch items queue behind everyone and do not take interactive queue room
+        interactive = sum(1 for w in self._waiters if w[3] != "batch")
+        if interactive >= self.max_queue:
+            self._reject(tier, "queue_full", f"Server busy: {interactive} requests queued",
+                         self.estimated_wait(interactive), 503)
+        if tier == "free":
+            waiting = sum(1 for w in self._waiters if w[3] == "free")
+            if waiting >= self.max_queue * self.free_queue_share:
+                self._reject(tier, "shed", "Free tier capacity exhausted, retry later",
+                             self.estimated_wait(interactive), 429)
+        ahead = sum(1 for w in self._waiters if w[0] <= priority)
+        wait = self.estimated_wait(ahead)
+        deadline = self.max_wait.get(tier)
+        if deadline is not None and wait > deadline:
+            self._reject(tier, "deadline", f"Estimated wait {wait:.0f}s exceeds {deadline:.0f}s", wait, 503)
+
+    @staticmethod
+    def _reject(tier: str, reason: str, detail: str, retry_after: float, status_code: int):
+        ADMISSION_REJECTED.labels(tier=tier, reason=reason).inc()
+        raise Overloaded(detail, retry_after, status_code)
+
+    def _grant(self):
+        self.in_flight += 1
+        ADMISSION_IN_FLIGHT.inc()
+
+    def _release(self, held: float, observe: bool = True):
+        if observe:
+            self.service_time = 0.8 * self.service_time + 0.2 * held
+        self.in_flight -= 1
+        ADMISSION_IN_FLIGHT.dec()
+        while self.in_flight < self.max_concurrency and self._waiters:
+            _, _, future, tier = heapq.heappop(self._waiters)
+            ADMISSION_QUEUE_DEPTH.labels(tier=tier).dec()
+            if future.done():
+                continue
+            self._grant()
+            future.set_result(None)
@@ -0,0 +1,291 @@
+"""
+Gonyai Benchmark Harness.
+
+Runs the FastAPI app in-process (httpx ASGI transport, no network hop),
+drives /chat and /chat/stream at a fixed concurrency and micro-benchmarks
+the hot helpers. Results are written as JSON so two commits can be diffed.
+
+    python3 benchmark.py --model ./tiny-model --requests 200 --concurrency 16
+    python3 benchmark.py --redis-host localhost --redis-port 6380 --output before.json
+
+Without --redis-host an in-process fakeredis is used (no RediSearch, so the
+Redis cache/RAG tiers are skipped and only the in-process cache can hit).
+It needs `pip install httpx "fakeredis[lua]"`: API key checks run a Lua script.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+DEFAULT_PROMPTS = [
+    "What is the capital of Goa?",
+    "Explain semantic caching in one paragraph.",
+    "How do I reset my password?",
+    "Summarize the benefits of continuous batching.",
+    "Give me three tips for writing clean Python.",
+    "What is a vector database?",
+    "Translate 'good morning' to Konkani.",
+    "Why is Redis fast?",
+]
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    if not samples:
+        return {"count": 0}
+    arr = np.asarray(samples, dtype=np.float64) * 1000.0
+    return {
+        "count": len(samples),
+        "mean_ms": round(float(arr.mean()), 3),
+        "p50_ms": round(float(np.percentile(arr, 50)), 3),
+        "p95_ms": round(float(np.percentile(arr, 95)), 3),
+        "p99_ms": round(float(np.percentile(arr, 99)), 3),
+    }
+
+def load_prompts(path: Optional[str]) -> List[str]:
+    if not path:
+        return list(DEFAULT_PROMPTS)
+    prompts = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if path.endswith((".jsonl", ".ndjson")):
+                record = json.loads(line)
+                line = record.get("prompt") or record.get("text") or ""
+            if line:
+                prompts.append(line)
+    return prompts
+
+def workload(prompts: List[str], n: int, unique: int, seed: int) -> List[str]:
+    """n prompts drawn from a pool of `unique` distinct ones (repeats are cache candidates)."""
+    rng = random.Random(seed)
+    pool = [prompts[i % len(prompts)] + ("" if i < len(prompts) else f" (variant {i})") for i in range(unique)]
+    return [rng.choice(pool) for _ in range(n)]
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+# ------------------------------------------------------------ end-to-end
+
+async def run_chat(client, headers: dict, prompts: List[str], concurrency: int, count_tokens: Callable[[str], int]) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, sources, tokens, errors = [], {}, 0, 0
+
+    async def one(i: int, prompt: str):
+        nonlocal tokens, errors
+        async with semaphore:
+            started = time.perf_counter()
+            res = await client.post("/chat", json={"prompt": prompt, "session_id": f"bench-{i}"}, headers=headers)
+            elapsed = time.perf_counter() - started
+        if res.status_code != 200:
+            errors += 1
+            return
+        body = res.json()
+        latencies.append(elapsed)
+        sources[body["source"]] = sources.get(body["source"], 0) + 1
+        if body["source"] != "semantic_cache":
+            tokens += count_tokens(body["response"])
+
+    started = time.perf_counter()
+    await asyncio.gather(*[one(i, p) for i, p in enumerate(prompts)])
+    wall = time.perf_counter() - started
+    return summarize(latencies, [], sources, tokens, errors, wall)
+
+async def run_stream(client, headers: dict, prompts: List[str], concurrency: int, count_tokens: Callable[[str], int]) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, ttfts, sources, tokens, errors = [], [], {}, 0, 0
+
+    async def one(i: int, prompt: str):
+        nonlocal tokens, errors
+        async with semaphore:
+            started = time.perf_counter()
+            first, text, source = None, "", None
+            async with client.stream("POST", "/chat/stream", json={"prompt": prompt, "session_id": f"bench-s{i}"}, headers=headers) as res:
+                if res.status_code != 200:
+                    errors += 1
+                    return
+                async for line in res.aiter_lines():
+                    if not line.startswith("data: "):
+                        continue
+                    if first is None:
+                        first = time.perf_counter() - started
+                    event = json.loads(line[6:])
+                    text += event.get("token", "")
+                    source = event.get("source", source)
+            elapsed = time.perf_counter() - started
+        latencies.append(elapsed)
+        if first is not None:
+            ttfts.append(first)
+        sources[source] = sources.get(source, 0) + 1
+        if source != "semantic_cache":
+            tokens += count_tokens(text)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[one(i, p) for i, p in enumerate(prompts)])
+    wall = time.perf_counter() - started
+    return summarize(latencies, ttfts, sources, tokens, errors, wall)
+
+def summarize(latencies, ttfts, sources, tokens, errors, wall) -> dict:
+    done = len(latencies)
+    result = {
+        "requests": done,
+        "errors": errors,
+        "wall_s": round(wall, 3),
+        "requests_per_s": round(done / wall, 3) if wall else None,
+        "latency": percentiles(latencies),
+        "generated_tokens": tokens,
+        "tokens_per_s": round(tokens / wall, 3) if wall else None,
+        "cache_hit_ratio": round(sources.get("semantic_cache", 0) / done, 4) if done else None,
+        "sources": sources,
+    }
+    if ttfts:
+        result["ttft"] = percentiles(ttfts)
+    return result
+
+# ------------------------------------------------------------ micro-benchmarks
+
+def time_calls(fn: Callable[[], object], iterations: int) -> dict:
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return percentiles(samples)
+
+def micro_benchmarks(app_main, raw_key: str, iterations: int) -> dict:
+    import security
+    from config import config
+
+    mapper, memory, redis_client = app_main.mapper, app_main.memory, app_main.redis_client
+    ctx = mapper.context("What is the capital of Goa?")
+    ctx.vector  # embedding excluded from the search timing
+    results = {
+        "search_vector_db.cache": time_calls(
+            lambda: mapper._search_vector_db(mapper.cache_idx, ctx, top_k=1, threshold=config.CACHE_THRESHOLD), iterations),
+        "retrieval.rag": time_calls(
+            lambda: mapper.get_context(ctx.prompt, ctx=ctx), iterations),
+        "verify_api_key": time_calls(lambda: security.verify_api_key(raw_key, redis_client), iterations),
+        "memory.add_turn": time_calls(
+            lambda: memory.add_turn("bench-memory", "What is Goa known for?", "Beaches, food and heritage."), iterations),
+        "memory.get_history": time_calls(lambda: memory.get_history("bench-memory"), iterations),
+    }
+    results["search_vector_db.redisearch"] = mapper._index_exists(mapper.cache_idx)
+    return results
+
+# ------------------------------------------------------------ main
+
+async def benchmark(args) -> dict:
+    import httpx
+    import main as app_main
+    import security
+    from config import config
+
+    # The harness measures the pipeline, not the rate limiter
+    config.RATE_LIMIT_PRO = config.RATE_LIMIT_FREE = 10 ** 9
+
+    await app_main.startup_event()
+    try:
+        raw_key = security.generate_api_key()
+        app_main.redis_client.hset(f"apikey:{security.hash_api_key(raw_key)}", mapping={
+            "tier": "pro", "created_at": time.time()
+        })
+        headers = {"X-API-Key": raw_key}
+        prompts = load_prompts(args.prompts)
+        count_tokens = app_main.brain.count_tokens
+
+        transport = httpx.ASGITransport(app=app_main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            if args.warmup:
+                await run_chat(client, headers, workload(prompts, args.warmup, args.warmup, args.seed + 1), 1, count_tokens)
+
+            results = {}
+            if "chat" in args.endpoints:
+                print(f"/chat: {args.requests} requests @ concurrency {args.concurrency}...")
+                results["chat"] = await run_chat(
+                    client, headers, workload(prompts, args.requests, args.unique, args.seed), args.concurrency, count_tokens)
+            if "stream" in args.endpoints:
+                print(f"/chat/stream: {args.requests} requests @ concurrency {args.concurrency}...")
+                results["chat_stream"] = await run_stream(
+                    client, headers, workload(prompts, args.requests, args.unique, args.seed + 2), args.concurrency, count_tokens)
+
+        if args.micro:
+            print(f"Micro-benchmarks: {args.micro} iterations each...")
+            results["micro"] = await asyncio.to_thread(micro_benchmarks, app_main, raw_key, args.micro)
+    finally:
+        await app_main.shutdown_event()
+
+    results["meta"] = {
+        "commit": git_commit(),
+        "timestamp": time.time(),
+        "model": config.MODEL_ID,
+        "embedding_model": config.EMBEDDING_MODEL_ID,
+        "redis_backend": config.REDIS_BACKEND,
+        "requests": args.requests,
+        "unique_prompts": args.unique,
+        "concurrency": args.concurrency,
+        "features": {
+            "cache": config.ENABLE_CACHE,
+            "rag": config.ENABLE_RAG,
+            "memory": config.ENABLE_MEMORY,
+            "batching": config.ENABLE_BATCHING,
+            "coalescing": config.ENABLE_COALESCING,
+            "speculative": config.SPECULATIVE_MODE,
+            "cpu_precision": config.CPU_PRECISION,
+        },
+    }
+    return results
+
+def main(argv: List[str]):
+    parser = argparse.ArgumentParser(description="Benchmark the Gonyai request pipeline in-process.")
+    parser.add_argument("--model", help="MODEL_ID to load (a tiny local model keeps runs short)")
+    parser.add_argument("--embedding-model", help="EMBEDDING_MODEL_ID to load")
+    parser.add_argument("--redis-host", help="Use a real Redis Stack instead of in-process fakeredis")
+    parser.add_argument("--redis-port", type=int, default=6380)
+    parser.add_argument("--requests", type=int, default=100, help="Requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--unique", type=int, default=20, help="Distinct prompts in the workload (fewer = more cache hits)")
+    parser.add_argument("--prompts", help="Prompt file (.txt one per line, or .jsonl with 'prompt')")
+    parser.add_argument("--endpoints", nargs="+", default=["chat", "stream"], choices=["chat", "stream"])
+    parser.add_argument("--warmup", type=int, default=2, help="Sequential warmup requests (not measured)")
+    parser.add_argument("--micro", type=int, default=200, help="Iterations per micro-benchmark (0 skips)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="benchmark-results.json")
+    args = parser.parse_args(argv)
+
+    # Config is read at import time: set the environment before importing the app
+    if args.model:
+        os.environ["MODEL_ID"] = args.model
+    if args.embedding_model:
+        os.environ["EMBEDDING_MODEL_ID"] = args.embedding_model
+    if args.redis_host:
+        os.environ["REDIS_HOST"] = args.redis_host
+        os.environ["REDIS_PORT"] = str(args.redis_port)
+    else:
+        os.environ["REDIS_BACKEND"] = "fakeredis"
+    os.environ.setdefault("ADMIN_ROOT_KEY", "benchmark")
+
+    results = asyncio.run(benchmark(args))
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    for name in ("chat", "chat_stream"):
+        if name in results:
+            r = results[name]
+            ttft = f", TTFT p50 {r['ttft']['p50_ms']}ms" if "ttft" in r else ""
+            print(f"{name}: p50 {r['latency'].get('p50_ms')}ms p95 {r['latency'].get('p95_ms')}ms "
+                  f"p99 {r['latency'].get('p99_ms')}ms{ttft} | {r['tokens_per_s']} tok/s | "
+                  f"cache hits {r['cache_hit_ratio']}")
+    print(f"Results written to {args.output}")
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
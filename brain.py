@@ -1,13 +1,145 @@
+import asyncio
+import importlib.util
+import queue
+import threading
+import time
+from collections import Counter
 from threading import Thread
-from typing import Optional, List, Generator
+from typing import Optional, List, Generator, Iterator, AsyncIterator, Callable
 from config import config
+from scheduler import BatchScheduler, GenerationRequest
+from generation import (
+    DEFAULT_MAX_NEW_TOKENS, ContextOverflow, GenerationBudget, StopFilter, cut_at_stop, record_finish,
+)
+from kv_cache import PrefixKVCache
+from hardware import configure_threads, cpu_supports_bf16
+from snapshot import find_snapshot, snapshot_dtype
+from metrics import (
+    SPEC_ACCEPTED_TOKENS, SPEC_DRAFTED_TOKENS, SPEC_ACCEPTANCE_RATE, GENERATION_TOKENS_PER_SECOND,
+    PROMPT_TOKENS, OUTPUT_TOKENS,
+)
 
-try:
+# torch/transformers take seconds to import: they are pulled in by
+# _import_backend() on the first model load, so the app (and its liveness
+# probe) comes up without them
+TRANSFORMERS_AVAILABLE = all(importlib.util.find_spec(name) for name in ("torch", "transformers"))
+torch = None
+_backend_loaded = False
+
+class AsyncTokenQueue:
+    """
+    Bridges tokens from a generation thread into the event loop.
+
+    put() runs on the generation thread and never touches the loop directly
+    beyond call_soon_threadsafe. A bounded semaphore provides backpressure:
+    a consumer `maxsize` tokens behind gets its generation cancelled. A
+    dedicated generate() thread may wait up to `put_timeout` for it first;
+    the batch scheduler passes 0, since waiting there would stall every row
+    of the shared decode batch.
+    """
+    def __init__(self, maxsize: int, put_timeout: float, on_overflow: Optional[Callable[[], None]] = None):
+        self._loop = asyncio.get_running_loop()
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._slots = threading.BoundedSemaphore(maxsize)
+        self.put_timeout = put_timeout
+        self.on_overflow = on_overflow
+        self.closed = False
+
+    def put(self, item: Optional[str]):
+        # None is the end-of-stream marker and must always get through
+        if item is not None:
+            if self.closed:
+                return
+            acquired = self._slots.acquire(timeout=self.put_timeout) if self.put_timeout > 0 else self._slots.acquire(blocking=False)
+            if not acquired:
+                print("Slow stream consumer: cancelling generation.")
+                self.closed = True
+                if self.on_overflow:
+                    self.on_overflow()
+                return
+        try:
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, item)
+        except RuntimeError:
+            # Event loop already shut down
+            self.closed = True
+
+    async def get(self) -> Optional[str]:
+        item = await self._queue.get()
+        if item is not None:
+            self._slots.release()
+        return item
+
+# Per-thread forward-pass counters for the generation running on that thread
+_forward_counts = threading.local()
+
+def model_hash(model_id: str) -> str:
+    """Stable hash of a model id, the cache namespace of its answers."""
+    import hashlib
+    return hashlib.md5(model_id.encode()).hexdigest()[:8]
+
+
+def _count_forwards(role: str):
+    def hook(module, args, output):
+        counts = getattr(_forward_counts, "counts", None)
+        if counts is not None:
+            counts[role] += 1
+    return hook
+
+def _import_backend():
+    global torch, AutoModelForCausalLM, AutoTokenizer, BitsAndBytesConfig, StoppingCriteriaList
+    global _SinkStreamer, _BudgetCriteria, _backend_loaded
+    # Not `torch is not None`: torch binds before transformers is imported, and a
+    # failed transformers import must be retried, not skipped, on the next load
+    if _backend_loaded:
+        return
     import torch
-    from transformers import AutoModelForCausalLM, AutoTokenizer, BitsAndBytesConfig, TextIteratorStreamer
-    TRANSFORMERS_AVAILABLE = True
-except ImportError:
-    TRANSFORMERS_AVAILABLE = False
+    from transformers import (
+        AutoModelForCausalLM, AutoTokenizer, BitsAndBytesConfig,
+        TextStreamer, StoppingCriteria, StoppingCriteriaList,
+    )
+
+    class _SinkStreamer(TextStreamer):
+        """TextStreamer that forwards finalized text to a sink with a put() method."""
+        def __init__(self, tokenizer, sink):
+            super().__init__(tokenizer, skip_prompt=True, skip_special_tokens=True)
+            self.sink = sink
+
+        def on_finalized_text(self, text: str, stream_end: bool = False):
+            if text:
+                self.sink.put(text)
+
+    class _BudgetCriteria(StoppingCriteria):
+        """Stops generate() on cancel, past the request's deadline or once a stop sequence is out."""
+        def __init__(self, request: GenerationRequest, tokenizer, prompt_length: int):
+            self.request = request
+            self.tokenizer = tokenizer
+            self.prompt_length = prompt_length
+
+        def __call__(self, input_ids, scores, **kwargs):
+            request = self.request
+            done = request.cancelled.is_set() or request.expired()
+            if not done and request.stop:
+                text = self.tokenizer.decode(input_ids[0, self.prompt_length:], skip_special_tokens=True)
+                done = cut_at_stop(text, request.stop)[1]
+            return torch.full((input_ids.shape[0],), done, dtype=torch.bool, device=input_ids.device)
+
+    _backend_loaded = True
+
+class ModelUnavailable(Exception):
+    """The model is not loaded (or was unloaded): callers answer 503, never an error string."""
+
+
+def _oldest_turn(messages: list) -> tuple:
+    """
+    (start, end) of the turn to drop when history + prompt (the last message)
+    overflow: a user message with its reply, so roles keep alternating. The
+    first turn goes last, since ConversationMemory folds the summary of
+    older turns into its user message.
+    """
+    start = 2 if len(messages) > 3 else 0
+    paired = start + 1 < len(messages) - 1 and messages[start + 1]["role"] == "assistant"
+    return start, start + (2 if paired else 1)
+
 
 class ModelEngine:
     def __init__(self, model_id: Optional[str] = None):
@@ -15,13 +147,22 @@ class ModelEngine:
         self.model = None
         self.tokenizer = None
         self.device = "cpu"
-        self.dtype = torch.float32
+        self.dtype = None  # set by load_model, once torch is imported
         self.inference_count = 0
+        self.scheduler: Optional[BatchScheduler] = None
+        self.draft_model = None
+        self.draft_tokenizer = None
+        self.speculative_mode = config.SPECULATIVE_MODE
+        self.precision = "fp32"
+        # Generations outside the scheduler's queue/batch (direct generate(), encoding before submit)
+        self._in_flight = 0
+        self._in_flight_lock = threading.Lock()
 
     def load_model(self):
         if not TRANSFORMERS_AVAILABLE:
             print("WARNING: Transformers/Torch not installed. Running in MOCK mode.")
             return
+        _import_backend()
 
         # Hardware Auto-Detection
         if config.DEVICE == "auto":
@@ -37,12 +178,22 @@ class ModelEngine:
                 self.dtype = torch.bfloat16
             else:
                 self.dtype = torch.float16
+            self.precision = str(self.dtype).replace("torch.", "")
         else:
             self.dtype = torch.float32
+            self.precision = self._cpu_precision()
+            if self.precision == "bf16":
+                self.dtype = torch.bfloat16
+            intra_op, inter_op = configure_threads(config.TORCH_NUM_THREADS, config.TORCH_INTEROP_THREADS)
+            print(f"CPU mode: {self.precision}, {intra_op} intra-op / {inter_op} inter-op threads.")
 
-        print(f"Loading S-Tier Engine: {self.model_id} on {self.device}...")
+        # A local preconverted snapshot (see snapshot.py) skips the hub checkpoint parse
+        source = find_snapshot(self.model_id) or self.model_id
+        print(f"Loading S-Tier Engine: {self.model_id} on {self.device}{' (snapshot)' if source != self.model_id else ''}...")
+        if source != self.model_id and snapshot_dtype(source) != str(self.dtype).replace("torch.", ""):
+            print(f"WARNING: Snapshot is {snapshot_dtype(source)} but serving {self.dtype}: weights are converted on load.")
         try:
-            self.tokenizer = AutoTokenizer.from_pretrained(self.model_id)
+            self.tokenizer = AutoTokenizer.from_pretrained(source)
             
             load_kwargs = {
                 "trust_remote_code": True,
@@ -65,91 +216,491 @@ class ModelEngine:
                     load_kwargs["load_in_8bit"] = True
             
             self.model = AutoModelForCausalLM.from_pretrained(
-                self.model_id,
+                source,
                 **load_kwargs
             )
             
             if self.device != "cuda" and not (config.LOAD_IN_4BIT or config.LOAD_IN_8BIT):
                 self.model = self.model.to(self.device)
+
+            if self.precision == "int8":
+                print("Applying dynamic INT8 quantization to Linear layers...")
+                self.model = torch.ao.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8)
+
+            if config.TORCH_COMPILE:
+                print(f"Compiling model forward (mode={config.TORCH_COMPILE_MODE})...")
+                # dynamic=True: batch size and sequence length change every step
+                self.model.forward = torch.compile(self.model.forward, mode=config.TORCH_COMPILE_MODE, dynamic=True)
                 
             print(f"Model {self.model_id} loaded successfully.")
+
+            if self.speculative_mode != "off":
+                self._load_speculative()
+
+            if config.ENABLE_BATCHING and self.speculative_mode != "off":
+                # Assisted generation verifies one sequence at a time
+                print("Speculative decoding enabled: continuous batching is disabled.")
+            elif config.ENABLE_BATCHING:
+                self.scheduler = BatchScheduler(
+                    self,
+                    max_batch_size=config.BATCH_MAX_SIZE,
+                    max_wait_ms=config.BATCH_MAX_WAIT_MS,
+                    max_queue_depth=config.BATCH_QUEUE_DEPTH,
+                    prefix_cache=PrefixKVCache(
+                        max_bytes=config.KV_CACHE_MAX_MB * 1024 * 1024,
+                        min_prefix=config.KV_CACHE_MIN_PREFIX,
+                    ) if config.ENABLE_KV_CACHE else None,
+                )
+                self.scheduler.start()
+                print(f"Continuous batching enabled (max batch {config.BATCH_MAX_SIZE}).")
+
+            if config.WARMUP_ON_START:
+                self._warmup()
         except Exception as e:
             print(f"Error loading model: {e}")
 
+    @staticmethod
+    def _cpu_precision() -> str:
+        precision = config.CPU_PRECISION
+        if precision == "auto":
+            return "bf16" if cpu_supports_bf16() else "fp32"
+        if precision == "bf16" and not cpu_supports_bf16():
+            print("WARNING: CPU_PRECISION=bf16 but this CPU has no native BF16; expect emulation overhead.")
+        if precision not in ("fp32", "bf16", "int8"):
+            print(f"WARNING: Unknown CPU_PRECISION={precision}. Using fp32.")
+            return "fp32"
+        return precision
+
+    def _warmup(self):
+        """
+        One short generation through the real serving path, so kernel
+        selection, allocator growth and torch.compile happen before the
+        pod reports ready rather than on the first user request.
+        """
+        started = time.time()
+        try:
+            inputs = self._encode_chat("Hello", [])
+            if self.scheduler:
+                request = self.scheduler.submit(GenerationRequest(
+                    inputs["input_ids"][0].tolist(),
+                    max_new_tokens=config.WARMUP_TOKENS,
+                ))
+                request.future.result()
+            else:
+                self._generate(
+                    **inputs,
+                    max_new_tokens=config.WARMUP_TOKENS,
+                    do_sample=False,
+                    pad_token_id=self.tokenizer.eos_token_id
+                )
+            print(f"Warmup generation done in {time.time() - started:.1f}s.")
+        except Exception as e:
+            print(f"Warmup generation failed: {e}")
+
+    def _load_speculative(self):
+        if self.speculative_mode == "draft":
+            if not config.DRAFT_MODEL_ID:
+                print("WARNING: SPECULATIVE_MODE=draft without DRAFT_MODEL_ID. Speculative decoding disabled.")
+                self.speculative_mode = "off"
+                return
+            print(f"Loading draft model: {config.DRAFT_MODEL_ID}...")
+            draft_source = find_snapshot(config.DRAFT_MODEL_ID) or config.DRAFT_MODEL_ID
+            self.draft_model = AutoModelForCausalLM.from_pretrained(
+                draft_source, trust_remote_code=True, torch_dtype=self.dtype,
+            ).to(self.device)
+            draft_tokenizer = AutoTokenizer.from_pretrained(draft_source)
+            # Same vocab: token ids are exchanged directly. Otherwise transformers
+            # re-tokenizes candidates, which needs both tokenizers.
+            if draft_tokenizer.get_vocab() != self.tokenizer.get_vocab():
+                self.draft_tokenizer = draft_tokenizer
+            self.draft_model.register_forward_hook(_count_forwards("draft"))
+        elif self.speculative_mode != "prompt_lookup":
+            print(f"WARNING: Unknown SPECULATIVE_MODE={self.speculative_mode}. Speculative decoding disabled.")
+            self.speculative_mode = "off"
+            return
+        self.model.register_forward_hook(_count_forwards("target"))
+        print(f"Speculative decoding: {self.speculative_mode}.")
+
+    def _speculative_kwargs(self) -> dict:
+        if self.speculative_mode == "draft":
+            kwargs = {"assistant_model": self.draft_model, "num_assistant_tokens": config.SPECULATIVE_NUM_TOKENS}
+            if self.draft_tokenizer is not None:
+                kwargs.update(tokenizer=self.tokenizer, assistant_tokenizer=self.draft_tokenizer)
+            return kwargs
+        if self.speculative_mode == "prompt_lookup":
+            return {"prompt_lookup_num_tokens": config.PROMPT_LOOKUP_NUM_TOKENS}
+        return {}
+
+    def _generate(self, **generation_kwargs):
+        """model.generate() with the configured speculative mode, reporting acceptance and speed."""
+        generation_kwargs.update(self._speculative_kwargs())
+        _forward_counts.counts = counts = Counter()
+        started = time.time()
+        try:
+            with torch.inference_mode():
+                outputs = self.model.generate(**generation_kwargs)
+        finally:
+            _forward_counts.counts = None
+
+        new_tokens = outputs.shape[-1] - generation_kwargs["input_ids"].shape[-1]
+        OUTPUT_TOKENS.inc(new_tokens)
+        elapsed = time.time() - started
+        if new_tokens > 0 and elapsed > 0:
+            GENERATION_TOKENS_PER_SECOND.labels(mode=self.speculative_mode).observe(new_tokens / elapsed)
+        if self.speculative_mode != "off" and counts["target"]:
+            # Every verification pass yields one token of its own; the rest came from drafts
+            accepted = max(0, new_tokens - counts["target"])
+            # Prompt lookup proposes up to N tokens per pass; draft models one per draft forward
+            drafted = counts["draft"] if self.speculative_mode == "draft" else counts["target"] * config.PROMPT_LOOKUP_NUM_TOKENS
+            SPEC_ACCEPTED_TOKENS.labels(mode=self.speculative_mode).inc(accepted)
+            SPEC_DRAFTED_TOKENS.labels(mode=self.speculative_mode).inc(drafted)
+            if drafted:
+                SPEC_ACCEPTANCE_RATE.labels(mode=self.speculative_mode).observe(min(1.0, accepted / drafted))
+        return outputs
+
     @property
     def ready(self) -> bool:
         return self.model is not None
 
-    def get_model_hash(self) -> str:
-        """Returns a stable hash of the model ID for cache versioning."""
-        import hashlib
-        return hashlib.md5(self.model_id.encode()).hexdigest()[:8]
+    @property
+    def idle(self) -> bool:
+        """Nothing generating: safe for the registry to unload."""
+        if self._in_flight:
+            return False
+        return self.scheduler is None or (self.scheduler.depth == 0 and self.scheduler.active == 0)
 
-    def predict(self, prompt: str, history: list = None) -> str:
-        self.inference_count += 1
-        if not TRANSFORMERS_AVAILABLE or not self.model:
-            return f"Error: Model not loaded. Ensure heavy dependencies are installed."
+    def _enter(self):
+        with self._in_flight_lock:
+            self._in_flight += 1
 
-        messages = history if history else []
-        messages.append({"role": "user", "content": prompt})
+    def acquire(self) -> bool:
+        """
+        Keeps the engine loaded (not idle) until release(), e.g. for a whole
+        request routed to it. False if it is not loaded.
+        """
+        with self._in_flight_lock:
+            if self.model is None:
+                return False
+            self._in_flight += 1
+            return True
 
-        inputs = self.tokenizer.apply_chat_template(
-            messages,
-            tokenize=True,
-            add_generation_prompt=True,
-            return_tensors="pt",
-            return_dict=True
-        ).to(self.device)
-
-        with torch.inference_mode():
-            outputs = self.model.generate(
-                **inputs,
-                max_new_tokens=256,
-                temperature=0.3,
-                repetition_penalty=1.2,
-                do_sample=True,
-                eos_token_id=self.tokenizer.eos_token_id,
-                pad_token_id=self.tokenizer.eos_token_id
-            )
+    def release(self):
+        self._leave()
 
-        generated_tokens = outputs[0][inputs["input_ids"].shape[-1]:]
-        response = self.tokenizer.decode(generated_tokens, skip_special_tokens=True).strip()
-        
-        return response
+    def unload_if_idle(self) -> bool:
+        """unload() unless in use; atomic with acquire(), so a routed request never loses its model."""
+        with self._in_flight_lock:
+            if not self.idle:
+                return False
+            self.unload()
+            return True
 
-    def stream_predict(self, prompt: str, history: list = None) -> Generator[str, None, None]:
-        """Real-time token streaming for Gonyai Production UX."""
-        self.inference_count += 1
+    def _require_model(self):
         if not TRANSFORMERS_AVAILABLE or not self.model:
-            yield "Error: Model not loaded."
-            return
+            raise ModelUnavailable(f"Model {self.model_id} is not loaded")
 
-        messages = history if history else []
+    def _leave(self):
+        with self._in_flight_lock:
+            self._in_flight -= 1
+
+    @property
+    def capacity(self) -> int:
+        """Sequences decoded at once: a full scheduler batch, else one generation at a time."""
+        return self.scheduler.max_batch_size if self.scheduler else 1
+
+    @property
+    def context_window(self) -> int:
+        """Tokens the model attends over: prompt and answer together."""
+        limits = [
+            getattr(getattr(self.model, "config", None), "max_position_embeddings", None),
+            # Tokenizers without a known limit report a huge sentinel
+            getattr(self.tokenizer, "model_max_length", None),
+        ]
+        limits = [n for n in limits if isinstance(n, int) and 0 < n < 1_000_000]
+        return min(limits) if limits else 2048
+
+    @property
+    def memory_bytes(self) -> int:
+        """Weights + buffers held by this engine (draft model included)."""
+        total = 0
+        for model in (self.model, self.draft_model):
+            if model is not None:
+                total += sum(t.numel() * t.element_size() for t in model.parameters())
+                total += sum(t.numel() * t.element_size() for t in model.buffers())
+        return total
+
+    def unload(self):
+        """Releases the weights so the registry can load another model in their place."""
+        if self.scheduler:
+            self.scheduler.stop()
+            self.scheduler = None
+        self.model = None
+        self.draft_model = None
+        import gc
+        gc.collect()
+        if TRANSFORMERS_AVAILABLE and self.device == "cuda":
+            torch.cuda.empty_cache()
+        print(f"Model {self.model_id} unloaded.")
+
+    def get_model_hash(self) -> str:
+        """Returns a stable hash of the model ID for cache versioning."""
+        return model_hash(self.model_id)
+
+    def count_tokens(self, text: str) -> int:
+        if self.tokenizer is None:
+            return max(1, len(text) // 4)
+        return len(self.tokenizer.encode(text, add_special_tokens=False))
+
+    def _encode_chat(self, prompt: str, history: list = None, reserve: int = 0):
+        """Chat-templated prompt. Older turns are dropped until `reserve` answer tokens fit the context window."""
+        messages = list(history or [])
         messages.append({"role": "user", "content": prompt})
 
-        inputs = self.tokenizer.apply_chat_template(
-            messages,
-            tokenize=True,
-            add_generation_prompt=True,
-            return_tensors="pt",
-            return_dict=True
-        ).to(self.device)
-
-        streamer = TextIteratorStreamer(self.tokenizer, timeout=10.0, skip_prompt=True, skip_special_tokens=True)
-        
-        generation_kwargs = dict(
+        while True:
+            inputs = self.tokenizer.apply_chat_template(
+                messages,
+                tokenize=True,
+                add_generation_prompt=True,
+                return_tensors="pt",
+                return_dict=True
+            )
+            if len(messages) == 1 or inputs["input_ids"].shape[-1] + reserve <= self.context_window:
+                break
+            del messages[slice(*_oldest_turn(messages))]
+        inputs = inputs.to(self.device)
+        PROMPT_TOKENS.inc(inputs["input_ids"].shape[-1])
+        return inputs
+
+    def _prepare(self, prompt: str, history: list, budget: Optional[GenerationBudget], session_id: Optional[str], stream=None):
+        """Encoded prompt + a request sized to the budget and to what the context window has left."""
+        budget = budget or GenerationBudget()
+        wanted = budget.max_new_tokens or DEFAULT_MAX_NEW_TOKENS
+        inputs = self._encode_chat(prompt, history, reserve=wanted)
+        prompt_length = inputs["input_ids"].shape[-1]
+        room = self.context_window - prompt_length
+        if room <= 0:
+            raise ContextOverflow(f"Prompt is {prompt_length} tokens; the model's context window is {self.context_window}")
+        request = GenerationRequest(
+            inputs["input_ids"][0].tolist(),
+            max_new_tokens=min(wanted, room),
+            stream=stream,
+            session_id=session_id,
+            stop=budget.stop,
+            deadline=budget.deadline,
+        )
+        return inputs, request
+
+    def _generation_kwargs(self, inputs, request: GenerationRequest) -> dict:
+        return dict(
             **inputs,
-            streamer=streamer,
-            max_new_tokens=512,
+            stopping_criteria=StoppingCriteriaList([_BudgetCriteria(request, self.tokenizer, inputs["input_ids"].shape[-1])]),
+            max_new_tokens=request.max_new_tokens,
             temperature=0.3,
-            do_sample=True,
             repetition_penalty=1.2,
+            do_sample=True,
             eos_token_id=self.tokenizer.eos_token_id,
             pad_token_id=self.tokenizer.eos_token_id
         )
 
-        thread = Thread(target=self.model.generate, kwargs=generation_kwargs)
-        thread.start()
+    def _settle(self, request: GenerationRequest, new_tokens, delivered: Optional[str] = None) -> str:
+        """Answer text of a generate() run, with why it stopped (the scheduler does this for its rows)."""
+        text, stopped = cut_at_stop(self.tokenizer.decode(new_tokens, skip_special_tokens=True), request.stop)
+        if request.cancelled.is_set():
+            request.finish_reason = "cancelled"
+        elif stopped:
+            request.finish_reason = "stop_sequence"
+        elif len(new_tokens) >= request.max_new_tokens:
+            request.finish_reason = "length"
+        elif request.expired():
+            request.finish_reason = "deadline"
+        else:
+            request.finish_reason = "eos"
+        if delivered is None:
+            delivered = "" if request.cancelled.is_set() else text
+        record_finish(request.finish_reason, self.count_tokens(delivered) if delivered else 0)
+        return text.strip()
+
+    @staticmethod
+    def _report(request: GenerationRequest, budget: Optional[GenerationBudget]):
+        if budget is not None:
+            budget.finish_reason = request.finish_reason or "cancelled"
+
+    def predict(self, prompt: str, history: list = None, session_id: Optional[str] = None,
+                budget: Optional[GenerationBudget] = None) -> str:
+        self.inference_count += 1
+        self._require_model()
+
+        self._enter()
+        try:
+            inputs, request = self._prepare(prompt, history, budget, session_id)
+        except BaseException:
+            self._leave()
+            raise
+        if self.scheduler:
+            try:
+                self.scheduler.submit(request)
+            finally:
+                self._leave()
+            try:
+                return request.future.result()
+            finally:
+                self._report(request, budget)
+        return self._generate_direct(inputs, request, budget)
+
+    def _generate_direct(self, inputs, request: GenerationRequest, budget: Optional[GenerationBudget]) -> str:
+        """generate() without the scheduler. Takes over the caller's _enter()."""
+        try:
+            outputs = self._generate(**self._generation_kwargs(inputs, request))
+            return self._settle(request, outputs[0][inputs["input_ids"].shape[-1]:])
+        finally:
+            self._report(request, budget)
+            self._leave()
+
+    async def apredict(self, prompt: str, history: list = None, session_id: Optional[str] = None,
+                       budget: Optional[GenerationBudget] = None) -> str:
+        """
+        Non-blocking predict: awaits the scheduler instead of parking a
+        threadpool worker. Cancelling the call cancels the generation.
+        """
+        self.inference_count += 1
+        self._require_model()
+
+        self._enter()
+        try:
+            inputs, request = self._prepare(prompt, history, budget, session_id)
+        except BaseException:
+            self._leave()
+            raise
+        if not self.scheduler:
+            # Shielded: the thread always runs and releases the engine; the flag stops generate() between tokens
+            work = asyncio.ensure_future(asyncio.to_thread(self._generate_direct, inputs, request, budget))
+            try:
+                return await asyncio.shield(work)
+            except asyncio.CancelledError:
+                request.cancel()
+                raise
+
+        try:
+            self.scheduler.submit(request)
+        finally:
+            # Queued: the scheduler's depth keeps the engine busy from here
+            self._leave()
+        try:
+            return await asyncio.wrap_future(request.future)
+        except asyncio.CancelledError:
+            request.cancel()
+            raise
+        finally:
+            self._report(request, budget)
+
+    def stream_predict(self, prompt: str, history: list = None, session_id: Optional[str] = None,
+                       budget: Optional[GenerationBudget] = None) -> Iterator[str]:
+        """Real-time token streaming for Gonyai Production UX.
+
+        Submission happens eagerly so a full queue is reported to the caller
+        before the response starts, not halfway through the stream.
+        """
+        self.inference_count += 1
+        self._require_model()
+
+        self._enter()
+        try:
+            inputs, request = self._prepare(prompt, history, budget, session_id, stream=queue.Queue())
+        except BaseException:
+            self._leave()
+            raise
+        self._submit_stream(inputs, request)
+        return self._drain(request, budget)
+
+    def astream_predict(self, prompt: str, history: list = None, session_id: Optional[str] = None,
+                        budget: Optional[GenerationBudget] = None) -> AsyncIterator[str]:
+        """
+        Event-loop friendly streaming: tokens arrive through an asyncio queue,
+        so the loop is free between tokens. Must be called from a running loop.
+        Closing the returned iterator cancels the generation.
+        """
+        self.inference_count += 1
+        self._require_model()
+
+        self._enter()
+        try:
+            inputs, request = self._prepare(prompt, history, budget, session_id)
+        except BaseException:
+            self._leave()
+            raise
+        request.stream = AsyncTokenQueue(
+            maxsize=config.STREAM_BUFFER_SIZE,
+            put_timeout=0 if self.scheduler else config.STREAM_SLOW_CLIENT_TIMEOUT,
+            on_overflow=request.cancel,
+        )
+        self._submit_stream(inputs, request)
+        return self._adrain(request, budget)
+
+    async def aopen_stream(self, prompt: str, history: list = None, session_id: Optional[str] = None,
+                           budget: Optional[GenerationBudget] = None) -> AsyncIterator[str]:
+        """astream_predict with RemoteEngine's signature (its streams are accepted over a socket)."""
+        return self.astream_predict(prompt, history, session_id=session_id, budget=budget)
+
+    def _submit_stream(self, inputs, request: GenerationRequest):
+        """Takes over the caller's _enter(): released once queued, or when the generate thread ends."""
+        if self.scheduler:
+            try:
+                self.scheduler.submit(request)
+            finally:
+                self._leave()
+            return
+
+        # Stop sequences must never reach the client, not even their first characters
+        sink = StopFilter(request.stream, request.stop)
+        generation_kwargs = self._generation_kwargs(inputs, request)
+        generation_kwargs["streamer"] = _SinkStreamer(self.tokenizer, sink)
+
+        thread = Thread(target=self._generate_into, args=(request, generation_kwargs, sink), daemon=True)
+        try:
+            thread.start()
+        except BaseException:
+            self._leave()
+            raise
+
+    def _generate_into(self, request: GenerationRequest, generation_kwargs: dict, sink: StopFilter):
+        try:
+            outputs = self._generate(**generation_kwargs)
+            if not request.cancelled.is_set():
+                sink.flush()
+            self._settle(request, outputs[0][generation_kwargs["input_ids"].shape[-1]:], delivered=sink.sent)
+            request.future.set_result(None)
+        except Exception as e:
+            request.future.set_exception(e)
+        finally:
+            request.stream.put(None)
+            self._leave()
+
+    @staticmethod
+    def _drain(request: GenerationRequest, budget: Optional[GenerationBudget] = None) -> Generator[str, None, None]:
+        try:
+            for new_text in iter(request.stream.get, None):
+                yield new_text
+        finally:
+            # Consumer went away early: free the batch slot
+            request.cancel()
+            ModelEngine._report(request, budget)
+        # Surface generation errors to the caller
+        request.future.result()
 
-        for new_text in streamer:
-            yield new_text
+    @staticmethod
+    async def _adrain(request: GenerationRequest, budget: Optional[GenerationBudget] = None) -> AsyncIterator[str]:
+        try:
+            while True:
+                new_text = await request.stream.get()
+                if new_text is None:
+                    break
+                yield new_text
+            overflowed = request.stream.closed
+        finally:
+            request.stream.closed = True
+            request.cancel()
+            ModelEngine._report(request, budget)
+        if request.future.done() and request.future.exception():
+            raise request.future.exception()
+        if overflowed:
+            raise ConnectionError("Stream consumer too slow; generation cancelled")
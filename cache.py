@@ -1,116 +1,709 @@
+import asyncio
 import numpy as np
 import hashlib
+import threading
+import time
+from collections import OrderedDict
 from redis import Redis
-from typing import Optional
+from redis.asyncio import Redis as AsyncRedis
+from typing import Callable, Iterable, List, Optional, Tuple
 from config import config
+from embeddings import EmbeddingService
+from retrieval import Retriever
+import vector_index
+from metrics import CACHE_STATS, CACHE_TIER_HITS
+from tracing import span
 
 INDEX_NAME = "coconut_idx"
 CACHE_INDEX_NAME = "coconut_cache_idx"
 
+class EmbeddingContext:
+    """
+    Per-request embedding holder: the prompt is encoded at most once and the
+    same vector is shared by cache lookup, RAG and cache store.
+    """
+    def __init__(self, mapper: "SemanticMapper", prompt: str):
+        self.mapper = mapper
+        self.prompt = prompt
+        self._vector: Optional[bytes] = None
+
+    @property
+    def vector(self) -> bytes:
+        if self._vector is None:
+            with span("embed"):
+                self._vector = self.mapper.embed(self.prompt)
+        return self._vector
+
+    async def avector(self) -> bytes:
+        """Same vector, awaited from the embedding batcher so the event loop keeps running."""
+        if self._vector is None:
+            with span("embed"):
+                self._vector = await self.mapper.aembed(self.prompt)
+        return self._vector
+
+def normalize_prompt(prompt: str) -> str:
+    """Case and whitespace insensitive form used for exact-match keys."""
+    return " ".join(prompt.lower().split())
+
+def prompt_hash(prompt: str) -> str:
+    return hashlib.sha1(normalize_prompt(prompt).encode()).hexdigest()
+
+class LocalSemanticCache:
+    """
+    In-process tier in front of the Redis semantic cache.
+
+    - exact: normalized-prompt hash -> slot, no embedding needed
+    - near:  unit vectors in a preallocated NumPy matrix, searched with one
+             matrix-vector product
+
+    Slots are recycled LRU, entries expire after `ttl`, and everything is
+    scoped to a namespace (the model-versioned cache index): switching
+    namespace drops the lot, exactly like pointing at a new cache_idx.
+    """
+    def __init__(self, namespace: str, max_entries: int, ttl: float):
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._slots: "OrderedDict[str, int]" = OrderedDict()  # prompt hash -> slot, LRU order
+            self._keys = [None] * self.max_entries
+            self._responses = [None] * self.max_entries
+            self._expires = np.zeros(self.max_entries, dtype=np.float64)
+            self._searchable = np.zeros(self.max_entries, dtype=bool)
+            self._matrix: Optional[np.ndarray] = None  # allocated on first vector
+
+    def set_namespace(self, namespace: str):
+        if namespace != self.namespace:
+            self.namespace = namespace
+            self.clear()
+
+    def get_exact(self, prompt: str) -> Optional[str]:
+        key = prompt_hash(prompt)
+        with self._lock:
+            slot = self._slots.get(key)
+            if slot is None:
+                return None
+            if self._expires[slot] < time.time():
+                self._release(key)
+                return None
+            self._slots.move_to_end(key)
+            return self._responses[slot]
+
+    def get_similar(self, vector: bytes, threshold: float) -> Optional[str]:
+        query = self._unit(vector)
+        with self._lock:
+            if self._matrix is None or not self._slots or query.shape[0] != self._matrix.shape[1]:
+                return None
+            scores = self._matrix @ query
+            live = self._searchable & (self._expires >= time.time())
+            scores = np.where(live, scores, -np.inf)
+            slot = int(np.argmax(scores))
+            if scores[slot] < threshold:
+                return None
+            self._slots.move_to_end(self._keys[slot])
+            return self._responses[slot]
+
+    def put(self, prompt: str, response: str, vector: Optional[bytes] = None):
+        key = prompt_hash(prompt)
+        unit = self._unit(vector) if vector is not None else None
+        with self._lock:
+            slot = self._slots.get(key)
+            if slot is None:
+                if len(self._slots) < self.max_entries:
+                    slot = len(self._slots)
+                else:
+                    _, slot = self._slots.popitem(last=False)
+                    self._keys[slot] = None
+            self._slots[key] = slot
+            self._slots.move_to_end(key)
+            self._keys[slot] = key
+            self._responses[slot] = response
+            self._expires[slot] = time.time() + self.ttl
+            self._searchable[slot] = False
+            if unit is not None:
+                if self._matrix is None:
+                    self._matrix = np.zeros((self.max_entries, unit.shape[0]), dtype=np.float32)
+                if unit.shape[0] == self._matrix.shape[1]:
+                    self._matrix[slot] = unit
+                    self._searchable[slot] = True
+
+    def _release(self, key: str):
+        slot = self._slots.pop(key)
+        self._keys[slot] = None
+        self._responses[slot] = None
+        self._searchable[slot] = False
+        self._expires[slot] = 0
+        # Keep slots dense: move the last used slot into the hole
+        last = len(self._slots)
+        if slot != last:
+            moved = self._keys[last]
+            self._slots[moved] = slot
+            self._keys[slot], self._keys[last] = moved, None
+            self._responses[slot], self._responses[last] = self._responses[last], None
+            self._expires[slot], self._expires[last] = self._expires[last], 0
+            self._searchable[slot], self._searchable[last] = self._searchable[last], False
+            if self._matrix is not None:
+                self._matrix[slot] = self._matrix[last]
+
+    @staticmethod
+    def _unit(vector: bytes) -> np.ndarray:
+        v = np.frombuffer(vector, dtype=np.float32)
+        norm = np.linalg.norm(v)
+        return v / norm if norm > 0 else v
+
 class SemanticMapper:
-    def __init__(self, redis_client: Redis, model_hash: str = "v1"):
+    def __init__(
+        self,
+        redis_client: Redis,
+        model_hash: str = "v1",
+        async_client: Optional[AsyncRedis] = None,
+        embedder: Optional[EmbeddingService] = None,
+        count_tokens: Optional[Callable[[str], int]] = None,
+        reranker=None,
+    ):
         self.redis = redis_client
-        self._model = None
+        self.aredis = async_client
+        self.embedder = embedder or EmbeddingService()
+        self.retriever = Retriever(self, INDEX_NAME, count_tokens=count_tokens, reranker=reranker)
         self.hits = 0
+        self.model_hash = model_hash
         self.cache_idx = f"cache_idx_{model_hash}"
+        self.key_prefix = vector_index.cache_prefix(model_hash)
+        # Tier 1: in-process exact + vector cache, namespaced like cache_idx
+        self.local = LocalSemanticCache(self.cache_idx, config.LOCAL_CACHE_SIZE, config.LOCAL_CACHE_TTL) \
+            if config.LOCAL_CACHE_SIZE > 0 else None
+        # LRU of prompt hash -> FLOAT32 vector bytes
+        self._embeddings: "OrderedDict[str, bytes]" = OrderedDict()
+        self._embeddings_lock = threading.Lock()
+        # Indexes confirmed via FT.INFO, so the hot path skips the round trip
+        self._known_indexes = set()
+
+    def context(self, prompt: str) -> EmbeddingContext:
+        return EmbeddingContext(self, prompt)
 
     @property
-    def model(self):
-        if self._model is None:
-            from sentence_transformers import SentenceTransformer
-            print(f"Loading S-Tier Embedding Model: {config.EMBEDDING_MODEL_ID}...")
-            self._model = SentenceTransformer(config.EMBEDDING_MODEL_ID)
-        return self._model
-
-    def get_context(self, prompt: str, top_k: int = 2) -> Optional[str]:
+    def usage_key(self) -> str:
+        return self.usage_key_for(self.model_hash)
+
+    @staticmethod
+    def usage_key_for(model_hash: str) -> str:
+        # Sorted set of cache keys scored for eviction; kept outside the
+        # "cache:" prefix so the vector index never sees it
+        return f"cachemeta:cache_idx_{model_hash}:usage"
+
+    def set_model_hash(self, model_hash: str):
+        """Points the cache at a new model version; the local tier is invalidated with it."""
+        self.model_hash = model_hash
+        self.cache_idx = f"cache_idx_{model_hash}"
+        self.key_prefix = vector_index.cache_prefix(model_hash)
+        if self.local:
+            self.local.set_namespace(self.cache_idx)
+
+    def embed(self, prompt: str) -> bytes:
+        """Encodes a prompt to FLOAT32 bytes, served from the LRU when possible."""
+        key = hashlib.sha1(prompt.encode()).hexdigest()
+        vector = self._remembered(key)
+        if vector is None:
+            vector = self._remember(key, self.embedder.encode_one(prompt))
+        return vector
+
+    async def aembed(self, prompt: str) -> bytes:
+        key = hashlib.sha1(prompt.encode()).hexdigest()
+        vector = self._remembered(key)
+        if vector is None:
+            vector = self._remember(key, await self.embedder.aencode_one(prompt))
+        return vector
+
+    def _remembered(self, key: str) -> Optional[bytes]:
+        with self._embeddings_lock:
+            vector = self._embeddings.get(key)
+            if vector is not None:
+                self._embeddings.move_to_end(key)
+            return vector
+
+    def _remember(self, key: str, vector: np.ndarray) -> bytes:
+        vector = vector.astype(np.float32).tobytes()
+        with self._embeddings_lock:
+            self._embeddings[key] = vector
+            while len(self._embeddings) > config.EMBEDDING_CACHE_SIZE:
+                self._embeddings.popitem(last=False)
+        return vector
+
+    def get_context(self, prompt: str, top_k: Optional[int] = None, ctx: Optional[EmbeddingContext] = None) -> Optional[str]:
         """
-        RAG: Retrieves relevant snippets to GROUND the model.
+        RAG: Retrieves relevant snippets to GROUND the model (hybrid search,
+        packed into RAG_CONTEXT_TOKENS).
         """
         if not config.ENABLE_RAG or not self.redis:
             return None
         
-        return self._search_vector_db(INDEX_NAME, prompt, top_k)
+        return self.retriever.retrieve(prompt, ctx or self.context(prompt), top_k)
 
-    def get_cached_response(self, prompt: str) -> Optional[str]:
+    def get_cached_response(self, prompt: str, ctx: Optional[EmbeddingContext] = None) -> Optional[str]:
         """
         Semantic Cache: Retrieves a PREVIOUS ANSWER to bypass inference.
         """
-        if not config.ENABLE_CACHE or not self.redis:
+        if not config.ENABLE_CACHE:
+            return None
+
+        ctx = ctx or self.context(prompt)
+        if self.local:
+            # Exact repeats never pay for an embedding
+            response = self._local_exact(prompt)
+            if response is None:
+                response = self._local_similar(ctx.vector)
+            if response is not None:
+                return response
+        if not self.redis:
             return None
         
-        return self._search_vector_db(self.cache_idx, prompt, top_k=1, threshold=config.CACHE_THRESHOLD)
+        key, response = self._knn_search(self.cache_idx, ctx, top_k=1, threshold=config.CACHE_THRESHOLD)
+        if key and response is not None:
+            pipe = self.redis.pipeline(transaction=False)
+            self._queue_touch(pipe, key)
+            pipe.execute()
+        return self._promote(prompt, response, ctx)
 
-    def store_cache(self, prompt: str, response: str):
+    def store_cache(self, prompt: str, response: str, ctx: Optional[EmbeddingContext] = None, ttl: Optional[int] = None):
         """
-        Saves a successful Q&A pair for future reuse.
+        Saves a successful Q&A pair for future reuse. Expires after `ttl`
+        seconds (CACHE_TTL by default) and evicts the coldest entries once
+        the cache holds CACHE_MAX_ENTRIES.
         """
         if not config.ENABLE_CACHE or not self.redis:
             return
 
         try:
+            vector = (ctx or self.context(prompt)).vector
+            # The in-process tier does not depend on Redis being healthy
+            if self.local:
+                self.local.put(prompt, response, vector)
+
             # Ensure index exists
             self._ensure_index(self.cache_idx)
             
-            vector = self.model.encode(prompt).astype(np.float32).tobytes()
-            key = f"cache:{hashlib.md5(prompt.encode()).hexdigest()}"
-            
-            self.redis.hset(key, mapping={
-                "prompt": prompt,
-                "response": response,
-                "vector": vector
-            })
+            key, entry = self._cache_entry(prompt, response, vector)
+            evicted, score = self._make_room()
+
+            pipe = self.redis.pipeline(transaction=False)
+            self._queue_store(pipe, key, entry, ttl, evicted, score)
+            pipe.execute()
+        except Exception as e:
+            print(f"Cache storage error: {e}")
+
+    def store_many(self, entries: List[Tuple[str, str, bytes]], ttl: Optional[int] = None, batch: int = 500) -> int:
+        """
+        Bulk load of (prompt, response, FLOAT32 vector) triples (warmup,
+        import): one index check, pipelined writes, eviction per chunk.
+        """
+        if not entries or not self.redis:
+            return 0
+        self._ensure_index(self.cache_idx, dim=len(entries[0][2]) // 4)
+        for start in range(0, len(entries), batch):
+            chunk = entries[start:start + batch]
+            evicted, score = self._make_room(len(chunk))
+            pipe = self.redis.pipeline(transaction=False)
+            for i, (prompt, response, vector) in enumerate(chunk):
+                key, entry = self._cache_entry(prompt, response, vector)
+                self._queue_store(pipe, key, entry, ttl, evicted if i == 0 else [], score)
+            pipe.execute()
+        return len(entries)
+
+    async def aget_context(self, prompt: str, top_k: Optional[int] = None, ctx: Optional[EmbeddingContext] = None) -> Optional[str]:
+        if not config.ENABLE_RAG or not self.aredis:
+            return None
+
+        return await self.retriever.aretrieve(prompt, ctx or self.context(prompt), top_k)
+
+    async def aget_cached_response(self, prompt: str, ctx: Optional[EmbeddingContext] = None) -> Optional[str]:
+        if not config.ENABLE_CACHE:
+            return None
+
+        ctx = ctx or self.context(prompt)
+        if self.local:
+            response = self._local_exact(prompt)
+            if response is None:
+                response = self._local_similar(await ctx.avector())
+            if response is not None:
+                return response
+        if not self.aredis:
+            return None
+
+        key, response = await self._aknn_search(self.cache_idx, ctx, top_k=1, threshold=config.CACHE_THRESHOLD)
+        if key and response is not None:
+            pipe = self.aredis.pipeline(transaction=False)
+            self._queue_touch(pipe, key)
+            await pipe.execute()
+        return self._promote(prompt, response, ctx)
+
+    async def astore_cache(self, prompt: str, response: str, ctx: Optional[EmbeddingContext] = None, ttl: Optional[int] = None):
+        if not config.ENABLE_CACHE or not self.aredis:
+            return
+
+        try:
+            vector = await (ctx or self.context(prompt)).avector()
+            if self.local:
+                self.local.put(prompt, response, vector)
+
+            await self._aensure_index(self.cache_idx)
+
+            key, entry = self._cache_entry(prompt, response, vector)
+            evicted, score = await self._amake_room()
+
+            pipe = self.aredis.pipeline(transaction=False)
+            self._queue_store(pipe, key, entry, ttl, evicted, score)
+            await pipe.execute()
         except Exception as e:
             print(f"Cache storage error: {e}")
 
-    def _search_vector_db(self, index: str, prompt: str, top_k: int, threshold: float = 0.0) -> Optional[str]:
+    # ------------------------------------------------------------ bulk (batch API)
+
+    async def acontexts(self, prompts: List[str]) -> List[EmbeddingContext]:
+        """Contexts for many prompts; every embedding not in the LRU comes from ONE encode call."""
+        ctxs = [self.context(prompt) for prompt in prompts]
+        missing = {}
+        for ctx in ctxs:
+            ctx._vector = self._remembered(hashlib.sha1(ctx.prompt.encode()).hexdigest())
+            if ctx._vector is None:
+                missing.setdefault(ctx.prompt, []).append(ctx)
+        if missing:
+            texts = list(missing)
+            with span("embed"):
+                vectors = await asyncio.to_thread(self.embedder.encode, texts, config.EMBEDDING_BATCH_SIZE)
+            for text, vector in zip(texts, vectors):
+                stored = self._remember(hashlib.sha1(text.encode()).hexdigest(), vector)
+                for ctx in missing[text]:
+                    ctx._vector = stored
+        return ctxs
+
+    async def aget_cached_responses(self, ctxs: List[EmbeddingContext]) -> List[Optional[str]]:
+        """Bulk lookup: the local tier per prompt, then all remaining KNN queries in one pipelined round trip."""
+        responses: List[Optional[str]] = [None] * len(ctxs)
+        if not config.ENABLE_CACHE:
+            return responses
+
+        pending = []
+        for i, ctx in enumerate(ctxs):
+            if self.local:
+                response = self._local_exact(ctx.prompt)
+                if response is None:
+                    response = self._local_similar(await ctx.avector())
+                if response is not None:
+                    responses[i] = response
+                    continue
+            pending.append(i)
+        if not pending or not self.aredis or not await self._aindex_exists(self.cache_idx):
+            return responses
+
+        try:
+            pipe = self.aredis.pipeline(transaction=False)
+            for i in pending:
+                pipe.execute_command(*self._knn_command(self.cache_idx, await ctxs[i].avector(), 1))
+            results = await pipe.execute()
+        except Exception as e:
+            self._known_indexes.discard(self.cache_idx)
+            print(f"Vector search error: {e}")
+            return responses
+
+        touch = self.aredis.pipeline(transaction=False)
+        touched = False
+        for i, res in zip(pending, results):
+            key, response = self._parse_result(res, config.CACHE_THRESHOLD)
+            if key and response is not None:
+                self._queue_touch(touch, key)
+                touched = True
+            responses[i] = self._promote(ctxs[i].prompt, response, ctxs[i])
+        if touched:
+            await touch.execute()
+        return responses
+
+    def _local_exact(self, prompt: str) -> Optional[str]:
+        response = self.local.get_exact(prompt)
+        if response is not None:
+            self._count_local_hit("local_exact")
+        return response
+
+    def _local_similar(self, vector: bytes) -> Optional[str]:
+        response = self.local.get_similar(vector, config.CACHE_THRESHOLD)
+        if response is not None:
+            self._count_local_hit("local_vector")
+        return response
+
+    def _count_local_hit(self, tier: str):
+        self.hits += 1
+        CACHE_TIER_HITS.labels(tier=tier).inc()
+
+    def _promote(self, prompt: str, response: Optional[str], ctx: EmbeddingContext) -> Optional[str]:
+        """Redis hits are copied into the local tier so the next repeat stays in process."""
+        if response is not None:
+            CACHE_TIER_HITS.labels(tier="redis").inc()
+            if self.local:
+                self.local.put(prompt, response, ctx.vector)
+        return response
+
+    def _cache_entry(self, prompt: str, response: str, vector: bytes):
+        key = f"{self.key_prefix}{hashlib.md5(prompt.encode()).hexdigest()}"
+        return key, {
+            "prompt": prompt,
+            "response": response,
+            "vector": vector,
+            "model": self.model_hash,
+            "created_at": time.time(),
+            "hits": 0
+        }
+
+    # ------------------------------------------------------------ lifecycle
+
+    @staticmethod
+    def _usage_score(coldest: list) -> float:
+        """
+        Score of a new entry. LRU: now. LFU: one above the coldest entry left
+        (dynamic aging). Starting at 0 would make every new entry the next
+        one evicted, freezing the cache on whatever filled it first.
+        """
+        if config.CACHE_EVICTION_POLICY != "LFU":
+            return time.time()
+        return (coldest[0][1] if coldest else 0) + 1
+
+    def _queue_store(self, pipe, key: str, entry: dict, ttl: Optional[int], evicted: List[str], score: float):
+        if evicted:
+            pipe.delete(*evicted)
+            CACHE_STATS.labels(status="evicted").inc(len(evicted))
+        pipe.hset(key, mapping=entry)
+        ttl = config.CACHE_TTL if ttl is None else ttl
+        if ttl > 0:
+            pipe.expire(key, ttl)
+        pipe.zadd(self.usage_key, {key: score})
+        CACHE_STATS.labels(status="stored").inc()
+
+    def _queue_touch(self, pipe, key: str):
+        """Hit bookkeeping: per-entry counter plus the eviction score (hits for LFU, last use for LRU)."""
+        pipe.hincrby(key, "hits", 1)
+        if config.CACHE_EVICTION_POLICY == "LFU":
+            pipe.zadd(self.usage_key, {key: 1}, xx=True, incr=True)
+        else:
+            pipe.zadd(self.usage_key, {key: time.time()}, xx=True)
+
+    def _make_room(self, entries: int = 1) -> Tuple[List[str], float]:
+        """Pops the coldest keys so `entries` more fit under CACHE_MAX_ENTRIES. Returns them and the new entries' score."""
+        evicted = []
+        if config.CACHE_MAX_ENTRIES > 0:
+            excess = self.redis.zcard(self.usage_key) - config.CACHE_MAX_ENTRIES + entries
+            if excess > 0:
+                evicted = [member for member, _ in self.redis.zpopmin(self.usage_key, excess)]
+        coldest = self.redis.zrange(self.usage_key, 0, 0, withscores=True) if config.CACHE_EVICTION_POLICY == "LFU" else []
+        return evicted, self._usage_score(coldest)
+
+    async def _amake_room(self, entries: int = 1) -> Tuple[List[str], float]:
+        evicted = []
+        if config.CACHE_MAX_ENTRIES > 0:
+            excess = await self.aredis.zcard(self.usage_key) - config.CACHE_MAX_ENTRIES + entries
+            if excess > 0:
+                evicted = [member for member, _ in await self.aredis.zpopmin(self.usage_key, excess)]
+        coldest = await self.aredis.zrange(self.usage_key, 0, 0, withscores=True) if config.CACHE_EVICTION_POLICY == "LFU" else []
+        return evicted, self._usage_score(coldest)
+
+    def compact(self, batch: int = 500, keep: Optional[Iterable[str]] = None) -> Tuple[int, int]:
+        """
+        Deletes entries written under a model hash outside `keep` (default:
+        this mapper's; the registry passes every routed model) or before
+        entries carried one, and drops usage records whose key already
+        expired. Returns (stale entries removed, usage records pruned).
+        """
+        keep = set(keep or ()) | {self.model_hash}
+        stale = pruned = 0
+        cursor = None
+        while cursor != 0:
+            cursor, keys = self.redis.scan(cursor or 0, match=f"{vector_index.CACHE_PREFIX}*", count=batch)
+            if keys:
+                pipe = self.redis.pipeline(transaction=False)
+                for key in keys:
+                    pipe.hget(key, "model")
+                dead = self._stale(keys, pipe.execute(), keep)
+                if dead:
+                    self.redis.delete(*dead)
+                    stale += len(dead)
+
+        cursor = None
+        while cursor != 0:
+            cursor, keys = self.redis.scan(cursor or 0, match="cachemeta:*:usage", count=batch)
+            for key in keys:
+                if key not in self._usage_keys(keep):
+                    self.redis.delete(key)
+
+        cursor = None
+        while cursor != 0:
+            cursor, members = self.redis.zscan(self.usage_key, cursor or 0, count=batch)
+            keys = [member for member, _ in members]
+            if keys:
+                pipe = self.redis.pipeline(transaction=False)
+                for key in keys:
+                    pipe.exists(key)
+                gone = [k for k, exists in zip(keys, pipe.execute()) if not exists]
+                if gone:
+                    self.redis.zrem(self.usage_key, *gone)
+                    pruned += len(gone)
+        return self._report_compaction(stale, pruned)
+
+    async def acompact(self, batch: int = 500, keep: Optional[Iterable[str]] = None) -> Tuple[int, int]:
+        keep = set(keep or ()) | {self.model_hash}
+        stale = pruned = 0
+        cursor = None
+        while cursor != 0:
+            cursor, keys = await self.aredis.scan(cursor or 0, match=f"{vector_index.CACHE_PREFIX}*", count=batch)
+            if keys:
+                pipe = self.aredis.pipeline(transaction=False)
+                for key in keys:
+                    pipe.hget(key, "model")
+                dead = self._stale(keys, await pipe.execute(), keep)
+                if dead:
+                    await self.aredis.delete(*dead)
+                    stale += len(dead)
+
+        cursor = None
+        while cursor != 0:
+            cursor, keys = await self.aredis.scan(cursor or 0, match="cachemeta:*:usage", count=batch)
+            for key in keys:
+                if key not in self._usage_keys(keep):
+                    await self.aredis.delete(key)
+
+        cursor = None
+        while cursor != 0:
+            cursor, members = await self.aredis.zscan(self.usage_key, cursor or 0, count=batch)
+            keys = [member for member, _ in members]
+            if keys:
+                pipe = self.aredis.pipeline(transaction=False)
+                for key in keys:
+                    pipe.exists(key)
+                gone = [k for k, exists in zip(keys, await pipe.execute()) if not exists]
+                if gone:
+                    await self.aredis.zrem(self.usage_key, *gone)
+                    pruned += len(gone)
+        return self._report_compaction(stale, pruned)
+
+    def _stale(self, keys: List[str], models: List[Optional[str]], keep: set) -> List[str]:
+        return [key for key, model in zip(keys, models) if model not in keep]
+
+    def _usage_keys(self, keep: set) -> set:
+        return {self.usage_key_for(model_hash) for model_hash in keep}
+
+    @staticmethod
+    def _report_compaction(stale: int, pruned: int) -> Tuple[int, int]:
+        if stale:
+            CACHE_STATS.labels(status="compacted").inc(stale)
+        if stale or pruned:
+            print(f"Cache compaction: {stale} stale entries removed, {pruned} expired usage records pruned")
+        return stale, pruned
+
+    def _index_exists(self, index: str) -> bool:
+        if index in self._known_indexes:
+            return True
         try:
-            # Check if index exists
             self.redis.execute_command("FT.INFO", index)
+        except Exception:
+            return False
+        self._known_indexes.add(index)
+        return True
+
+    async def _aindex_exists(self, index: str) -> bool:
+        if index in self._known_indexes:
+            return True
+        try:
+            await self.aredis.execute_command("FT.INFO", index)
+        except Exception:
+            return False
+        self._known_indexes.add(index)
+        return True
+
+    @staticmethod
+    def _knn_command(index: str, vector: bytes, top_k: int) -> tuple:
+        # Using DIALECT 2 for improved vector search performance
+        # and returning the 'score' (Cosine Distance)
+        return (
+            "FT.SEARCH", index,
+            f"*=>[KNN {top_k} @vector $vec AS score]",
+            "PARAMS", "4", "vec", vector,
+            "SORTBY", "score",
+            "DIALECT", "2",
+            "RETURN", "4", "content", "response", "model", "score"
+        )
+
+    def _parse_result(self, res, threshold: float) -> Tuple[Optional[str], Optional[str]]:
+        """Returns (matched key, text) or (None, None)."""
+        if res and res[0] > 0:
+            # res[1] is the key, res[2] is the list of fields/values
+            fields = res[2]
+            field_dict = {fields[i]: fields[i+1] for i in range(0, len(fields), 2)}
             
-            vector = self.model.encode(prompt).astype(np.float32).tobytes()
-            
-            # Using DIALECT 2 for improved vector search performance
-            # and returning the 'score' (Cosine Distance)
-            res = self.redis.execute_command(
-                "FT.SEARCH", index,
-                f"*=>[KNN {top_k} @vector $vec AS score]",
-                "PARAMS", "4", "vec", vector,
-                "SORTBY", "score",
-                "DIALECT", "2",
-                "RETURN", "3", "content", "response", "score"
-            )
+            # Verification Logic: Similarity = 1 - Distance
+            distance = float(field_dict.get("score", 1.0))
+            similarity = 1.0 - distance
             
-            if res and res[0] > 0:
-                # res[1] is the key, res[2] is the list of fields/values
-                fields = res[2]
-                field_dict = {fields[i]: fields[i+1] for i in range(0, len(fields), 2)}
-                
-                # Verification Logic: Similarity = 1 - Distance
-                distance = float(field_dict.get("score", 1.0))
-                similarity = 1.0 - distance
+            if threshold > 0 and similarity < threshold:
+                print(f"Cache miss: Similarity {similarity:.4f} below threshold {threshold}")
+                return None, None
                 
-                if threshold > 0 and similarity < threshold:
-                    print(f"Cache miss: Similarity {similarity:.4f} below threshold {threshold}")
-                    return None
-                    
-                if "response" in field_dict:
-                    self.hits += 1
-                    return field_dict["response"]
-                return field_dict.get("content")
+            if "response" in field_dict:
+                # Indexes created before keys were namespaced cover every model: never serve another model's answer
+                if field_dict.get("model", self.model_hash) != self.model_hash:
+                    return None, None
+                self.hits += 1
+                return res[1], field_dict["response"]
+            return res[1], field_dict.get("content")
+        return None, None
+
+    def _search_vector_db(self, index: str, ctx: EmbeddingContext, top_k: int, threshold: float = 0.0) -> Optional[str]:
+        return self._knn_search(index, ctx, top_k, threshold)[1]
+
+    async def _asearch_vector_db(self, index: str, ctx: EmbeddingContext, top_k: int, threshold: float = 0.0) -> Optional[str]:
+        return (await self._aknn_search(index, ctx, top_k, threshold))[1]
+
+    def _knn_search(self, index: str, ctx: EmbeddingContext, top_k: int, threshold: float = 0.0) -> Tuple[Optional[str], Optional[str]]:
+        try:
+            # Skip the embedding entirely when there is nothing to search
+            if not self._index_exists(index):
+                return None, None
+            
+            res = self.redis.execute_command(*self._knn_command(index, ctx.vector, top_k))
+            return self._parse_result(res, threshold)
                 
         except Exception as e:
+            # Index may have been dropped underneath us: re-check on next call
+            self._known_indexes.discard(index)
             print(f"Vector search error: {e}")
-            return None
-        return None
+            return None, None
 
-    def _ensure_index(self, index_name: str):
+    async def _aknn_search(self, index: str, ctx: EmbeddingContext, top_k: int, threshold: float = 0.0) -> Tuple[Optional[str], Optional[str]]:
         try:
-            self.redis.execute_command("FT.INFO", index_name)
-        except:
-            # Create a simple cache index if it doesn't exist
-            # Note: We assume 384 dim for all-MiniLM-L6-v2
-            dim = 384 
-            self.redis.execute_command(
-                "FT.CREATE", index_name, "ON", "HASH", "PREFIX", "1", "cache:",
-                "SCHEMA", "response", "TEXT", "vector", "VECTOR", "FLAT", "6", "TYPE", "FLOAT32", "DIM", str(dim), "DISTANCE_METRIC", "COSINE"
-            )
+            if not await self._aindex_exists(index):
+                return None, None
+
+            res = await self.aredis.execute_command(*self._knn_command(index, await ctx.avector(), top_k))
+            return self._parse_result(res, threshold)
+
+        except Exception as e:
+            self._known_indexes.discard(index)
+            print(f"Vector search error: {e}")
+            return None, None
+
+    def _ensure_index(self, index_name: str, dim: Optional[int] = None):
+        if self._index_exists(index_name):
+            return
+        vector_index.ensure_index(
+            self.redis, index_name, self.key_prefix, vector_index.CACHE_TEXT_FIELDS,
+            dim=dim or self.embedder.dimension,
+        )
+        self._known_indexes.add(index_name)
+
+    async def _aensure_index(self, index_name: str):
+        if await self._aindex_exists(index_name):
+            return
+        await vector_index.aensure_index(
+            self.aredis, index_name, self.key_prefix, vector_index.CACHE_TEXT_FIELDS,
+            dim=self.embedder.dimension,
+        )
+        self._known_indexes.add(index_name)
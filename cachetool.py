@@ -0,0 +1,259 @@
+"""
+Semantic cache tooling: pre-warm, export and import.
+
+A model bump moves SemanticMapper to a new, empty `cache_idx_<hash>`, so
+every replica starts at a 0% hit rate under full load. `warmup` takes the
+most frequent prompts from JSONL request logs, regenerates their answers
+with the new model (through the batch scheduler) and bulk-loads them into
+that model's namespace before traffic is flipped to it.
+
+`export` / `import` move a model's entries between environments as a
+gzipped binary dump (prompt, response and FLOAT32 vector per entry), so
+staging can be seeded from production without re-running the model.
+
+    python3 cachetool.py warmup --log requests.jsonl --top 500 --model org/new-model
+    python3 cachetool.py export --model omdeep22/Gonyai-v1 --output cache.gcz
+    python3 cachetool.py import --input cache.gcz
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import struct
+import sys
+import time
+from collections import Counter
+from typing import BinaryIO, Iterator, List, Optional, Sequence, Tuple
+import numpy as np
+from config import config
+from cache import SemanticMapper, normalize_prompt
+from generation import budget_from_payload
+import vector_index
+
+MAGIC = b"GNYCACHE"
+VERSION = 1
+_RECORD = struct.Struct("<III")  # prompt, response, vector byte lengths
+
+Entry = Tuple[str, str, bytes]  # (prompt, response, FLOAT32 vector)
+
+
+def top_prompts(paths: Sequence[str], fields: Sequence[str], top: int, min_count: int = 1) -> List[str]:
+    """Most frequent prompts across JSONL logs; repeats differing in case/spacing count as one."""
+    counts: Counter = Counter()
+    first_seen = {}
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                prompt = next((record[field] for field in fields if isinstance(record.get(field), str) and record[field].strip()), None)
+                if prompt is None:
+                    continue
+                key = normalize_prompt(prompt)
+                counts[key] += 1
+                first_seen.setdefault(key, prompt)
+    return [first_seen[key] for key, count in counts.most_common(top) if count >= min_count]
+
+
+def _resolve_model(model: Optional[str]) -> str:
+    """Registry alias or model id -> model id."""
+    from registry import parse_routes
+    routes = {"default": config.MODEL_ID, **parse_routes(config.MODEL_ROUTES)}
+    return routes.get(model or "default", model)
+
+
+def _mapper(store, model_id: str, embedder=None, count_tokens=None) -> SemanticMapper:
+    from brain import model_hash
+    return SemanticMapper(store.sync, model_hash=model_hash(model_id), async_client=store.aio,
+                          embedder=embedder, count_tokens=count_tokens)
+
+
+# ------------------------------------------------------------ warmup
+
+async def regenerate(engine, mapper: SemanticMapper, prompts: List[str], force: bool = False,
+                     tier: str = "free") -> Tuple[List[Entry], int]:
+    """Answers for prompts not already cached for this model. Returns (entries, already cached)."""
+    ctxs = await mapper.acontexts(prompts)
+    cached = [None] * len(prompts) if force else await mapper.aget_cached_responses(ctxs)
+    todo = [ctx for ctx, response in zip(ctxs, cached) if response is None]
+    slots = asyncio.Semaphore(max(1, config.BATCH_MAX_SIZE))
+    done = 0
+
+    async def answer(ctx) -> Optional[Entry]:
+        nonlocal done
+        async with slots:
+            try:
+                # Same prompt shape as /chat so the cached answer is the one users would get
+                context = await mapper.aget_context(ctx.prompt, ctx=ctx) if config.ENABLE_RAG else None
+                final_prompt = f"Context: {context}\n\nQuestion: {ctx.prompt}" if context else ctx.prompt
+                # ...and the same default-length budget the tier gets on a cache miss
+                budget = budget_from_payload({}, tier)
+                response = await engine.apredict(final_prompt, [], budget=budget)
+            except Exception as e:
+                print(f"  skipped {ctx.prompt[:40]!r}: {e}")
+                return None
+            if not budget.cacheable:
+                print(f"  skipped {ctx.prompt[:40]!r}: generation ended with {budget.finish_reason}")
+                return None
+        done += 1
+        if done % 50 == 0:
+            print(f"  {done}/{len(todo)} generated")
+        return ctx.prompt, response, await ctx.avector()
+
+    results = await asyncio.gather(*[answer(ctx) for ctx in todo])
+    return [entry for entry in results if entry is not None], len(prompts) - len(todo)
+
+
+def warmup(args, store):
+    from brain import ModelEngine
+    from embeddings import EmbeddingService
+    prompts = top_prompts(args.log, args.field, args.top, args.min_count)
+    if not prompts:
+        print("No prompts found in the logs.")
+        return
+    model_id = _resolve_model(args.model)
+    print(f"Warming the cache of {model_id} with the top {len(prompts)} prompts...")
+
+    started = time.time()
+    engine = ModelEngine(model_id)
+    engine.load_model()
+    if not engine.ready:
+        raise SystemExit(f"Model {model_id} failed to load")
+    mapper = _mapper(store, model_id, embedder=EmbeddingService(), count_tokens=engine.count_tokens)
+    try:
+        entries, skipped = asyncio.run(regenerate(engine, mapper, prompts, force=args.force, tier=args.tier))
+        stored = mapper.store_many(entries, ttl=args.ttl)
+    finally:
+        engine.unload()
+    print(f"Cache {mapper.cache_idx}: {stored} answers loaded, {skipped} already cached, "
+          f"{len(prompts) - stored - skipped} failed ({time.time() - started:.1f}s).")
+
+
+# ------------------------------------------------------------ export / import
+
+def iter_entries(r, model_hash: str, batch: int = 500) -> Iterator[Entry]:
+    """Entries of one model, read with a bytes client (vectors are binary). Legacy un-namespaced keys included."""
+    cursor = None
+    while cursor != 0:
+        cursor, keys = r.scan(cursor or 0, match=f"{vector_index.CACHE_PREFIX}*", count=batch)
+        if not keys:
+            continue
+        pipe = r.pipeline(transaction=False)
+        for key in keys:
+            pipe.hmget(key, "model", "prompt", "response", "vector")
+        for model, prompt, response, vector in pipe.execute():
+            if model is not None and model.decode() == model_hash and prompt and response and vector:
+                yield prompt.decode(), response.decode(), vector
+
+
+def write_dump(f: BinaryIO, header: dict, entries: Iterator[Entry]) -> int:
+    meta = json.dumps(header).encode()
+    f.write(MAGIC + struct.pack("<BI", VERSION, len(meta)) + meta)
+    count = 0
+    for prompt, response, vector in entries:
+        p, r = prompt.encode(), response.encode()
+        f.write(_RECORD.pack(len(p), len(r), len(vector)))
+        f.write(p)
+        f.write(r)
+        f.write(vector)
+        count += 1
+    return count
+
+
+def read_dump(f: BinaryIO) -> Tuple[dict, Iterator[Entry]]:
+    if f.read(len(MAGIC)) != MAGIC:
+        raise ValueError("Not a cache dump")
+    version, meta_len = struct.unpack("<BI", f.read(5))
+    if version != VERSION:
+        raise ValueError(f"Unsupported cache dump version {version}")
+    header = json.loads(f.read(meta_len))
+
+    def entries() -> Iterator[Entry]:
+        while True:
+            head = f.read(_RECORD.size)
+            if not head:
+                return
+            p_len, r_len, v_len = _RECORD.unpack(head)
+            yield f.read(p_len).decode(), f.read(r_len).decode(), f.read(v_len)
+
+    return header, entries()
+
+
+def export_cache(args, store):
+    from brain import model_hash
+    model_id = _resolve_model(args.model)
+    header = {
+        "model_id": model_id,
+        "model_hash": model_hash(model_id),
+        "embedding_model": config.EMBEDDING_MODEL_ID,
+        "exported_at": time.time(),
+    }
+    with gzip.open(args.output, "wb") as f:
+        count = write_dump(f, header, iter_entries(store.binary, header["model_hash"]))
+    print(f"Exported {count} entries of {model_id} to {args.output}")
+
+
+def import_cache(args, store):
+    from brain import model_hash
+    with gzip.open(args.input, "rb") as f:
+        header, entries = read_dump(f)
+        entries = list(entries)
+    model_id = _resolve_model(args.model) if args.model else header["model_id"]
+    embedder = None
+    if args.reembed or header.get("embedding_model") != config.EMBEDDING_MODEL_ID:
+        # Vectors from another embedding model would never match this environment's queries
+        from embeddings import EmbeddingService
+        embedder = EmbeddingService()
+        print(f"Re-embedding {len(entries)} prompts with {config.EMBEDDING_MODEL_ID}...")
+        vectors = embedder.encode([prompt for prompt, _, _ in entries], batch_size=config.EMBEDDING_BATCH_SIZE)
+        entries = [(prompt, response, np.asarray(v, dtype=np.float32).tobytes())
+                   for (prompt, response, _), v in zip(entries, vectors)]
+    mapper = _mapper(store, model_id, embedder=embedder)
+    stored = mapper.store_many(entries, ttl=args.ttl)
+    print(f"Imported {stored} entries into {mapper.cache_idx} (model {model_id}, hash {model_hash(model_id)})")
+
+
+def main(argv: List[str]):
+    parser = argparse.ArgumentParser(description="Pre-warm, export and import the semantic cache.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    warm = sub.add_parser("warmup", help="Regenerate the most frequent logged prompts into a model's cache")
+    warm.add_argument("--log", action="append", required=True, help="JSONL request log (repeatable)")
+    warm.add_argument("--field", action="append", help="Prompt field(s) in each record (default: prompt, then body)")
+    warm.add_argument("--top", type=int, default=500)
+    warm.add_argument("--min-count", type=int, default=1, help="Skip prompts seen fewer times")
+    warm.add_argument("--model", help="Alias or model id to warm (default: MODEL_ID)")
+    warm.add_argument("--force", action="store_true", help="Regenerate prompts that are already cached")
+    warm.add_argument("--tier", choices=["free", "pro"], default="free",
+                      help="Generate answers with this tier's default max_tokens (default: free)")
+    warm.add_argument("--ttl", type=int, help="Entry TTL in seconds (default: CACHE_TTL)")
+
+    exp = sub.add_parser("export", help="Write a model's cache entries to a binary dump")
+    exp.add_argument("--model", help="Alias or model id (default: MODEL_ID)")
+    exp.add_argument("--output", required=True)
+
+    imp = sub.add_parser("import", help="Load a binary dump into a model's cache")
+    imp.add_argument("--input", required=True)
+    imp.add_argument("--model", help="Target alias or model id (default: the one in the dump)")
+    imp.add_argument("--reembed", action="store_true", help="Recompute vectors with this environment's embedding model")
+    imp.add_argument("--ttl", type=int, help="Entry TTL in seconds (default: CACHE_TTL)")
+    args = parser.parse_args(argv)
+
+    from datastore import RedisStore
+    store = RedisStore()
+    if args.command == "warmup":
+        args.field = args.field or ["prompt", "body"]
+        warmup(args, store)
+    elif args.command == "export":
+        export_cache(args, store)
+    else:
+        import_cache(args, store)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,247 @@
+"""
+Single-flight request coalescing.
+
+Identical prompts that miss the semantic cache at the same time attach to
+one in-flight generation instead of each running the model. Every request
+gets the full token stream (late joiners replay what was already
+generated), and the cache is written once, by the flight.
+
+With a Redis client the flight is also shared across replicas: the first
+replica takes a SET NX lock and mirrors its tokens into a Redis Stream,
+the others relay that stream to their local subscribers. If the lock
+holder dies before producing anything, a follower generates instead.
+"""
+import asyncio
+import inspect
+import uuid
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple, Union
+from redis.asyncio import Redis as AsyncRedis
+from cache import prompt_hash
+from metrics import COALESCED_REQUESTS
+
+TokenFactory = Callable[[], Union[AsyncIterator[str], Awaitable[AsyncIterator[str]]]]
+
+
+async def _start(factory: TokenFactory) -> AsyncIterator[str]:
+    source = factory()
+    return await source if inspect.isawaitable(source) else source
+
+
+class _Flight:
+    def __init__(self, key: str):
+        self.key = key
+        self.tokens: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.outcome: Optional[str] = None  # e.g. the generation's finish reason, set before done
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+
+    def push(self, token: str):
+        self.tokens.append(token)
+        self._wake()
+
+    def finish(self, error: Optional[BaseException] = None):
+        if not self.done:
+            self.done = True
+            self.error = error
+            self._wake()
+
+    def _wake(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def follow(self) -> AsyncIterator[str]:
+        i = 0
+        while True:
+            while i < len(self.tokens):
+                yield self.tokens[i]
+                i += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await self._changed.wait()
+
+
+class Subscription:
+    """One request's view of a flight: iterate for tokens, aclose() when done."""
+    def __init__(self, coalescer: "Coalescer", flight: _Flight, leader: bool):
+        self.leader = leader
+        self._coalescer = coalescer
+        self._flight = flight
+        self._closed = False
+        flight.subscribers += 1
+
+    def __aiter__(self) -> AsyncIterator[str]:
+        return self._flight.follow()
+
+    @property
+    def outcome(self) -> Optional[str]:
+        """What the generating request's `outcome()` reported, once the flight is done."""
+        return self._flight.outcome
+
+    async def text(self) -> str:
+        try:
+            return "".join([token async for token in self])
+        finally:
+            await self.aclose()
+
+    async def aclose(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._flight.subscribers -= 1
+        if self._flight.subscribers == 0 and not self._flight.done:
+            # Everyone left: stop generating for nobody
+            self._coalescer._forget(self._flight)
+            if self._flight.task:
+                self._flight.task.cancel()
+
+
+class Coalescer:
+    def __init__(self, redis_client: Optional[AsyncRedis] = None, lock_ttl: int = 120):
+        self.aredis = redis_client  # None = in-process only
+        self.lock_ttl = lock_ttl
+        self._flights: Dict[str, _Flight] = {}
+
+    @staticmethod
+    def key(namespace: str, prompt: str) -> str:
+        return f"{namespace}:{prompt_hash(prompt)}"
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._flights)
+
+    def active(self, key: str) -> bool:
+        """A local flight for `key` exists: joining it costs no model work."""
+        return key in self._flights
+
+    async def join(
+        self,
+        key: str,
+        factory: TokenFactory,
+        on_complete: Optional[Callable[[str], Awaitable]] = None,
+        outcome: Optional[Callable[[], Optional[str]]] = None,
+    ) -> Subscription:
+        """
+        Attaches to the flight for `key`, starting it if needed. `factory`
+        is only called by the replica that generates, eagerly (and awaited if
+        it returns an awaitable), so admission errors (e.g. SchedulerFull)
+        reach the caller before any response.
+        `on_complete(text)` runs once per generated answer. `outcome()` is
+        read when the tokens run out and shared with every subscriber (and
+        other replicas) as Subscription.outcome.
+        """
+        flight = self._flights.get(key)
+        if flight is not None:
+            COALESCED_REQUESTS.labels(scope="local").inc()
+            return Subscription(self, flight, leader=False)
+
+        flight = _Flight(key)
+        self._flights[key] = flight
+        subscription = Subscription(self, flight, leader=True)
+        try:
+            generate, stream = await self._claim(key) if self.aredis else (True, None)
+            source = await _start(factory) if generate else None
+        except BaseException as e:
+            self._forget(flight)
+            flight.finish(e)
+            raise
+        if not generate:
+            # Another replica runs the model; this request only relays it
+            subscription.leader = False
+            COALESCED_REQUESTS.labels(scope="remote").inc()
+        flight.task = asyncio.create_task(self._pump(flight, source, stream, factory, on_complete, outcome))
+        return subscription
+
+    def _forget(self, flight: _Flight):
+        if self._flights.get(flight.key) is flight:
+            del self._flights[flight.key]
+
+    async def _pump(self, flight: _Flight, source, stream: Optional[str], factory: TokenFactory, on_complete, outcome):
+        try:
+            if source is None:
+                if await self._relay(flight, stream):
+                    flight.finish()
+                    return
+                if flight.tokens:
+                    raise ConnectionError("Coalesced generation lost its leader mid-stream")
+                # Leader vanished before producing anything: generate here, unshared
+                source, stream = await _start(factory), None
+            await self._generate(flight, source, stream, outcome)
+            flight.finish()
+            if on_complete is not None:
+                await on_complete("".join(flight.tokens))
+        except asyncio.CancelledError:
+            flight.finish(ConnectionError("Coalesced generation cancelled"))
+            raise
+        except Exception as e:
+            flight.finish(e)
+        finally:
+            self._forget(flight)
+
+    async def _generate(self, flight: _Flight, source: AsyncIterator[str], stream: Optional[str], outcome):
+        """Runs the model for the flight, mirroring tokens to `stream` for other replicas."""
+        try:
+            async for token in source:
+                flight.push(token)
+                if stream:
+                    pipe = self.aredis.pipeline(transaction=False)
+                    pipe.xadd(stream, {"t": token})
+                    # Bounded even if this replica dies mid-generation
+                    pipe.expire(stream, self.lock_ttl)
+                    await pipe.execute()
+            flight.outcome = outcome() if outcome else None
+            if stream:
+                await self.aredis.xadd(stream, {"end": "1", "outcome": flight.outcome or ""})
+        except Exception as e:
+            if stream:
+                await self.aredis.xadd(stream, {"error": str(e)})
+            raise
+        finally:
+            await source.aclose()
+            if stream:
+                # Followers still reading have a short grace period
+                pipe = self.aredis.pipeline(transaction=False)
+                pipe.delete(f"coalesce:lock:{flight.key}")
+                pipe.expire(stream, 30)
+                await pipe.execute()
+
+    # ------------------------------------------------------------ cross-replica
+
+    async def _claim(self, key: str) -> Tuple[bool, Optional[str]]:
+        """Returns (True, our stream) when this replica generates, else (False, the leader's stream)."""
+        lock = f"coalesce:lock:{key}"
+        mine = f"coalesce:stream:{uuid.uuid4().hex}"
+        for _ in range(2):
+            if await self.aredis.set(lock, mine, nx=True, ex=self.lock_ttl):
+                return True, mine
+            theirs = await self.aredis.get(lock)
+            if theirs:
+                return False, theirs
+            # Lock expired between SET and GET: try once more
+        return True, None
+
+    async def _relay(self, flight: _Flight, stream: str) -> bool:
+        """Copies the leader's tokens into the local flight. False if the leader disappeared."""
+        lock = f"coalesce:lock:{flight.key}"
+        last_id = "0"
+        while True:
+            res = await self.aredis.xread({stream: last_id}, count=256, block=1000)
+            if not res:
+                if await self.aredis.exists(lock):
+                    continue
+                # Lock released or expired: whatever the leader wrote is already readable
+                res = await self.aredis.xread({stream: last_id}, count=256)
+                if not res:
+                    return False
+            for last_id, fields in res[0][1]:
+                if "t" in fields:
+                    flight.push(fields["t"])
+                elif "error" in fields:
+                    raise RuntimeError(fields["error"])
+                elif "end" in fields:
+                    flight.outcome = fields.get("outcome") or None
+                    return True
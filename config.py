@@ -5,6 +5,16 @@ class Config:
     # Model Configuration
     MODEL_ID: str = os.getenv("MODEL_ID", "omdeep22/Gonyai-v1")
     EMBEDDING_MODEL_ID: str = os.getenv("EMBEDDING_MODEL_ID", "all-MiniLM-L6-v2")
+    # Model Registry: extra models by alias ("fast=org/small-model,large=org/big-model"); "default" is MODEL_ID
+    MODEL_ROUTES: str = os.getenv("MODEL_ROUTES", "")
+    MODEL_TIER_ROUTES: str = os.getenv("MODEL_TIER_ROUTES", "")  # e.g. "free=fast,pro=default"
+    MODEL_MEMORY_BUDGET_MB: int = int(os.getenv("MODEL_MEMORY_BUDGET_MB", 0))  # LRU-unloads past this, 0 = unlimited
+    MODEL_SWAP_DRAIN_SECONDS: float = float(os.getenv("MODEL_SWAP_DRAIN_SECONDS", 60))  # old version finishes in-flight work
+    # Multi-worker mode: set by modelserver.py, workers forward model calls to it instead of loading weights
+    MODEL_SERVER_SOCKET: str = os.getenv("MODEL_SERVER_SOCKET", "")
+    MODEL_SERVER_AUTHKEY: str = os.getenv("MODEL_SERVER_AUTHKEY", "")
+    MODEL_SERVER_TIMEOUT: float = float(os.getenv("MODEL_SERVER_TIMEOUT", 30))  # blocking worker calls, 0 = wait forever
+    WEB_CONCURRENCY: int = int(os.getenv("WEB_CONCURRENCY", 1))  # uvicorn workers sharing one model server
     
     # Feature Flags
     ENABLE_RAG: bool = os.getenv("ENABLE_RAG", "True").lower() == "true"
@@ -14,20 +24,119 @@ class Config:
     # Infrastructure
     REDIS_HOST: str = os.getenv("REDIS_HOST", "localhost")
     REDIS_PORT: int = int(os.getenv("REDIS_PORT", 6380))
+    REDIS_BACKEND: str = os.getenv("REDIS_BACKEND", "redis")  # redis, fakeredis
+    REDIS_MAX_CONNECTIONS: int = int(os.getenv("REDIS_MAX_CONNECTIONS", 64))
+    REDIS_POOL_TIMEOUT: float = float(os.getenv("REDIS_POOL_TIMEOUT", 5.0))
+    REDIS_SOCKET_TIMEOUT: float = float(os.getenv("REDIS_SOCKET_TIMEOUT", 5.0))
+    REDIS_HEALTH_CHECK_INTERVAL: int = int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", 30))
     
     # Hardware/Performance
     DEVICE: str = os.getenv("DEVICE", "auto") # auto, cuda, cpu
     CACHE_THRESHOLD: float = float(os.getenv("CACHE_THRESHOLD", 0.95))
+    EMBEDDING_CACHE_SIZE: int = int(os.getenv("EMBEDDING_CACHE_SIZE", 1024))
+    EMBEDDING_BACKEND: str = os.getenv("EMBEDDING_BACKEND", "torch").lower()  # torch, onnx, int8
+    EMBEDDING_ONNX_FILE: str = os.getenv("EMBEDDING_ONNX_FILE", "")  # e.g. onnx/model_qint8_avx512_vnni.onnx
+    EMBEDDING_BATCH_SIZE: int = int(os.getenv("EMBEDDING_BATCH_SIZE", 32))
+    EMBEDDING_BATCH_WAIT_MS: float = float(os.getenv("EMBEDDING_BATCH_WAIT_MS", 3))
+    LOCAL_CACHE_SIZE: int = int(os.getenv("LOCAL_CACHE_SIZE", 4096))  # in-process tier, 0 disables
+    LOCAL_CACHE_TTL: float = float(os.getenv("LOCAL_CACHE_TTL", 600))  # seconds
+
+    # Semantic Cache Lifecycle (Redis tier)
+    CACHE_TTL: int = int(os.getenv("CACHE_TTL", 86400))  # seconds per entry, 0 = never expire
+    CACHE_MAX_ENTRIES: int = int(os.getenv("CACHE_MAX_ENTRIES", 50000))  # 0 = unbounded
+    CACHE_EVICTION_POLICY: str = os.getenv("CACHE_EVICTION_POLICY", "LRU").upper()  # LRU, LFU
+    CACHE_COMPACT_INTERVAL: int = int(os.getenv("CACHE_COMPACT_INTERVAL", 600))  # seconds, 0 disables
+
+    # Request Coalescing (identical fresh prompts share one generation)
+    ENABLE_COALESCING: bool = os.getenv("ENABLE_COALESCING", "True").lower() == "true"
+    COALESCE_ACROSS_REPLICAS: bool = os.getenv("COALESCE_ACROSS_REPLICAS", "False").lower() == "true"
+    COALESCE_LOCK_TTL: int = int(os.getenv("COALESCE_LOCK_TTL", 120))  # seconds
+
+    # RAG Retrieval (vector KNN + BM25 fused by reciprocal rank, packed into a token budget)
+    RAG_HYBRID: bool = os.getenv("RAG_HYBRID", "True").lower() == "true"
+    RAG_CANDIDATES: int = int(os.getenv("RAG_CANDIDATES", 20))  # per retriever, before fusion
+    RAG_TOP_K: int = int(os.getenv("RAG_TOP_K", 4))  # passages considered for the prompt
+    RAG_RRF_K: int = int(os.getenv("RAG_RRF_K", 60))
+    RAG_CONTEXT_TOKENS: int = int(os.getenv("RAG_CONTEXT_TOKENS", 512))
+    RERANKER_MODEL_ID: str = os.getenv("RERANKER_MODEL_ID", "")  # e.g. cross-encoder/ms-marco-MiniLM-L-6-v2, empty = off
+
+    # Vector Index (FLAT = exact brute force, HNSW = approximate, sub-linear)
+    VECTOR_ALGORITHM: str = os.getenv("VECTOR_ALGORITHM", "FLAT").upper()
+    HNSW_M: int = int(os.getenv("HNSW_M", 16))
+    HNSW_EF_CONSTRUCTION: int = int(os.getenv("HNSW_EF_CONSTRUCTION", 200))
+    HNSW_EF_RUNTIME: int = int(os.getenv("HNSW_EF_RUNTIME", 10))
     LOAD_IN_4BIT: bool = os.getenv("LOAD_IN_4BIT", "False").lower() == "true"
     LOAD_IN_8BIT: bool = os.getenv("LOAD_IN_8BIT", "False").lower() == "true"
+
+    # CPU Inference (fp32, bf16, int8 = dynamic quantization of Linear layers, auto = bf16 if native)
+    CPU_PRECISION: str = os.getenv("CPU_PRECISION", "fp32").lower()
+    TORCH_NUM_THREADS: int = int(os.getenv("TORCH_NUM_THREADS", 0))  # 0 = cgroup CPU quota
+    TORCH_INTEROP_THREADS: int = int(os.getenv("TORCH_INTEROP_THREADS", 0))  # 0 = 1
+    TORCH_COMPILE: bool = os.getenv("TORCH_COMPILE", "False").lower() == "true"
+    TORCH_COMPILE_MODE: str = os.getenv("TORCH_COMPILE_MODE", "default")
+    WARMUP_ON_START: bool = os.getenv("WARMUP_ON_START", "True").lower() == "true"
+    WARMUP_TOKENS: int = int(os.getenv("WARMUP_TOKENS", 8))
+
+    # Cold Start
+    SNAPSHOT_DIR: str = os.getenv("SNAPSHOT_DIR", "")  # preconverted safetensors from snapshot.py, empty = hub
+    BACKGROUND_LOAD: bool = os.getenv("BACKGROUND_LOAD", "False").lower() == "true"  # serve /health/live while loading
+
+    # Continuous Batching Scheduler
+    ENABLE_BATCHING: bool = os.getenv("ENABLE_BATCHING", "True").lower() == "true"
+    BATCH_MAX_SIZE: int = int(os.getenv("BATCH_MAX_SIZE", 8))
+    BATCH_MAX_WAIT_MS: int = int(os.getenv("BATCH_MAX_WAIT_MS", 10))
+    BATCH_QUEUE_DEPTH: int = int(os.getenv("BATCH_QUEUE_DEPTH", 64))
+
+    # Speculative Decoding (off, draft, prompt_lookup). Replaces continuous batching when on.
+    SPECULATIVE_MODE: str = os.getenv("SPECULATIVE_MODE", "off").lower()
+    DRAFT_MODEL_ID: str = os.getenv("DRAFT_MODEL_ID", "")  # small model sharing MODEL_ID's tokenizer ideally
+    SPECULATIVE_NUM_TOKENS: int = int(os.getenv("SPECULATIVE_NUM_TOKENS", 5))  # draft tokens per step
+    PROMPT_LOOKUP_NUM_TOKENS: int = int(os.getenv("PROMPT_LOOKUP_NUM_TOKENS", 10))  # n-gram continuation length
+
+    # Admission Control (bounded priority queue in front of the model: pro, then free, then batch jobs)
+    ENABLE_ADMISSION: bool = os.getenv("ENABLE_ADMISSION", "True").lower() == "true"
+    ADMISSION_MAX_CONCURRENCY: int = int(os.getenv("ADMISSION_MAX_CONCURRENCY", 0))  # 0 = what the engine decodes at once
+    ADMISSION_QUEUE_SIZE: int = int(os.getenv("ADMISSION_QUEUE_SIZE", 64))
+    ADMISSION_MAX_WAIT_PRO: float = float(os.getenv("ADMISSION_MAX_WAIT_PRO", 30))  # seconds of estimated wait before 503
+    ADMISSION_MAX_WAIT_FREE: float = float(os.getenv("ADMISSION_MAX_WAIT_FREE", 10))
+    ADMISSION_FREE_QUEUE_SHARE: float = float(os.getenv("ADMISSION_FREE_QUEUE_SHARE", 0.5))  # free past this share -> 429
+
+    # Generation Budgets (payload max_tokens / stop / deadline_ms; answers are also capped by the context window)
+    GEN_DEFAULT_TOKENS_FREE: int = int(os.getenv("GEN_DEFAULT_TOKENS_FREE", 256))  # when the payload has no max_tokens
+    GEN_DEFAULT_TOKENS_PRO: int = int(os.getenv("GEN_DEFAULT_TOKENS_PRO", 512))
+    GEN_MAX_TOKENS_FREE: int = int(os.getenv("GEN_MAX_TOKENS_FREE", 512))  # ceiling for a requested max_tokens
+    GEN_MAX_TOKENS_PRO: int = int(os.getenv("GEN_MAX_TOKENS_PRO", 2048))
+    GEN_MAX_STOP_SEQUENCES: int = int(os.getenv("GEN_MAX_STOP_SEQUENCES", 4))
+
+    # Batch API (/chat/batch and async jobs)
+    BATCH_API_MAX_ITEMS: int = int(os.getenv("BATCH_API_MAX_ITEMS", 256))
+    BATCH_JOB_TTL: int = int(os.getenv("BATCH_JOB_TTL", 86400))  # seconds results stay pollable
+
+    # Prefix KV-Cache (multi-turn sessions only prefill new tokens)
+    ENABLE_KV_CACHE: bool = os.getenv("ENABLE_KV_CACHE", "True").lower() == "true"
+    KV_CACHE_MAX_MB: int = int(os.getenv("KV_CACHE_MAX_MB", 512))
+    KV_CACHE_MIN_PREFIX: int = int(os.getenv("KV_CACHE_MIN_PREFIX", 16))  # tokens
+
+    # Streaming
+    STREAM_BUFFER_SIZE: int = int(os.getenv("STREAM_BUFFER_SIZE", 256))  # tokens buffered per client
+    STREAM_SLOW_CLIENT_TIMEOUT: float = float(os.getenv("STREAM_SLOW_CLIENT_TIMEOUT", 1.0))  # seconds a generate() thread waits on a full buffer (the batch scheduler never waits)
     
+    # Observability (stage histograms are always on; spans need opentelemetry)
+    ENABLE_TRACING: bool = os.getenv("ENABLE_TRACING", "False").lower() == "true"
+    TRACING_SERVICE_NAME: str = os.getenv("TRACING_SERVICE_NAME", "gonyai-api")
+
     # Security & Admin
     RATE_LIMIT_FREE: int = 10
     RATE_LIMIT_PRO: int = 100
     RATE_WINDOW: int = 60 # seconds
+    API_KEY_CACHE_TTL: float = float(os.getenv("API_KEY_CACHE_TTL", 30))  # 0 disables
+    API_KEY_CACHE_SIZE: int = int(os.getenv("API_KEY_CACHE_SIZE", 10000))
     ADMIN_ROOT_KEY: str = os.getenv("ADMIN_ROOT_KEY", "UNSET_PROTECT_YOUR_SERVICE")
     
     # Memory/Context
     MAX_HISTORY_TOKENS: int = int(os.getenv("MAX_HISTORY_TOKENS", 2048))
+    MEMORY_MAX_MESSAGES: int = int(os.getenv("MEMORY_MAX_MESSAGES", 50))
+    MEMORY_SUMMARIZE: bool = os.getenv("MEMORY_SUMMARIZE", "False").lower() == "true"
+    MEMORY_SUMMARY_TOKENS: int = int(os.getenv("MEMORY_SUMMARY_TOKENS", 256))
 
 config = Config()
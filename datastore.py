@@ -0,0 +1,117 @@
+"""
+Shared Redis access layer.
+
+One explicitly sized pool for threadpool callers and one for asyncio callers,
+both with health checks and retry-with-backoff on dropped connections.
+Set REDIS_BACKEND=fakeredis to run the whole stack against an in-process
+stand-in (tests, benchmarks, laptops without Redis Stack).
+"""
+from typing import Optional
+from redis import Redis, BlockingConnectionPool
+from redis.backoff import ExponentialBackoff
+from redis.exceptions import ConnectionError, TimeoutError
+from redis.retry import Retry
+import redis.asyncio as aioredis
+from redis.asyncio.retry import Retry as AsyncRetry
+from config import config
+
+class RedisStore:
+    def __init__(
+        self,
+        host: str = config.REDIS_HOST,
+        port: int = config.REDIS_PORT,
+        max_connections: int = config.REDIS_MAX_CONNECTIONS,
+        backend: str = config.REDIS_BACKEND,
+    ):
+        self.host = host
+        self.port = port
+        self.max_connections = max_connections
+        self.backend = backend
+        self._sync: Optional[Redis] = None
+        self._aio: Optional[aioredis.Redis] = None
+        self._binary: Optional[Redis] = None
+        self._fake_server = None
+
+    def _connection_kwargs(self) -> dict:
+        return {
+            "host": self.host,
+            "port": self.port,
+            "decode_responses": True,
+            "max_connections": self.max_connections,
+            "timeout": config.REDIS_POOL_TIMEOUT,  # wait for a free connection, don't fail fast
+            "socket_timeout": config.REDIS_SOCKET_TIMEOUT,
+            "socket_connect_timeout": config.REDIS_SOCKET_TIMEOUT,
+            "health_check_interval": config.REDIS_HEALTH_CHECK_INTERVAL,
+            "retry_on_error": [ConnectionError, TimeoutError],
+        }
+
+    def _fake(self):
+        # Optional dependency: only needed when REDIS_BACKEND=fakeredis
+        import fakeredis
+        if self._fake_server is None:
+            self._fake_server = fakeredis.FakeServer()
+        return fakeredis
+
+    @property
+    def sync(self) -> Redis:
+        """Blocking client for threadpool code paths (and CLI tools)."""
+        if self._sync is None:
+            if self.backend == "fakeredis":
+                self._sync = self._fake().FakeRedis(server=self._fake_server, decode_responses=True)
+            else:
+                pool = BlockingConnectionPool(
+                    retry=Retry(ExponentialBackoff(cap=1.0, base=0.05), 3),
+                    **self._connection_kwargs(),
+                )
+                self._sync = Redis(connection_pool=pool)
+        return self._sync
+
+    @property
+    def binary(self) -> Redis:
+        """Blocking client returning raw bytes, for reading vector fields back (CLI tools)."""
+        if self._binary is None:
+            if self.backend == "fakeredis":
+                self._binary = self._fake().FakeRedis(server=self._fake_server)
+            else:
+                kwargs = dict(self._connection_kwargs(), decode_responses=False, max_connections=4)
+                self._binary = Redis(connection_pool=BlockingConnectionPool(**kwargs))
+        return self._binary
+
+    @property
+    def aio(self) -> aioredis.Redis:
+        """asyncio client: commands from concurrent requests overlap on the pool."""
+        if self._aio is None:
+            if self.backend == "fakeredis":
+                self._aio = self._fake().FakeAsyncRedis(server=self._fake_server, decode_responses=True)
+            else:
+                pool = aioredis.BlockingConnectionPool(
+                    retry=AsyncRetry(ExponentialBackoff(cap=1.0, base=0.05), 3),
+                    **self._connection_kwargs(),
+                )
+                self._aio = aioredis.Redis(connection_pool=pool)
+        return self._aio
+
+    def ping(self) -> bool:
+        try:
+            return bool(self.sync.ping())
+        except Exception as e:
+            print(f"Redis health check failed: {e}")
+            return False
+
+    async def aping(self) -> bool:
+        try:
+            return bool(await self.aio.ping())
+        except Exception as e:
+            print(f"Redis health check failed: {e}")
+            return False
+
+    async def aclose(self):
+        if self._aio is not None:
+            await self._aio.aclose()
+            self._aio = None
+        if self._sync is not None:
+            self._sync.close()
+            self._sync = None
+        if self._binary is not None:
+            self._binary.close()
+            self._binary = None
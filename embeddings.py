@@ -0,0 +1,157 @@
+"""
+Embedding Service: one shared sentence encoder per process.
+
+- Loaded and warmed up eagerly at startup (readiness waits for it), so the
+  first user request does not pay for the model download/load.
+- Concurrent single-prompt encodes are merged by a micro-batcher into one
+  forward pass: requests arriving within EMBEDDING_BATCH_WAIT_MS share a batch.
+- CPU backends: plain torch, ONNX Runtime, or torch dynamic int8 quantization.
+"""
+import asyncio
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import List, Optional, Sequence
+import numpy as np
+from config import config
+from metrics import EMBEDDING_BATCH_SIZE
+from snapshot import find_snapshot
+
+BACKENDS = ("torch", "onnx", "int8")
+
+
+def load_model(model_id: Optional[str] = None, backend: Optional[str] = None):
+    """Builds the SentenceTransformer for the configured backend (shared with ingest)."""
+    from sentence_transformers import SentenceTransformer
+    model_id = model_id or config.EMBEDDING_MODEL_ID
+    backend = (backend or config.EMBEDDING_BACKEND).lower()
+    if backend not in BACKENDS:
+        raise ValueError(f"Unsupported embedding backend: {backend} (choose from {', '.join(BACKENDS)})")
+
+    print(f"Loading S-Tier Embedding Model: {model_id} ({backend})...")
+    model_id = find_snapshot(model_id) or model_id
+    if backend == "onnx":
+        # Exports on first use when the repo ships no ONNX weights; a
+        # pre-quantized file (e.g. onnx/model_qint8_avx512_vnni.onnx) can be picked
+        model_kwargs = {"file_name": config.EMBEDDING_ONNX_FILE} if config.EMBEDDING_ONNX_FILE else None
+        return SentenceTransformer(model_id, device="cpu", backend="onnx", model_kwargs=model_kwargs)
+
+    model = SentenceTransformer(model_id)
+    if backend == "int8":
+        import torch
+        model = model.to("cpu")
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return model
+
+
+class _EncodeRequest:
+    def __init__(self, text: str):
+        self.text = text
+        self.future: Future = Future()
+
+
+class EmbeddingService:
+    def __init__(
+        self,
+        model_id: Optional[str] = None,
+        backend: Optional[str] = None,
+        max_batch_size: Optional[int] = None,
+        max_wait_ms: Optional[float] = None,
+    ):
+        self.model_id = model_id or config.EMBEDDING_MODEL_ID
+        self.backend = (backend or config.EMBEDDING_BACKEND).lower()
+        self.max_batch_size = max_batch_size or config.EMBEDDING_BATCH_SIZE
+        self.max_wait = (config.EMBEDDING_BATCH_WAIT_MS if max_wait_ms is None else max_wait_ms) / 1000.0
+        self.ready = False
+        self._model = None
+        self._load_lock = threading.Lock()
+        self._pending: "queue.Queue[_EncodeRequest]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._load_lock:
+                if self._model is None:
+                    self._model = load_model(self.model_id, self.backend)
+        return self._model
+
+    @property
+    def dimension(self) -> int:
+        from vector_index import embedding_dim
+        return embedding_dim(self.model)
+
+    def warmup(self):
+        """Loads the model and runs one batch so lazy kernels/allocations happen now."""
+        started = time.time()
+        self.encode(["warmup"] * min(self.max_batch_size, 8))
+        self._start()
+        self.ready = True
+        print(f"Embedding model ready in {time.time() - started:.1f}s")
+
+    def encode(self, texts: Sequence[str], batch_size: int = 32) -> np.ndarray:
+        """Direct batched encode (bulk callers); returns FLOAT32 [n, dim]."""
+        return np.asarray(self.model.encode(list(texts), batch_size=batch_size), dtype=np.float32)
+
+    def submit(self, text: str) -> Future:
+        """Queues one text for the micro-batcher; the Future resolves to a FLOAT32 vector."""
+        self._start()
+        request = _EncodeRequest(text)
+        self._pending.put(request)
+        return request.future
+
+    def encode_one(self, text: str) -> np.ndarray:
+        return self.submit(text).result()
+
+    async def aencode_one(self, text: str) -> np.ndarray:
+        """Awaits the batch without parking a threadpool worker."""
+        return await asyncio.wrap_future(self.submit(text))
+
+    def stop(self):
+        thread, self._thread = self._thread, None
+        if thread:
+            self._pending.put(None)
+            thread.join(timeout=5)
+
+    # ------------------------------------------------------------ batcher
+
+    def _start(self):
+        if self._thread is None:
+            with self._load_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            try:
+                vectors = self.encode([r.text for r in batch], batch_size=len(batch))
+            except Exception as e:
+                for r in batch:
+                    r.future.set_exception(e)
+                continue
+            EMBEDDING_BATCH_SIZE.observe(len(batch))
+            for r, vector in zip(batch, vectors):
+                r.future.set_result(vector)
+
+    def _collect(self) -> Optional[List[_EncodeRequest]]:
+        first = self._pending.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                request = self._pending.get(timeout=remaining) if remaining > 0 else self._pending.get_nowait()
+            except queue.Empty:
+                break
+            if request is None:
+                self._pending.put(None)
+                break
+            batch.append(request)
+        return batch
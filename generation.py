@@ -0,0 +1,136 @@
+"""
+Generation budgets: how much decoding one request is allowed.
+
+A chat payload may carry
+    max_tokens   answer length cap (default and ceiling come from the key's tier)
+    stop         string or list of strings that end the answer (not included in it)
+    deadline_ms  wall-clock budget; whatever was generated by then is returned
+
+The engine also caps the answer at what the context window has left after
+the prompt. Limits are checked after every decode step, by the batch
+scheduler or by a StoppingCriteria inside generate(), so no token past
+them is computed.
+"""
+import time
+from typing import List, Optional, Tuple
+from config import config
+from metrics import DELIVERED_TOKENS, GENERATION_FINISHED
+
+DEFAULT_MAX_NEW_TOKENS = 256  # internal callers (warmup tooling, benchmarks) without a budget
+
+
+class ContextOverflow(ValueError):
+    """The prompt alone fills the model's context window."""
+
+
+class GenerationBudget:
+    """Per-request decoding limits, plus why decoding stopped once it has."""
+
+    def __init__(
+        self,
+        max_new_tokens: Optional[int] = None,
+        stop: Optional[List[str]] = None,
+        deadline_ms: Optional[float] = None,
+        custom: bool = False,
+    ):
+        self.max_new_tokens = max_new_tokens
+        self.stop = list(stop or [])
+        # Monotonic clocks are system-wide: the deadline holds in the model server process too
+        self.deadline = time.monotonic() + deadline_ms / 1000.0 if deadline_ms else None
+        # Client-shaped answer (own length or stop sequences): not cached or served from cache
+        self.custom = custom
+        # eos, length, stop_sequence, deadline or cancelled
+        self.finish_reason: Optional[str] = None
+
+    @property
+    def shareable(self) -> bool:
+        """Another request could be handed this answer (coalescing)."""
+        return not self.custom and self.deadline is None
+
+    @property
+    def cacheable(self) -> bool:
+        """The answer is a complete default-shaped one."""
+        return not self.custom and self.finish_reason not in ("deadline", "cancelled")
+
+
+def budget_from_payload(payload: dict, tier: str) -> GenerationBudget:
+    """Resolves max_tokens / stop / deadline_ms against the tier. Raises ValueError on bad values."""
+    pro = tier == "pro"
+    ceiling = config.GEN_MAX_TOKENS_PRO if pro else config.GEN_MAX_TOKENS_FREE
+    default = config.GEN_DEFAULT_TOKENS_PRO if pro else config.GEN_DEFAULT_TOKENS_FREE
+
+    max_tokens = payload.get("max_tokens")
+    if max_tokens is not None and (isinstance(max_tokens, bool) or not isinstance(max_tokens, int) or max_tokens < 1):
+        raise ValueError("'max_tokens' must be a positive integer")
+
+    stop = payload.get("stop")
+    if isinstance(stop, str):
+        stop = [stop]
+    if stop is not None and (not isinstance(stop, list) or not all(isinstance(s, str) and s for s in stop)):
+        raise ValueError("'stop' must be a string or a list of non-empty strings")
+    if stop and len(stop) > config.GEN_MAX_STOP_SEQUENCES:
+        raise ValueError(f"At most {config.GEN_MAX_STOP_SEQUENCES} stop sequences")
+
+    deadline_ms = payload.get("deadline_ms")
+    if deadline_ms is not None and (isinstance(deadline_ms, bool) or not isinstance(deadline_ms, (int, float)) or deadline_ms <= 0):
+        raise ValueError("'deadline_ms' must be a positive number")
+
+    return GenerationBudget(
+        max_new_tokens=min(max_tokens or default, ceiling),
+        stop=stop,
+        deadline_ms=deadline_ms,
+        custom=max_tokens is not None or bool(stop),
+    )
+
+
+def cut_at_stop(text: str, stop: List[str]) -> Tuple[str, bool]:
+    """Text up to the earliest stop sequence, and whether one was found."""
+    cut = min((i for i in (text.find(s) for s in stop) if i >= 0), default=-1)
+    return (text[:cut], True) if cut >= 0 else (text, False)
+
+
+def holdback(text: str, stop: List[str]) -> int:
+    """Length of the tail of `text` that could still grow into a stop sequence."""
+    longest = 0
+    for s in stop:
+        for k in range(min(len(s) - 1, len(text)), longest, -1):
+            if text.endswith(s[:k]):
+                longest = k
+                break
+    return longest
+
+
+def record_finish(reason: str, delivered_tokens: int):
+    """Generated tokens are counted as they are decoded (OUTPUT_TOKENS); this counts what reached the caller."""
+    GENERATION_FINISHED.labels(reason=reason).inc()
+    DELIVERED_TOKENS.inc(delivered_tokens)
+
+
+class StopFilter:
+    """
+    Streaming sink wrapper for generate(): forwards text up to the first stop
+    sequence and holds back a tail that may still turn into one.
+    """
+    def __init__(self, sink, stop: List[str]):
+        self.sink = sink
+        self.stop = stop
+        self.text = ""
+        self.sent = ""
+        self.stopped = False
+
+    def put(self, delta: str):
+        if self.stopped:
+            return
+        self.text += delta
+        text, self.stopped = cut_at_stop(self.text, self.stop)
+        self._send(text if self.stopped else text[:len(text) - holdback(text, self.stop)])
+
+    def flush(self):
+        """Generation ended without a stop sequence: the held-back tail is real text."""
+        if not self.stopped:
+            self._send(self.text)
+
+    def _send(self, visible: str):
+        if len(visible) > len(self.sent):
+            self.sink.put(visible[len(self.sent):])
+            self.sent = visible
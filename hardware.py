@@ -0,0 +1,68 @@
+"""
+CPU Performance Helpers: size torch's thread pools to the container, not the
+host, and detect what precision the CPU runs fast.
+
+Inside a pod, os.cpu_count() reports every core on the node while the cgroup
+quota may allow two. Oversubscribed intra-op threads then fight over that
+quota and inference gets slower, not faster.
+"""
+import math
+import os
+from typing import Optional
+
+def cgroup_cpu_limit() -> Optional[float]:
+    """CPUs granted by the cgroup quota (v2 cpu.max or v1 cfs), None if unlimited."""
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            return int(quota) / int(period)
+        return None
+    except (OSError, ValueError):
+        pass
+    try:
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+            quota = int(f.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+            period = int(f.read())
+        if quota > 0:
+            return quota / period
+    except (OSError, ValueError):
+        pass
+    return None
+
+def available_cpus() -> int:
+    """Usable CPUs: cgroup quota, CPU affinity and core count, whichever is smallest."""
+    counts = [os.cpu_count() or 1]
+    if hasattr(os, "sched_getaffinity"):
+        counts.append(len(os.sched_getaffinity(0)))
+    limit = cgroup_cpu_limit()
+    if limit:
+        counts.append(max(1, math.floor(limit)))
+    return min(counts)
+
+def configure_threads(intra_op: int = 0, inter_op: int = 0) -> tuple:
+    """
+    Applies torch thread counts (0 = auto: one intra-op thread per usable CPU,
+    a single inter-op thread since requests are not run as parallel graphs).
+    Returns the (intra_op, inter_op) actually in effect.
+    """
+    import torch
+    intra_op = intra_op or available_cpus()
+    inter_op = inter_op or 1
+    torch.set_num_threads(intra_op)
+    try:
+        torch.set_num_interop_threads(inter_op)
+    except RuntimeError:
+        # Can only be set once, before any inter-op work started
+        inter_op = torch.get_num_interop_threads()
+    return intra_op, inter_op
+
+def cpu_supports_bf16() -> bool:
+    """Native bf16 math (AVX512-BF16 or AMX); elsewhere bf16 is emulated and slower than fp32."""
+    try:
+        with open("/proc/cpuinfo") as f:
+            flags = f.read()
+    except OSError:
+        return False
+    return "avx512_bf16" in flags or "amx_bf16" in flags
@@ -1,49 +1,211 @@
 import sys
+import os
+import json
+import time
+import hashlib
+import argparse
 import numpy as np
+from typing import Iterable, Iterator, List, Optional, Tuple
 from redis import Redis
 from sentence_transformers import SentenceTransformer
 from config import config
+from datastore import RedisStore
+from embeddings import load_model
+import vector_index
 
 INDEX_NAME = "coconut_idx"
+TEXT_EXTENSIONS = {".txt", ".md"}
+JSONL_EXTENSIONS = {".jsonl", ".ndjson"}
+
+_model: Optional[SentenceTransformer] = None
+
+def get_model() -> SentenceTransformer:
+    """One embedding model per process, however many documents we ingest."""
+    global _model
+    if _model is None:
+        print(f"Embedding knowledge Using {config.EMBEDDING_MODEL_ID}...")
+        # Same backend as the API so stored and query vectors match
+        _model = load_model()
+    return _model
+
+def ensure_index(r: Redis):
+    _, prefix, text_fields = vector_index.RAG_INDEX
+    vector_index.ensure_index(r, INDEX_NAME, prefix, text_fields, dim=vector_index.embedding_dim(get_model()))
+
+def doc_id(text: str) -> str:
+    # Content hash doubles as the dedup key, which makes bulk runs resumable
+    return hashlib.md5(text.encode()).hexdigest()
 
 def ingest(text: str, source: str = "manual"):
     if not text.strip():
         return
 
     # 1. Connect
-    r = Redis(host=config.REDIS_HOST, port=config.REDIS_PORT)
-    
+    r = RedisStore().sync
+
     # 2. Embed
-    print(f"Embedding knowledge Using {config.EMBEDDING_MODEL_ID}...")
-    model = SentenceTransformer(config.EMBEDDING_MODEL_ID)
-    
+    model = get_model()
+
     # 3. Create Index if needed
-    try:
-        r.execute_command("FT.INFO", INDEX_NAME)
-    except:
-        print("Creating Vector Index...")
-        dim = 384 # Default for all-MiniLM-L6-v2
-        r.execute_command(
-            "FT.CREATE", INDEX_NAME, "ON", "HASH", "PREFIX", "1", "doc:",
-            "SCHEMA", "content", "TEXT", "vector", "VECTOR", "FLAT", "6", "TYPE", "FLOAT32", "DIM", str(dim), "DISTANCE_METRIC", "COSINE"
-        )
+    ensure_index(r)
 
     # 4. Store
-    import hashlib
-    doc_id = hashlib.md5(text.encode()).hexdigest()
     vector = model.encode(text).astype(np.float32).tobytes()
-    
-    r.hset(f"doc:{doc_id}", mapping={
+
+    r.hset(f"doc:{doc_id(text)}", mapping={
         "content": text,
         "source": source,
         "vector": vector
     })
     print(f"Successfully ingested: {text[:50]}...")
 
-if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: python3 ingest.py \"Your knowledge text here\"")
+# ---------------------------------------------------------------- bulk mode
+
+def chunk_text(text: str, size: int, overlap: int) -> Iterator[str]:
+    """Splits long documents into ~size-char passages, preferring paragraph/word breaks."""
+    text = text.strip()
+    if len(text) <= size:
+        if text:
+            yield text
+        return
+    start = 0
+    while start < len(text):
+        end = min(start + size, len(text))
+        if end < len(text):
+            cut = text.rfind("\n\n", start + size // 2, end)
+            if cut == -1:
+                cut = text.rfind(" ", start + size // 2, end)
+            if cut != -1:
+                end = cut
+        chunk = text[start:end].strip()
+        if chunk:
+            yield chunk
+        if end >= len(text):
+            break
+        start = max(end - overlap, start + 1)
+
+def iter_documents(paths: Iterable[str]) -> Iterator[Tuple[str, str]]:
+    """Streams (text, source) from files, JSONL files and directories, one file at a time."""
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                for name in sorted(files):
+                    yield from iter_documents([os.path.join(root, name)])
+            continue
+
+        ext = os.path.splitext(path)[1].lower()
+        if ext in JSONL_EXTENSIONS:
+            with open(path, encoding="utf-8") as f:
+                for line_no, line in enumerate(f, 1):
+                    if not line.strip():
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        print(f"Skipping malformed line {path}:{line_no}")
+                        continue
+                    text = record.get("text") or record.get("content") or ""
+                    yield text, record.get("source", f"{path}:{line_no}")
+        elif ext in TEXT_EXTENSIONS:
+            with open(path, encoding="utf-8") as f:
+                yield f.read(), path
+
+def iter_chunks(paths: Iterable[str], chunk_size: int, overlap: int) -> Iterator[Tuple[str, str]]:
+    for text, source in iter_documents(paths):
+        for chunk in chunk_text(text, chunk_size, overlap):
+            yield chunk, source
+
+def _batches(items: Iterator, size: int) -> Iterator[List]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def bulk_ingest(
+    paths: List[str],
+    batch_size: int = 256,
+    chunk_size: int = 1000,
+    overlap: int = 100,
+    workers: int = 0,
+    write_chunk: int = 500,
+):
+    r = RedisStore().sync
+    model = get_model()
+    ensure_index(r)
+
+    # Optional multi-process encoding (one model copy per worker)
+    pool = model.start_multi_process_pool(["cpu"] * workers) if workers > 1 else None
+
+    seen = skipped = written = 0
+    started = time.time()
+    try:
+        # Each round: dedup against Redis, encode new passages, pipeline the writes
+        for batch in _batches(iter_chunks(paths, chunk_size, overlap), batch_size * 4):
+            unique = {}
+            for text, source in batch:
+                unique.setdefault(doc_id(text), (text, source))
+            seen += len(batch)
+
+            ids = list(unique)
+            pipe = r.pipeline(transaction=False)
+            for i in ids:
+                pipe.exists(f"doc:{i}")
+            fresh = [i for i, exists in zip(ids, pipe.execute()) if not exists]
+            skipped += len(batch) - len(fresh)
+            if not fresh:
+                continue
+
+            texts = [unique[i][0] for i in fresh]
+            if pool is not None:
+                vectors = model.encode_multi_process(texts, pool, batch_size=batch_size)
+            else:
+                vectors = model.encode(texts, batch_size=batch_size)
+            vectors = np.asarray(vectors, dtype=np.float32)
+
+            pipe = r.pipeline(transaction=False)
+            for n, (i, vector) in enumerate(zip(fresh, vectors), 1):
+                text, source = unique[i]
+                pipe.hset(f"doc:{i}", mapping={
+                    "content": text,
+                    "source": source,
+                    "vector": vector.tobytes()
+                })
+                if n % write_chunk == 0:
+                    pipe.execute()
+            pipe.execute()
+            written += len(fresh)
+
+            elapsed = time.time() - started
+            print(f"[ingest] {seen} passages | {written} written | {skipped} duplicates skipped | {seen / elapsed:.1f} docs/sec")
+    finally:
+        if pool is not None:
+            model.stop_multi_process_pool(pool)
+
+    elapsed = time.time() - started
+    print(f"Done: {written} new passages ({skipped} skipped) in {elapsed:.1f}s ({seen / max(elapsed, 1e-9):.1f} docs/sec)")
+
+def main(argv: List[str]):
+    parser = argparse.ArgumentParser(description="Ingest knowledge into the Gonyai RAG index.")
+    parser.add_argument("text", nargs="?", help="Single knowledge text to ingest")
+    parser.add_argument("--path", action="append", default=[], help="File, JSONL or directory to bulk ingest (repeatable)")
+    parser.add_argument("--batch-size", type=int, default=256, help="Embedding batch size")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="Max characters per passage")
+    parser.add_argument("--overlap", type=int, default=100, help="Characters shared between consecutive passages")
+    parser.add_argument("--workers", type=int, default=0, help="Encode across N processes (0 = in-process)")
+    parser.add_argument("--write-chunk", type=int, default=500, help="HSETs per pipeline flush")
+    args = parser.parse_args(argv)
+
+    if args.path:
+        bulk_ingest(args.path, args.batch_size, args.chunk_size, args.overlap, args.workers, args.write_chunk)
+    elif args.text:
+        ingest(args.text)
+    else:
+        parser.print_usage()
         sys.exit(1)
-    
-    input_text = sys.argv[1]
-    ingest(input_text)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,96 @@
+"""
+Prefix KV-Cache: keeps each session's past_key_values in process so the
+next turn only prefills the tokens that changed.
+
+Entries are keyed by session and validated by token prefix (longest common
+prefix with the new prompt), so reuse is always exact. Memory is bounded by
+total tensor bytes with LRU eviction.
+"""
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+from metrics import KV_CACHE_REQUESTS, KV_CACHE_REUSED_TOKENS, KV_CACHE_BYTES, KV_CACHE_ENTRIES
+
+
+def past_nbytes(past) -> int:
+    return sum(k.numel() * k.element_size() + v.numel() * v.element_size() for k, v in past)
+
+
+class _Entry:
+    def __init__(self, tokens: List[int], past, nbytes: int):
+        self.tokens = tokens
+        self.past = past
+        self.nbytes = nbytes
+
+
+class PrefixKVCache:
+    def __init__(self, max_bytes: int, min_prefix: int = 16):
+        self.max_bytes = max_bytes
+        self.min_prefix = min_prefix
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup(self, session_id: Optional[str], input_ids: List[int]) -> Tuple[Optional[tuple], int]:
+        """
+        Returns (past cropped to the reusable prefix, prefix length) or
+        (None, 0). The entry is handed over to the caller; the finished
+        request stores its extended cache back.
+        """
+        entry = None
+        if session_id is not None:
+            with self._lock:
+                entry = self._entries.pop(session_id, None)
+                if entry is not None:
+                    self.bytes -= entry.nbytes
+                self._report()
+
+        prefix = 0
+        if entry is not None:
+            limit = min(len(entry.tokens), len(input_ids) - 1)  # keep >= 1 token to produce logits
+            while prefix < limit and entry.tokens[prefix] == input_ids[prefix]:
+                prefix += 1
+
+        if entry is None or prefix < self.min_prefix:
+            self.misses += 1
+            KV_CACHE_REQUESTS.labels(status="miss").inc()
+            return None, 0
+
+        self.hits += 1
+        KV_CACHE_REQUESTS.labels(status="hit").inc()
+        KV_CACHE_REUSED_TOKENS.inc(prefix)
+        return tuple((k[:, :, :prefix], v[:, :, :prefix]) for k, v in entry.past), prefix
+
+    def store(self, session_id: Optional[str], tokens: List[int], past):
+        if session_id is None or len(tokens) < self.min_prefix:
+            return
+        nbytes = past_nbytes(past)
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(session_id, None)
+            if old is not None:
+                self.bytes -= old.nbytes
+            self._entries[session_id] = _Entry(tokens, past, nbytes)
+            self.bytes += nbytes
+            while self.bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.bytes -= evicted.nbytes
+            self._report()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+            self._report()
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def _report(self):
+        KV_CACHE_BYTES.set(self.bytes)
+        KV_CACHE_ENTRIES.set(len(self._entries))
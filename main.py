@@ -1,34 +1,107 @@
-from fastapi import FastAPI, Depends, HTTPException, Body
-from fastapi.responses import StreamingResponse, Response
-from redis import Redis
+import time
+_boot_started = time.perf_counter()  # startup phases are measured from the first import
+
+from fastapi import FastAPI, Depends, HTTPException, Body, Query, Request, Security
+from fastapi.responses import StreamingResponse, Response, JSONResponse
 from config import config
 import security
-import time
+import asyncio
+import copy
 import json
+import os
+import uuid
+from contextlib import contextmanager
+from typing import Optional
+from datastore import RedisStore
 from brain import ModelEngine
+from registry import ModelRegistry, UnknownModel, ModelUnavailable
+from admission import AdmissionController, Overloaded, Ticket
+from scheduler import SchedulerFull, SchedulerStopped
+from generation import ContextOverflow, GenerationBudget, budget_from_payload
 from memory import ConversationMemory
 from cache import SemanticMapper
-from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
+from embeddings import EmbeddingService
+from coalesce import Coalescer
+from prometheus_client import generate_latest, CollectorRegistry, CONTENT_TYPE_LATEST, multiprocess
+from metrics import (
+    CACHE_STATS, INFERENCE_LATENCY, API_REQUESTS, TIME_TO_FIRST_TOKEN, INTER_TOKEN_LATENCY, STARTUP_PHASE_SECONDS,
+)
+from tracing import Span, setup_tracing, span, traced
 
 app = FastAPI(title="Gonyai Production API", version="1.2.0")
 
-# Prometheus Metrics
-CACHE_STATS = Counter('gonyai_cache_requests_total', 'Total cache requests', ['status'])
-INFERENCE_LATENCY = Histogram('gonyai_inference_latency_seconds', 'Time spent processing AI inference')
-API_REQUESTS = Counter('gonyai_api_requests_total', 'Total API requests', ['endpoint', 'tier'])
-
-# Redis Connection using Config
-try:
-    redis_client = Redis(host=config.REDIS_HOST, port=config.REDIS_PORT, decode_responses=True)
-except Exception as e:
-    print(f"Error connecting to Redis: {e}")
-    redis_client = None
+# Shared, pooled Redis layer (sync + asyncio clients)
+store = RedisStore()
+redis_client = store.sync
 
 # Initialize Core Components
-brain = ModelEngine()
-memory = ConversationMemory(redis_client)
-# Cache versioned by model to prevent logical drift
-mapper = SemanticMapper(redis_client, model_hash=brain.get_model_hash())
+if config.MODEL_SERVER_SOCKET:
+    # Multi-worker mode: the weights live in modelserver.py, this worker forwards to it
+    from remote import ModelClient, RemoteRegistry, RemoteEmbedder, RemoteReranker
+    model_client = ModelClient()
+    registry = RemoteRegistry(model_client)
+    embedder = RemoteEmbedder(model_client)
+    reranker = RemoteReranker(model_client) if config.RERANKER_MODEL_ID else None
+else:
+    # Every servable model (MODEL_ID is "default"), loaded lazily under a memory budget
+    registry = ModelRegistry()
+    # One shared encoder: micro-batches embeddings across concurrent requests
+    embedder = EmbeddingService()
+    reranker = None
+brain = registry.default_engine
+memory = ConversationMemory(redis_client, async_client=store.aio,
+                            token_counter=lambda text: registry.default_engine.count_tokens(text))
+# Semantic cache per model version (keyed by get_model_hash) to prevent logical drift
+_mappers = {}
+
+def mapper_for(engine: ModelEngine) -> SemanticMapper:
+    model_hash = engine.get_model_hash()
+    if model_hash not in _mappers:
+        _mappers[model_hash] = SemanticMapper(redis_client, model_hash=model_hash, async_client=store.aio,
+                                              embedder=embedder, count_tokens=engine.count_tokens, reranker=reranker)
+    return _mappers[model_hash]
+
+mapper = mapper_for(brain)
+# Admission control per model: slots sized to what each engine decodes at once
+_admission = {}
+
+def admission_for(engine: ModelEngine) -> AdmissionController:
+    controller = _admission.get(engine.model_id)
+    if controller is None:
+        controller = _admission[engine.model_id] = AdmissionController(
+            max_concurrency=config.ADMISSION_MAX_CONCURRENCY or engine.capacity,
+            max_queue=config.ADMISSION_QUEUE_SIZE,
+            max_wait={"pro": config.ADMISSION_MAX_WAIT_PRO, "free": config.ADMISSION_MAX_WAIT_FREE},
+            free_queue_share=config.ADMISSION_FREE_QUEUE_SHARE,
+        )
+    return controller
+
+# Single-flight for identical fresh prompts (optionally shared across replicas)
+coalescer = Coalescer(
+    store.aio if config.COALESCE_ACROSS_REPLICAS else None,
+    lock_ttl=config.COALESCE_LOCK_TTL,
+) if config.ENABLE_COALESCING else None
+# Long-running housekeeping started on startup, cancelled on shutdown
+_background_tasks = []
+# Async batch jobs in progress on this replica
+_batch_jobs = set()
+
+# torch/transformers are not imported yet: they load with the model
+STARTUP_PHASE_SECONDS.labels(phase="import").set(time.perf_counter() - _boot_started)
+
+@contextmanager
+def _startup_phase(phase: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STARTUP_PHASE_SECONDS.labels(phase=phase).set(elapsed)
+        print(f"Startup phase '{phase}': {elapsed:.1f}s")
+
+async def authenticate(api_key: str = Security(security.API_KEY_HEADER)) -> dict:
+    with span("auth"):
+        return await security.averify_api_key(api_key, store.aio)
 
 @app.on_event("startup")
 async def startup_event():
@@ -39,23 +112,162 @@ async def startup_event():
         print("Identity Management (/generate-key) will be DISBALED.")
         print("Set your own secret via: docker run -e ADMIN_ROOT_KEY=my_secret")
         print("!" * 60 + "\n")
+
+    setup_tracing()
+
+    if not await store.aping():
+        print(f"WARNING: Redis at {config.REDIS_HOST}:{config.REDIS_PORT} is unreachable. Will retry per request.")
     
-    brain.load_model()
+    if config.BACKGROUND_LOAD:
+        # Liveness answers immediately; /health/ready stays 503 until the models are in
+        _background_tasks.append(asyncio.create_task(_load_models()))
+    else:
+        await _load_models()
+
+    if config.ENABLE_CACHE and config.CACHE_COMPACT_INTERVAL > 0:
+        _background_tasks.append(asyncio.create_task(_compact_cache_loop()))
+
+async def _load_models():
+    with _startup_phase("model_load"):
+        try:
+            await asyncio.to_thread(registry.load, registry.routes["default"])
+        except ModelUnavailable as e:
+            print(f"WARNING: {e}")
+    if config.ENABLE_CACHE or config.ENABLE_RAG:
+        # Load + warm the encoder now instead of on the first request
+        with _startup_phase("embedding_warmup"):
+            await asyncio.to_thread(embedder.warmup)
+    if config.ENABLE_RAG and config.RERANKER_MODEL_ID:
+        with _startup_phase("reranker_warmup"):
+            await asyncio.to_thread(mapper.retriever.warmup)
+    STARTUP_PHASE_SECONDS.labels(phase="total").set(time.perf_counter() - _boot_started)
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    for task in [*_background_tasks, *_batch_jobs]:
+        task.cancel()
+    embedder.stop()
+    await store.aclose()
+
+async def _compact_cache_loop():
+    """Periodic cache sweep; the SET NX lock lets one replica per interval do the work."""
+    while True:
+        await asyncio.sleep(config.CACHE_COMPACT_INTERVAL)
+        try:
+            if await store.aio.set("cachemeta:compactor", "1", nx=True, ex=config.CACHE_COMPACT_INTERVAL):
+                # Entries of every routed model survive; each model prunes its own usage set
+                live = await asyncio.to_thread(registry.model_hashes)
+                for model_mapper in [m for m in _mappers.values() if m.model_hash in live]:
+                    await model_mapper.acompact(keep=live)
+        except Exception as e:
+            print(f"Cache compaction error: {e}")
+
+@app.exception_handler(SchedulerFull)
+async def scheduler_full_handler(request: Request, exc: SchedulerFull):
+    """Queue saturation is a capacity problem: tell clients to back off."""
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "1"})
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, exc: Overloaded):
+    """Admission rejected the request up front: Retry-After is the estimated wait."""
+    return JSONResponse(status_code=exc.status_code, content={"detail": str(exc)},
+                        headers={"Retry-After": str(exc.retry_after)})
+
+@app.exception_handler(ContextOverflow)
+async def context_overflow_handler(request: Request, exc: ContextOverflow):
+    return JSONResponse(status_code=400, content={"detail": str(exc)})
+
+@app.exception_handler(UnknownModel)
+async def unknown_model_handler(request: Request, exc: UnknownModel):
+    return JSONResponse(status_code=404, content={"detail": f"Unknown model: {exc.args[0]}"})
+
+@app.exception_handler(ModelUnavailable)
+@app.exception_handler(SchedulerStopped)
+async def model_unavailable_handler(request: Request, exc: Exception):
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "30"})
+
+async def _route(payload: dict, key_data: dict):
+    """
+    Engine + cache namespace for this request (payload "model", else the
+    key's tier). The engine stays loaded until released (see _held).
+    """
+    engine = await registry.aroute(payload.get("model"), key_data.get("tier"))
+    try:
+        return engine, mapper_for(engine)
+    except BaseException:
+        engine.release()
+        raise
+
+@contextmanager
+def _held(engine: ModelEngine):
+    """Releases a routed engine once the response is done."""
+    try:
+        yield
+    finally:
+        engine.release()
+
+def _budget(payload: dict, key_data: dict) -> GenerationBudget:
+    """Payload max_tokens / stop / deadline_ms, defaulted and capped by the key's tier."""
+    try:
+        return budget_from_payload(payload, key_data["tier"])
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+async def _unless_disconnected(request: Request, awaitable):
+    """
+    Awaits a generation, cancelling it if the client hangs up first. Streams
+    are closed by the server on disconnect; plain requests are not.
+    """
+    work = asyncio.ensure_future(awaitable)
+    try:
+        while True:
+            done, _ = await asyncio.wait({work}, timeout=0.5)
+            if done:
+                return work.result()
+            if await request.is_disconnected():
+                raise HTTPException(status_code=499, detail="Client closed request")
+    finally:
+        work.cancel()
 
 @app.get("/")
-def read_root(key_data: dict = Depends(lambda k=Depends(security.API_KEY_HEADER): security.verify_api_key(k, redis_client))):
+async def read_root(key_data: dict = Depends(authenticate)):
     API_REQUESTS.labels(endpoint="/", tier=key_data['tier']).inc()
+    brain = registry.default_engine
+    # Off the event loop: a RemoteEngine may still have to ask the model server
+    device, precision = await asyncio.to_thread(lambda: (brain.device, brain.precision))
     return {
         "message": "Welcome to Gonyai Production AI Engine 🥥🤖",
-        "model": config.MODEL_ID,
-        "device": brain.device,
-        "quantization": "4-bit" if config.LOAD_IN_4BIT else ("8-bit" if config.LOAD_IN_8BIT else "None")
+        "model": brain.model_id,
+        "device": device,
+        "quantization": "4-bit" if config.LOAD_IN_4BIT else ("8-bit" if config.LOAD_IN_8BIT else "None"),
+        "precision": precision
     }
 
+@app.get("/models")
+async def list_models(key_data: dict = Depends(authenticate)):
+    """Servable models; pass one as "model" in the chat payload."""
+    return {"models": await asyncio.to_thread(registry.describe)}
+
+@app.post("/admin/models/swap")
+async def swap_model(
+    model_id: str = Query(...),
+    model: str = Query("default"),
+    admin_key: str = Depends(lambda k=Depends(security.API_KEY_HEADER): k)
+):
+    """Loads and warms `model_id` in the background, then flips `model` to it with no downtime."""
+    if admin_key != config.ADMIN_ROOT_KEY:
+        raise HTTPException(status_code=403, detail="Admin credentials required")
+    swapping = await asyncio.to_thread(lambda: registry.swapping)
+    if model in swapping:
+        raise HTTPException(status_code=409, detail=f"'{model}' is already swapping to {swapping[model]}")
+    _background_tasks.append(asyncio.create_task(registry.swap(model, model_id)))
+    return JSONResponse(status_code=202, content={"model": model, "model_id": model_id, "status": "warming"})
+
 @app.post("/chat")
-def chat_endpoint(
+async def chat_endpoint(
+    request: Request,
     payload: dict = Body(...),
-    key_data: dict = Depends(lambda k=Depends(security.API_KEY_HEADER): security.verify_api_key(k, redis_client))
+    key_data: dict = Depends(authenticate)
 ):
     API_REQUESTS.labels(endpoint="/chat", tier=key_data['tier']).inc()
     prompt = payload.get("prompt")
@@ -63,50 +275,117 @@ def chat_endpoint(
     
     if not prompt:
         raise HTTPException(status_code=400, detail="Prompt is required")
+    budget = _budget(payload, key_data)
 
-    # 1. SEMANTIC CACHE
-    if config.ENABLE_CACHE:
-        cached_res = mapper.get_cached_response(prompt)
-        if cached_res:
-            CACHE_STATS.labels(status='hit').inc()
-            return {
-                "response": cached_res,
-                "source": "semantic_cache",
-                "rag_context": None
-            }
-        CACHE_STATS.labels(status='miss').inc()
-
-    # 2. RAG
-    context = mapper.get_context(prompt) if config.ENABLE_RAG else None
-    final_prompt = f"Context: {context}\n\nQuestion: {prompt}" if context else prompt
-
-    # 3. MEMORY
-    history = memory.get_history(session_id) if config.ENABLE_MEMORY else []
-
-    # 4. INFERENCE
-    start_time = time.time()
-    with INFERENCE_LATENCY.time():
-        response = brain.predict(final_prompt, history)
-    
-    # 5. POST-PROCESS
-    if config.ENABLE_MEMORY:
-        memory.add_message(session_id, "user", prompt)
-        memory.add_message(session_id, "assistant", response)
-    
-    if config.ENABLE_CACHE:
-        mapper.store_cache(prompt, response)
+    brain, mapper = await _route(payload, key_data)
+    with _held(brain), span("chat", endpoint="/chat", model=brain.model_id) as request_span:
+        # Embed once, reuse across cache lookup, RAG and cache store
+        ctx = mapper.context(prompt)
 
-    return {
-        "response": response, 
-        "source": "model", 
-        "inference_time": round(time.time() - start_time, 2),
-        "rag_context": context[:100] + "..." if context else None
-    }
+        # 1. SEMANTIC CACHE (default-shaped answers only: a cached one ignores max_tokens / stop).
+        # Tiers share entries: a cached answer may be longer or shorter than this tier's default length.
+        if config.ENABLE_CACHE and not budget.custom:
+            with span("cache_lookup"):
+                cached_res = await mapper.aget_cached_response(prompt, ctx=ctx)
+            if cached_res:
+                CACHE_STATS.labels(status='hit').inc()
+                request_span.set(source="semantic_cache")
+                return {
+                    "response": cached_res,
+                    "source": "semantic_cache",
+                    "rag_context": None
+                }
+            CACHE_STATS.labels(status='miss').inc()
+
+        # 2. RAG + 3. MEMORY (independent lookups, overlapped)
+        context, history = await asyncio.gather(
+            traced("rag", mapper.aget_context(prompt, ctx=ctx)) if config.ENABLE_RAG else asyncio.sleep(0, result=None),
+            traced("history", memory.aget_history(session_id)) if config.ENABLE_MEMORY else asyncio.sleep(0, result=[]),
+        )
+        final_prompt = f"Context: {context}\n\nQuestion: {prompt}" if context else prompt
+
+        # 4. INFERENCE (identical fresh prompts share one generation)
+        start_time = time.time()
+        ticket = await _admit(brain, key_data["tier"], mapper, prompt, history, budget)
+        try:
+            flight = await _join_flight(mapper, prompt, ctx, history, budget,
+                                        lambda: _answer_once(brain, final_prompt, session_id, budget))
+            with INFERENCE_LATENCY.time(), span("inference"):
+                if flight:
+                    response = await _unless_disconnected(request, flight.text())
+                    # Followers report why the shared generation stopped
+                    budget.finish_reason = flight.outcome
+                else:
+                    response = await _unless_disconnected(
+                        request, brain.apredict(final_prompt, history, session_id=session_id, budget=budget))
+        finally:
+            if ticket:
+                ticket.release()
+        
+        # 5. POST-PROCESS
+        await _remember(mapper, session_id, prompt, response, ctx, cache=flight is None and budget.cacheable)
+
+        source = "model" if not flight or flight.leader else "coalesced"
+        request_span.set(source=source)
+        return {
+            "response": response, 
+            "source": source, 
+            "model": brain.model_id,
+            "finish_reason": budget.finish_reason,
+            "inference_time": round(time.time() - start_time, 2),
+            "rag_context": context[:100] + "..." if context else None
+        }
+
+async def _remember(mapper: SemanticMapper, session_id: str, prompt: str, response: str, ctx, cache: bool = True):
+    """Memory and cache writes for a finished turn, overlapped on the pool."""
+    with span("remember"):
+        await asyncio.gather(
+            memory.aadd_turn(session_id, prompt, response) if config.ENABLE_MEMORY else asyncio.sleep(0),
+            mapper.astore_cache(prompt, response, ctx=ctx) if config.ENABLE_CACHE and cache else asyncio.sleep(0),
+        )
+
+async def _admit(brain: ModelEngine, tier: str, mapper: SemanticMapper, prompt: str, history: list,
+                 budget: GenerationBudget) -> Optional[Ticket]:
+    """
+    A model slot for this request, or Overloaded (503/429) when the wait
+    would be too long. None when admission is off or the request joins a
+    generation already running here, which costs no model time.
+    """
+    if not config.ENABLE_ADMISSION:
+        return None
+    if coalescer and not history and budget.shareable and coalescer.active(_flight_key(mapper, prompt, budget)):
+        return None
+    with span("admission"):
+        return await admission_for(brain).acquire(tier)
+
+async def _join_flight(mapper: SemanticMapper, prompt: str, ctx, history: list, budget: GenerationBudget, factory):
+    """
+    Coalesces only prompts whose answer cannot depend on the session: with
+    history the output differs per conversation, and so it does with the
+    request's own length, stop sequences or deadline. The flight writes the
+    cache once, so callers skip it.
+    """
+    if not coalescer or history or not budget.shareable:
+        return None
+
+    async def store(response: str):
+        if config.ENABLE_CACHE:
+            await mapper.astore_cache(prompt, response, ctx=ctx)
+
+    return await coalescer.join(_flight_key(mapper, prompt, budget), factory, on_complete=store,
+                                outcome=lambda: budget.finish_reason)
+
+def _flight_key(mapper: SemanticMapper, prompt: str, budget: GenerationBudget) -> str:
+    # Tiers default to different answer lengths: a pro request must not get a free leader's shorter answer
+    return coalescer.key(f"{mapper.cache_idx}:{budget.max_new_tokens}", prompt)
+
+async def _answer_once(brain: ModelEngine, final_prompt: str, session_id: str, budget: GenerationBudget):
+    yield await brain.apredict(final_prompt, [], session_id=session_id, budget=budget)
 
 @app.post("/chat/stream")
 async def chat_stream_endpoint(
     payload: dict = Body(...),
-    key_data: dict = Depends(lambda k=Depends(security.API_KEY_HEADER): security.verify_api_key(k, redis_client))
+    key_data: dict = Depends(authenticate)
 ):
     """Real-time streaming endpoint for high-end UX."""
     API_REQUESTS.labels(endpoint="/chat/stream", tier=key_data['tier']).inc()
@@ -115,38 +394,235 @@ async def chat_stream_endpoint(
 
     if not prompt:
         raise HTTPException(status_code=400, detail="Prompt is required")
+    budget = _budget(payload, key_data)
 
-    # 1. Check Cache first
-    if config.ENABLE_CACHE:
-        cached_res = mapper.get_cached_response(prompt)
-        if cached_res:
-            CACHE_STATS.labels(status='hit').inc()
-            async def stream_cached():
-                yield f"data: {json.dumps({'token': cached_res, 'source': 'semantic_cache'})}\n\n"
-            return StreamingResponse(stream_cached(), media_type="text/event-stream")
-
-    CACHE_STATS.labels(status='miss').inc()
-    context = mapper.get_context(prompt) if config.ENABLE_RAG else None
-    final_prompt = f"Context: {context}\n\nQuestion: {prompt}" if context else prompt
-    history = memory.get_history(session_id) if config.ENABLE_MEMORY else []
+    brain, mapper = await _route(payload, key_data)
+    # Spans the whole response, which outlives this function
+    request_span = Span("chat_stream", endpoint="/chat/stream", model=brain.model_id)
+    ticket = None
+    try:
+        with request_span.activate():
+            ctx = mapper.context(prompt)
+
+            # 1. Check Cache first
+            if config.ENABLE_CACHE and not budget.custom:
+                with span("cache_lookup"):
+                    cached_res = await mapper.aget_cached_response(prompt, ctx=ctx)
+                if cached_res:
+                    CACHE_STATS.labels(status='hit').inc()
+                    request_span.set(source="semantic_cache")
+                    request_span.end()
+                    brain.release()
+                    async def stream_cached():
+                        yield f"data: {json.dumps({'token': cached_res, 'source': 'semantic_cache'})}\n\n"
+                    return StreamingResponse(stream_cached(), media_type="text/event-stream")
+
+            CACHE_STATS.labels(status='miss').inc()
+            context, history = await asyncio.gather(
+                traced("rag", mapper.aget_context(prompt, ctx=ctx)) if config.ENABLE_RAG else asyncio.sleep(0, result=None),
+                traced("history", memory.aget_history(session_id)) if config.ENABLE_MEMORY else asyncio.sleep(0, result=[]),
+            )
+            final_prompt = f"Context: {context}\n\nQuestion: {prompt}" if context else prompt
+            # The slot is held until the stream ends, not just until it starts
+            ticket = await _admit(brain, key_data["tier"], mapper, prompt, history, budget)
+            flight = await _join_flight(mapper, prompt, ctx, history, budget,
+                                        lambda: brain.aopen_stream(final_prompt, [], session_id=session_id, budget=budget))
+            tokens = flight or await brain.aopen_stream(final_prompt, history, session_id=session_id, budget=budget)
+    except BaseException:
+        if ticket:
+            ticket.release()
+        brain.release()
+        request_span.end()
+        raise
 
     async def event_generator():
         full_response = ""
-        for token in brain.stream_predict(final_prompt, history):
-            full_response += token
-            yield f"data: {json.dumps({'token': token, 'source': 'model'})}\n\n"
-        
-        if config.ENABLE_MEMORY:
-            memory.add_message(session_id, "user", prompt)
-            memory.add_message(session_id, "assistant", full_response)
-        if config.ENABLE_CACHE:
-            mapper.store_cache(prompt, full_response)
+        completed = False
+        with request_span.activate():
+            try:
+                with span("stream"):
+                    last = None
+                    try:
+                        async for token in tokens:
+                            now = time.perf_counter()
+                            if last is None:
+                                TIME_TO_FIRST_TOKEN.observe(now - request_span.started)
+                            else:
+                                INTER_TOKEN_LATENCY.observe(now - last)
+                            last = now
+                            full_response += token
+                            yield f"data: {json.dumps({'token': token, 'source': 'model'})}\n\n"
+                    finally:
+                        # Client disconnects close this generator: stop decoding for them too
+                        await tokens.aclose()
+                completed = True
+
+                # Only completed answers are remembered, and only complete default-shaped ones cached
+                await _remember(mapper, session_id, prompt, full_response, ctx, cache=flight is None and budget.cacheable)
+            finally:
+                if ticket:
+                    ticket.release()
+                brain.release()
+                request_span.set(completed=completed)
+                request_span.end()
 
     return StreamingResponse(event_generator(), media_type="text/event-stream")
 
+# ------------------------------------------------------------ batch API
+
+def _batch_prompts(payload: dict) -> list:
+    prompts = payload.get("prompts")
+    if not isinstance(prompts, list) or not prompts or not all(isinstance(p, str) and p for p in prompts):
+        raise HTTPException(status_code=400, detail="'prompts' must be a non-empty list of strings")
+    if len(prompts) > config.BATCH_API_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {config.BATCH_API_MAX_ITEMS} prompts per batch")
+    return prompts
+
+async def _authenticate_batch(api_key: str, items: int) -> dict:
+    """One auth + rate-limit round trip for the whole batch, charged per item."""
+    with span("auth"):
+        return await security.averify_api_key(api_key, store.aio, cost=items)
+
+async def _answer_batch(brain: ModelEngine, mapper: SemanticMapper, prompts: list, budget: GenerationBudget) -> list:
+    """
+    Bulk pipeline: one encode call for every prompt, one pipelined cache
+    lookup, then the misses (deduplicated) through the batch scheduler.
+    Items are stateless: no session memory is read or written. The budget
+    applies to every item (a deadline covers the whole batch).
+    """
+    ctxs = await mapper.acontexts(prompts) if config.ENABLE_CACHE or config.ENABLE_RAG else [mapper.context(p) for p in prompts]
+    with span("cache_lookup"):
+        cached = [None] * len(prompts) if budget.custom else await mapper.aget_cached_responses(ctxs)
+
+    results = [None] * len(prompts)
+    misses = {}
+    for i, response in enumerate(cached):
+        if response is not None:
+            results[i] = {"response": response, "source": "semantic_cache"}
+        else:
+            misses.setdefault(prompts[i], []).append(i)
+    if config.ENABLE_CACHE:
+        CACHE_STATS.labels(status='hit').inc(len(prompts) - sum(len(idx) for idx in misses.values()))
+        CACHE_STATS.labels(status='miss').inc(sum(len(idx) for idx in misses.values()))
+
+    # Enough in flight to keep one decode batch full without flooding the shared queue
+    slots = asyncio.Semaphore(max(1, config.BATCH_MAX_SIZE))
+
+    async def answer(prompt: str) -> dict:
+        ctx = ctxs[misses[prompt][0]]
+        item_budget = copy.copy(budget)
+        async with slots:
+            try:
+                context = await mapper.aget_context(prompt, ctx=ctx) if config.ENABLE_RAG else None
+                final_prompt = f"Context: {context}\n\nQuestion: {prompt}" if context else prompt
+                # Batch items take slots last, after every waiting interactive request
+                ticket = await admission_for(brain).acquire("batch") if config.ENABLE_ADMISSION else None
+                try:
+                    with INFERENCE_LATENCY.time():
+                        response = await brain.apredict(final_prompt, [], budget=item_budget)
+                finally:
+                    if ticket:
+                        ticket.release()
+            except Exception as e:
+                return {"error": str(e), "source": "model"}
+        if config.ENABLE_CACHE and item_budget.cacheable:
+            await mapper.astore_cache(prompt, response, ctx=ctx)
+        return {"response": response, "source": "model", "finish_reason": item_budget.finish_reason}
+
+    with span("inference"):
+        answers = await asyncio.gather(*[answer(prompt) for prompt in misses])
+    for prompt, result in zip(misses, answers):
+        for i in misses[prompt]:
+            results[i] = result
+    return results
+
+@app.post("/chat/batch")
+async def chat_batch_endpoint(
+    payload: dict = Body(...),
+    api_key: str = Security(security.API_KEY_HEADER)
+):
+    """Many prompts in one call: {"prompts": [...], "model": optional}. Rate limit is charged per prompt."""
+    prompts = _batch_prompts(payload)
+    key_data = await _authenticate_batch(api_key, len(prompts))
+    API_REQUESTS.labels(endpoint="/chat/batch", tier=key_data['tier']).inc()
+    budget = _budget(payload, key_data)
+
+    brain, mapper = await _route(payload, key_data)
+    started = time.time()
+    with _held(brain), span("chat_batch", endpoint="/chat/batch", model=brain.model_id, items=len(prompts)):
+        results = await _answer_batch(brain, mapper, prompts, budget)
+    return {"results": results, "model": brain.model_id, "inference_time": round(time.time() - started, 2)}
+
+@app.post("/chat/batch/jobs")
+async def create_batch_job(
+    payload: dict = Body(...),
+    api_key: str = Security(security.API_KEY_HEADER)
+):
+    """Async variant for large offline runs: returns a job id to poll."""
+    prompts = _batch_prompts(payload)
+    key_data = await _authenticate_batch(api_key, len(prompts))
+    API_REQUESTS.labels(endpoint="/chat/batch/jobs", tier=key_data['tier']).inc()
+    budget = _budget(payload, key_data)
+    brain, mapper = await _route(payload, key_data)
+
+    job_id = uuid.uuid4().hex
+    job_key = f"batchjob:{job_id}"
+    try:
+        await store.aio.hset(job_key, mapping={
+            "status": "queued",
+            "owner": security.hash_api_key(api_key),
+            "model": brain.model_id,
+            "total": len(prompts),
+            "created_at": time.time(),
+        })
+        await store.aio.expire(job_key, config.BATCH_JOB_TTL)
+    except BaseException:
+        brain.release()
+        raise
+
+    task = asyncio.create_task(_run_batch_job(job_key, brain, mapper, prompts, budget))
+    _batch_jobs.add(task)
+    task.add_done_callback(_batch_jobs.discard)
+    # The job holds its model until it is done
+    task.add_done_callback(lambda _: brain.release())
+    return JSONResponse(status_code=202, content={"job_id": job_id, "status": "queued"})
+
+async def _run_batch_job(job_key: str, brain: ModelEngine, mapper: SemanticMapper, prompts: list, budget: GenerationBudget):
+    # Jobs live on the replica that accepted them: a restart leaves them "running" until they expire
+    await store.aio.hset(job_key, "status", "running")
+    try:
+        with span("chat_batch", endpoint="/chat/batch/jobs", model=brain.model_id, items=len(prompts)):
+            results = await _answer_batch(brain, mapper, prompts, budget)
+        update = {"status": "done", "results": json.dumps(results)}
+    except Exception as e:
+        print(f"Batch job {job_key} failed: {e}")
+        update = {"status": "failed", "error": str(e)}
+    update["finished_at"] = time.time()
+    await store.aio.hset(job_key, mapping=update)
+    await store.aio.expire(job_key, config.BATCH_JOB_TTL)
+
+@app.get("/chat/batch/jobs/{job_id}")
+async def get_batch_job(job_id: str, api_key: str = Security(security.API_KEY_HEADER)):
+    with span("auth"):
+        key_data = await security.averify_api_key(api_key, store.aio)
+    API_REQUESTS.labels(endpoint="/chat/batch/jobs/{id}", tier=key_data['tier']).inc()
+    job = await store.aio.hgetall(f"batchjob:{job_id}")
+    # Other keys' jobs are indistinguishable from missing ones
+    if not job or job.get("owner") != security.hash_api_key(api_key):
+        raise HTTPException(status_code=404, detail="Job not found")
+    job.pop("owner")
+    if "results" in job:
+        job["results"] = json.loads(job["results"])
+    job["job_id"] = job_id
+    return job
+
 @app.get("/metrics")
 def metrics():
-    """Standard Prometheus metrics endpoint."""
+    """Standard Prometheus metrics endpoint (all workers + the model server in multi-worker mode)."""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        collected = CollectorRegistry()
+        multiprocess.MultiProcessCollector(collected)
+        return Response(content=generate_latest(collected), media_type=CONTENT_TYPE_LATEST)
     return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
 
 @app.post("/generate-key")
@@ -158,7 +634,7 @@ def generate_key(
     if admin_key != config.ADMIN_ROOT_KEY:
         raise HTTPException(status_code=403, detail="Admin credentials required")
         
-    if not redis_client:
+    if not store.ping():
         raise HTTPException(status_code=503, detail="Database unavailable")
         
     raw_key = security.generate_api_key()
@@ -176,9 +652,19 @@ def generate_key(
         "window": config.RATE_WINDOW
     }
 
+@app.get("/health/live")
+def liveness_check():
+    """Process is up and serving HTTP; says nothing about model or Redis."""
+    return {"status": "alive"}
+
 @app.get("/health/ready")
-def readiness_check():
+async def readiness_check():
     """Specific probe for K8s to detect when the AI Brain is loaded."""
-    if not brain.ready:
+    if not await asyncio.to_thread(lambda: registry.ready):
         raise HTTPException(status_code=503, detail="Model still loading")
+    if (config.ENABLE_CACHE or config.ENABLE_RAG) and not embedder.ready:
+        raise HTTPException(status_code=503, detail="Embedding model still loading")
+    # Without Redis every request fails auth: take the pod out of rotation
+    if not await store.aping():
+        raise HTTPException(status_code=503, detail="Redis unavailable")
     return {"status": "ready"}
@@ -1,35 +1,136 @@
 from redis import Redis
+from redis.asyncio import Redis as AsyncRedis
+from typing import Callable, List, Optional
+from config import config
 import json
+import re
+
+def estimate_tokens(text: str) -> int:
+    """Cheap fallback when no tokenizer is available (~4 chars per token)."""
+    return max(1, len(text) // 4)
+
+def extractive_summary(messages: List[dict], max_tokens: int, count_tokens: Callable[[str], int]) -> str:
+    """
+    Default summarizer: first sentence of each older message, oldest first,
+    cut off at the token budget. No model call, so it is safe on the hot path.
+    """
+    lines = []
+    used = 0
+    for m in messages:
+        first = re.split(r"(?<=[.!?।])\s", m["content"].strip(), maxsplit=1)[0]
+        line = f"{m['role']}: {first}"
+        cost = count_tokens(line)
+        if used + cost > max_tokens:
+            break
+        lines.append(line)
+        used += cost
+    return " | ".join(lines)
 
 class ConversationMemory:
-    def __init__(self, redis_client: Redis):
+    def __init__(
+        self,
+        redis_client: Redis,
+        async_client: Optional[AsyncRedis] = None,
+        token_counter: Optional[Callable[[str], int]] = None,
+        summarizer: Optional[Callable[[List[dict], int, Callable[[str], int]], str]] = None,
+    ):
         self.redis = redis_client
+        self.aredis = async_client
         self.ttl = 3600  # 1 hour expiration for sessions
+        self.count_tokens = token_counter or estimate_tokens
+        self.summarizer = summarizer or extractive_summary
 
     def _get_key(self, session_id: str) -> str:
         return f"chat:history:{session_id}"
 
-    def add_message(self, session_id: str, role: str, content: str):
-        if not self.redis:
-            return
-            
+    def _encode(self, role: str, content: str) -> str:
+        # Token count is computed once at write time, not on every read
+        return json.dumps({"role": role, "content": content, "tokens": self.count_tokens(content)})
+
+    def _queue_writes(self, pipe, session_id: str, messages: List[str]):
         key = self._get_key(session_id)
-        message = json.dumps({"role": role, "content": content})
-        
         # Push to the right (end) of the list
-        self.redis.rpush(key, message)
-        
-        # Trim to keep last 15 messages (Sliding Window)
-        # LLM Context protection: prevents session overflow
-        self.redis.ltrim(key, -15, -1)
-        
+        pipe.rpush(key, *messages)
+        # Hard cap on stored messages; the token budget is applied on read
+        pipe.ltrim(key, -config.MEMORY_MAX_MESSAGES, -1)
         # Refresh TTL
-        self.redis.expire(key, self.ttl)
+        pipe.expire(key, self.ttl)
+
+    def add_message(self, session_id: str, role: str, content: str):
+        if not self.redis:
+            return
+
+        pipe = self.redis.pipeline(transaction=True)
+        self._queue_writes(pipe, session_id, [self._encode(role, content)])
+        pipe.execute()
+
+    def add_turn(self, session_id: str, user: str, assistant: str):
+        """Stores a whole user/assistant turn in one MULTI/EXEC round trip."""
+        if not self.redis:
+            return
+
+        pipe = self.redis.pipeline(transaction=True)
+        self._queue_writes(pipe, session_id, [self._encode("user", user), self._encode("assistant", assistant)])
+        pipe.execute()
 
-    def get_history(self, session_id: str) -> list:
+    def get_history(self, session_id: str, max_tokens: Optional[int] = None) -> list:
         if not self.redis:
             return []
-            
+
         key = self._get_key(session_id)
         messages_raw = self.redis.lrange(key, 0, -1)
-        return [json.loads(m) for m in messages_raw]
+        return self._fit_budget([json.loads(m) for m in messages_raw], max_tokens)
+
+    async def aadd_message(self, session_id: str, role: str, content: str):
+        if not self.aredis:
+            return
+
+        pipe = self.aredis.pipeline(transaction=True)
+        self._queue_writes(pipe, session_id, [self._encode(role, content)])
+        await pipe.execute()
+
+    async def aadd_turn(self, session_id: str, user: str, assistant: str):
+        if not self.aredis:
+            return
+
+        pipe = self.aredis.pipeline(transaction=True)
+        self._queue_writes(pipe, session_id, [self._encode("user", user), self._encode("assistant", assistant)])
+        await pipe.execute()
+
+    async def aget_history(self, session_id: str, max_tokens: Optional[int] = None) -> list:
+        if not self.aredis:
+            return []
+
+        key = self._get_key(session_id)
+        messages_raw = await self.aredis.lrange(key, 0, -1)
+        return self._fit_budget([json.loads(m) for m in messages_raw], max_tokens)
+
+    def _fit_budget(self, messages: List[dict], max_tokens: Optional[int] = None) -> list:
+        """
+        Keeps the newest messages that fit in the token budget. Older turns
+        are dropped or, with MEMORY_SUMMARIZE, folded into a short summary
+        on the first kept user message (template-safe: no system role).
+        """
+        budget = config.MAX_HISTORY_TOKENS if max_tokens is None else max_tokens
+        summary_budget = min(config.MEMORY_SUMMARY_TOKENS, budget // 4) if config.MEMORY_SUMMARIZE else 0
+
+        kept, used = [], 0
+        for m in reversed(messages):
+            cost = m.get("tokens") or self.count_tokens(m["content"])
+            if used + cost > budget - summary_budget:
+                break
+            kept.append(m)
+            used += cost
+        kept.reverse()
+
+        # Chat templates expect the conversation to open with a user turn
+        while kept and kept[0]["role"] != "user":
+            kept.pop(0)
+
+        history = [{"role": m["role"], "content": m["content"]} for m in kept]
+        dropped = messages[:len(messages) - len(kept)]
+        if summary_budget and dropped and history:
+            summary = self.summarizer(dropped, summary_budget, self.count_tokens)
+            if summary:
+                history[0]["content"] = f"(Earlier in this conversation: {summary})\n\n{history[0]['content']}"
+        return history
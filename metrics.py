@@ -0,0 +1,57 @@
+"""
+Prometheus metrics shared across the Gonyai modules.
+Kept in one place so components outside main.py can report without
+importing the FastAPI app.
+"""
+from prometheus_client import Counter, Gauge, Histogram
+
+CACHE_STATS = Counter('gonyai_cache_requests_total', 'Total cache requests', ['status'])
+INFERENCE_LATENCY = Histogram('gonyai_inference_latency_seconds', 'Time spent processing AI inference')
+
+# Pipeline stages (auth, embed, cache_lookup, rag, history, inference, remember, ...)
+STAGE_LATENCY = Histogram('gonyai_stage_latency_seconds', 'Latency of each chat pipeline stage', ['stage'],
+                          buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30))
+TIME_TO_FIRST_TOKEN = Histogram('gonyai_time_to_first_token_seconds', 'Request start to first streamed token',
+                                buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10))
+INTER_TOKEN_LATENCY = Histogram('gonyai_inter_token_latency_seconds', 'Gap between consecutive streamed tokens',
+                                buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1))
+QUEUE_WAIT = Histogram('gonyai_queue_wait_seconds', 'Submit to admission into the decode batch',
+                       buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5))
+PROMPT_TOKENS = Counter('gonyai_prompt_tokens_total', 'Prompt tokens sent to the model (chat template included)')
+OUTPUT_TOKENS = Counter('gonyai_output_tokens_total', 'Tokens generated by the model')
+# Decode work that reached nobody = output - delivered (disconnects, stop sequences, cancelled waits)
+DELIVERED_TOKENS = Counter('gonyai_delivered_tokens_total', 'Generated tokens that reached the caller')
+GENERATION_FINISHED = Counter('gonyai_generation_finished_total', 'Generations by why decoding stopped', ['reason'])
+API_REQUESTS = Counter('gonyai_api_requests_total', 'Total API requests', ['endpoint', 'tier'])
+CACHE_TIER_HITS = Counter('gonyai_cache_tier_hits_total', 'Semantic cache hits by tier', ['tier'])
+COALESCED_REQUESTS = Counter('gonyai_coalesced_requests_total', 'Requests served by another request\'s in-flight generation', ['scope'])
+EMBEDDING_BATCH_SIZE = Histogram('gonyai_embedding_batch_size', 'Prompts encoded per embedding forward pass', buckets=(1, 2, 4, 8, 16, 32, 64))
+
+# Admission control (queue depth is the autoscaling signal, see k8s/hpa.yaml)
+ADMISSION_QUEUE_DEPTH = Gauge('gonyai_admission_queue_depth', 'Requests waiting for a model slot', ['tier'])
+ADMISSION_IN_FLIGHT = Gauge('gonyai_admission_in_flight', 'Requests holding a model slot')
+ADMISSION_REJECTED = Counter('gonyai_admission_rejected_total', 'Requests turned away by admission control', ['tier', 'reason'])
+ADMISSION_WAIT = Histogram('gonyai_admission_wait_seconds', 'Time spent waiting for a model slot', ['tier'],
+                           buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30))
+
+# Cold start (import, model_load, embedding_warmup, reranker_warmup, total)
+STARTUP_PHASE_SECONDS = Gauge('gonyai_startup_phase_seconds', 'Duration of each startup phase', ['phase'])
+
+# Model registry
+MODEL_MEMORY_BYTES = Gauge('gonyai_model_memory_bytes', 'Weights held by each loaded model', ['model'])
+MODEL_LOADS = Counter('gonyai_model_loads_total', 'Model loads by the registry', ['model', 'outcome'])
+MODEL_EVICTIONS = Counter('gonyai_model_evictions_total', 'Models unloaded to stay under MODEL_MEMORY_BUDGET_MB')
+
+# Prefix KV-cache (hit rate = hit / (hit + miss))
+KV_CACHE_REQUESTS = Counter('gonyai_kv_cache_requests_total', 'Prefix KV-cache lookups', ['status'])
+KV_CACHE_REUSED_TOKENS = Counter('gonyai_kv_cache_reused_tokens_total', 'Prompt tokens served from the prefix KV-cache instead of prefill')
+KV_CACHE_BYTES = Gauge('gonyai_kv_cache_bytes', 'Bytes of past_key_values held by the prefix KV-cache')
+KV_CACHE_ENTRIES = Gauge('gonyai_kv_cache_entries', 'Sessions held by the prefix KV-cache')
+
+# Generation speed and speculative decoding (acceptance = accepted / drafted)
+GENERATION_TOKENS_PER_SECOND = Histogram('gonyai_generation_tokens_per_second', 'Decode throughput per request', ['mode'],
+                                         buckets=(1, 2, 5, 10, 20, 50, 100, 200))
+SPEC_ACCEPTED_TOKENS = Counter('gonyai_speculative_accepted_tokens_total', 'Draft tokens accepted by the target model', ['mode'])
+SPEC_DRAFTED_TOKENS = Counter('gonyai_speculative_drafted_tokens_total', 'Draft tokens proposed (prompt lookup: upper bound)', ['mode'])
+SPEC_ACCEPTANCE_RATE = Histogram('gonyai_speculative_acceptance_rate', 'Per-request share of drafted tokens accepted', ['mode'],
+                                 buckets=(0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0))
@@ -0,0 +1,333 @@
+"""
+Model Server: one process holding the weights for many HTTP workers.
+
+`uvicorn --workers N` on its own loads the LLM and the sentence encoder N
+times. In this mode they are loaded once, here, and the workers (started
+with MODEL_SERVER_SOCKET) forward generation, token counting, embedding
+and re-ranking over a Unix socket (see remote.py). Concurrent workers'
+requests meet in the same continuous-batching scheduler and embedding
+micro-batcher, so they batch with each other too.
+
+    python3 modelserver.py --workers 4              # model server + 4 API workers
+    python3 modelserver.py --socket /run/gonyai.sock # model server only
+"""
+import argparse
+import asyncio
+import os
+import pickle
+import secrets
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+from multiprocessing.connection import Connection, Listener
+from typing import Dict, List, Optional
+from config import config
+from generation import GenerationBudget
+
+DEFAULT_SOCKET = "/tmp/gonyai-model.sock"
+
+
+def _portable(error: Exception) -> Exception:
+    """The error itself if it survives pickling (SchedulerFull, UnknownModel...), else a plain copy."""
+    try:
+        pickle.dumps(error)
+        return error
+    except Exception:
+        return RuntimeError(f"{type(error).__name__}: {error}")
+
+
+class _Peer:
+    """One worker connection: its in-flight calls, cancellable by request id."""
+    def __init__(self, conn: Connection):
+        self.conn = conn
+        self.tasks: Dict[int, asyncio.Task] = {}
+        self.leases: list = []  # engines routed for this worker's requests, until released
+        self._send_lock = threading.Lock()
+
+    def send(self, message: tuple):
+        try:
+            with self._send_lock:
+                self.conn.send(message)
+        except (OSError, EOFError):
+            # Worker gone: its reader cancels the rest
+            pass
+
+
+class ModelServer:
+    # Calls that get the calling worker's _Peer first: its leases end with its connection
+    PEER_CALLS = {"route", "release"}
+
+    def __init__(self, address: str, authkey: Optional[bytes], registry=None, embedder=None):
+        from registry import ModelRegistry
+        from embeddings import EmbeddingService
+        self.address = address
+        self.authkey = authkey
+        self.registry = registry or ModelRegistry()
+        self.embedder = embedder or EmbeddingService()
+        self._reranker = None
+        self._reranker_lock = threading.Lock()
+        self._listener: Optional[Listener] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    # ------------------------------------------------------------ lifecycle
+
+    def listen(self):
+        """Binds the socket (before loading, so workers can connect and wait)."""
+        if os.path.exists(self.address):
+            os.unlink(self.address)
+        self._listener = Listener(self.address, family="AF_UNIX", authkey=self.authkey)
+        os.chmod(self.address, 0o600)
+        print(f"Model server listening on {self.address}")
+
+    async def serve(self, stop: asyncio.Event):
+        self._loop = asyncio.get_running_loop()
+        if self._listener is None:
+            self.listen()
+        threading.Thread(target=self._accept, name="model-server-accept", daemon=True).start()
+        boot = asyncio.create_task(self._boot())
+        await stop.wait()
+        boot.cancel()
+        self._listener.close()
+        if os.path.exists(self.address):
+            os.unlink(self.address)
+        self.embedder.stop()
+
+    async def _boot(self):
+        try:
+            await self.registry._aload(self.registry.routes["default"])
+        except Exception as e:
+            print(f"WARNING: {e}")
+        if config.ENABLE_CACHE or config.ENABLE_RAG:
+            await self.rpc_embedding_warmup()
+        if config.ENABLE_RAG and config.RERANKER_MODEL_ID:
+            await asyncio.to_thread(self.rerank_model.predict, [("warmup", "warmup")])
+        print("Model server ready.")
+
+    def _accept(self):
+        while True:
+            try:
+                conn = self._listener.accept()
+            except OSError:
+                return  # listener closed
+            except Exception as e:
+                # Wrong authkey and friends: refuse that client, keep serving
+                print(f"Model server rejected a connection: {e}")
+                continue
+            threading.Thread(target=self._read, args=(_Peer(conn),), name="model-server-peer", daemon=True).start()
+
+    def _read(self, peer: _Peer):
+        try:
+            while True:
+                message = peer.conn.recv()
+                self._loop.call_soon_threadsafe(self._dispatch, peer, message)
+        except (OSError, EOFError):
+            pass
+        finally:
+            self._loop.call_soon_threadsafe(self._drop, peer)
+            peer.conn.close()
+
+    def _drop(self, peer: _Peer):
+        """Worker exited: stop generating for it and let its models be evicted again."""
+        for task in list(peer.tasks.values()):
+            task.cancel()
+        while peer.leases:
+            peer.leases.pop().release()
+
+    def _dispatch(self, peer: _Peer, message: tuple):
+        kind, rid = message[0], message[1]
+        if kind == "cancel":
+            task = peer.tasks.get(rid)
+            if task is not None:
+                task.cancel()
+            return
+        _, _, method, args, kwargs = message
+        run = self._call if kind == "call" else self._stream
+        task = peer.tasks[rid] = asyncio.create_task(run(peer, rid, method, args, kwargs))
+        task.add_done_callback(lambda _: peer.tasks.pop(rid, None))
+
+    async def _call(self, peer: _Peer, rid: int, method: str, args: tuple, kwargs: dict):
+        try:
+            handler = getattr(self, f"rpc_{method}", None)
+            if handler is None:
+                raise AttributeError(f"Unknown model server call: {method}")
+            if method in self.PEER_CALLS:
+                args = (peer, *args)
+            peer.send((rid, "ok", await handler(*args, **kwargs)))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            peer.send((rid, "error", _portable(e)))
+
+    async def _stream(self, peer: _Peer, rid: int, method: str, args: tuple, kwargs: dict):
+        tokens = None
+        try:
+            tokens, result = await getattr(self, f"stream_{method}")(*args, **kwargs)
+            # Admitted and queued: the worker may start its HTTP response now
+            peer.send((rid, "accepted", None))
+            async for token in tokens:
+                peer.send((rid, "token", token))
+            peer.send((rid, "end", result()))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            peer.send((rid, "error", _portable(e)))
+        finally:
+            if tokens is not None:
+                # Cancelled by the worker (client disconnect): frees the batch slot
+                await tokens.aclose()
+
+    # ------------------------------------------------------------ models
+
+    async def _engine(self, model_id: str):
+        engine = self.registry.engine(model_id)
+        if not engine.ready:
+            engine = await self.registry._aload(model_id)
+        return engine
+
+    @property
+    def rerank_model(self):
+        if self._reranker is None:
+            with self._reranker_lock:
+                if self._reranker is None:
+                    from sentence_transformers import CrossEncoder
+                    print(f"Loading Re-Ranker: {config.RERANKER_MODEL_ID}...")
+                    self._reranker = CrossEncoder(config.RERANKER_MODEL_ID, device="cpu")
+        return self._reranker
+
+    async def rpc_ready(self) -> bool:
+        embedding_ok = self.embedder.ready or not (config.ENABLE_CACHE or config.ENABLE_RAG)
+        return self.registry.ready and embedding_ok
+
+    async def rpc_route(self, peer: _Peer, requested: Optional[str], tier: Optional[str]):
+        """Routes and acquires the engine for the worker's request; the worker sends release when done."""
+        alias = self.registry.resolve(requested, tier)
+        engine = await self.registry.aroute(alias)
+        peer.leases.append(engine)
+        return alias, engine.model_id, await self.rpc_info(engine.model_id)
+
+    async def rpc_release(self, peer: _Peer, model_id: str):
+        for i, engine in enumerate(peer.leases):
+            if engine.model_id == model_id:
+                del peer.leases[i]
+                engine.release()
+                return
+
+    async def rpc_info(self, model_id: str) -> dict:
+        engine = self.registry.engine(model_id)
+        return {
+            "ready": engine.ready,
+            "device": engine.device,
+            "precision": engine.precision,
+            "capacity": engine.capacity,
+            "idle": engine.idle,
+            "memory_bytes": engine.memory_bytes,
+        }
+
+    async def rpc_load(self, model_id: str) -> dict:
+        await self._engine(model_id)
+        return await self.rpc_info(model_id)
+
+    async def rpc_unload(self, model_id: str):
+        await asyncio.to_thread(self.registry.unload, model_id)
+
+    async def rpc_describe(self) -> List[dict]:
+        return self.registry.describe()
+
+    async def rpc_model_hashes(self):
+        return self.registry.model_hashes()
+
+    async def rpc_swapping(self) -> Dict[str, str]:
+        return dict(self.registry.swapping)
+
+    async def rpc_swap(self, alias: str, model_id: str) -> bool:
+        return await self.registry.swap(alias, model_id)
+
+    async def rpc_count_tokens(self, model_id: str, text: str) -> int:
+        return self.registry.engine(model_id).count_tokens(text)
+
+    async def rpc_predict(self, model_id: str, prompt: str, history: list, session_id: Optional[str] = None,
+                          budget: Optional[GenerationBudget] = None):
+        """(answer, finish reason)"""
+        engine = await self._engine(model_id)
+        budget = budget or GenerationBudget()
+        text = await engine.apredict(prompt, history, session_id=session_id, budget=budget)
+        return text, budget.finish_reason
+
+    async def stream_stream(self, model_id: str, prompt: str, history: list, session_id: Optional[str] = None,
+                            budget: Optional[GenerationBudget] = None):
+        """(tokens, finish reason once they are exhausted)"""
+        engine = await self._engine(model_id)
+        budget = budget or GenerationBudget()
+        return engine.astream_predict(prompt, history, session_id=session_id, budget=budget), lambda: budget.finish_reason
+
+    # ------------------------------------------------------------ embeddings
+
+    async def rpc_embedding_warmup(self):
+        if not self.embedder.ready:
+            await asyncio.to_thread(self.embedder.warmup)
+
+    async def rpc_embedding_dimension(self) -> int:
+        return await asyncio.to_thread(lambda: self.embedder.dimension)
+
+    async def rpc_encode(self, texts: List[str], batch_size: int = 32):
+        return await asyncio.to_thread(self.embedder.encode, texts, batch_size)
+
+    async def rpc_encode_one(self, text: str):
+        return await self.embedder.aencode_one(text)
+
+    async def rpc_rerank(self, pairs: list) -> List[float]:
+        scores = await asyncio.to_thread(self.rerank_model.predict, pairs)
+        return [float(s) for s in scores]
+
+
+def main(argv: List[str]):
+    parser = argparse.ArgumentParser(description="Serve the models to several API worker processes.")
+    parser.add_argument("--socket", default=config.MODEL_SERVER_SOCKET or DEFAULT_SOCKET)
+    parser.add_argument("--workers", type=int, default=0, help="Also start uvicorn with this many workers (0 = server only)")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args(argv)
+    if args.workers and not os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        # prometheus_client picks in-memory or file-backed storage when it is first imported (config
+        # and generation above already did): restart with the directory set, so /metrics, which every
+        # worker merges from it, includes this process's generation metrics too
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="gonyai-metrics-")
+        os.execv(sys.executable, [sys.executable, os.path.abspath(__file__), *argv])
+
+    authkey = config.MODEL_SERVER_AUTHKEY or secrets.token_hex(16)
+    env = dict(os.environ, MODEL_SERVER_SOCKET=args.socket, MODEL_SERVER_AUTHKEY=authkey)
+    if args.workers:
+        env["WEB_CONCURRENCY"] = str(args.workers)
+
+    server = ModelServer(args.socket, authkey.encode())
+    server.listen()
+    workers = None
+    if args.workers:
+        workers = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--host", args.host, "--port", str(args.port),
+             "--workers", str(args.workers)],
+            env=env,
+        )
+
+    async def run():
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, stop.set)
+        if workers is not None:
+            # The API is useless without its model server and vice versa: exit together
+            loop.create_task(asyncio.to_thread(workers.wait)).add_done_callback(lambda _: stop.set())
+        await server.serve(stop)
+
+    try:
+        asyncio.run(run())
+    finally:
+        if workers is not None and workers.poll() is None:
+            workers.terminate()
+            workers.wait(timeout=30)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
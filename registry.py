@@ -0,0 +1,219 @@
+"""
+Model Registry: several ModelEngines behind one API.
+
+- Aliases map to model ids: "default" is MODEL_ID, more come from
+  MODEL_ROUTES ("fast=org/small,large=org/big").
+- Requests pick a model by payload (`"model": "fast"`), else by API key
+  tier (MODEL_TIER_ROUTES), else the default.
+- Models load lazily on first use; past MODEL_MEMORY_BUDGET_MB the least
+  recently used idle model is unloaded. Routed requests hold their engine
+  (acquire/release), so it is not idle until they are done.
+- swap() loads a new version next to the serving one, warms it up and only
+  then flips the alias; the old version drains and is unloaded.
+"""
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Set
+from config import config
+from brain import ModelEngine, ModelUnavailable
+from metrics import MODEL_MEMORY_BYTES, MODEL_LOADS, MODEL_EVICTIONS
+
+DEFAULT_ALIAS = "default"
+
+
+class UnknownModel(KeyError):
+    pass
+
+
+def parse_routes(spec: str) -> Dict[str, str]:
+    """"a=x,b=y" -> {"a": "x", "b": "y"}."""
+    routes = {}
+    for pair in spec.split(","):
+        if "=" in pair:
+            name, value = pair.split("=", 1)
+            if name.strip() and value.strip():
+                routes[name.strip()] = value.strip()
+    return routes
+
+
+class ModelRegistry:
+    def __init__(
+        self,
+        default_model_id: Optional[str] = None,
+        routes: Optional[Dict[str, str]] = None,
+        tier_routes: Optional[Dict[str, str]] = None,
+        memory_budget_mb: Optional[int] = None,
+        engine_factory: Callable[[str], ModelEngine] = ModelEngine,
+    ):
+        self.routes: Dict[str, str] = {DEFAULT_ALIAS: default_model_id or config.MODEL_ID}
+        self.routes.update(parse_routes(config.MODEL_ROUTES) if routes is None else routes)
+        self.tier_routes = parse_routes(config.MODEL_TIER_ROUTES) if tier_routes is None else tier_routes
+        for tier, alias in self.tier_routes.items():
+            if alias not in self.routes:
+                print(f"WARNING: MODEL_TIER_ROUTES sends '{tier}' to unknown model '{alias}'. Using default.")
+        budget = config.MODEL_MEMORY_BUDGET_MB if memory_budget_mb is None else memory_budget_mb
+        self.memory_budget = budget * 1024 * 1024
+        self.engine_factory = engine_factory
+        # model id -> engine (loaded or not), least recently used first
+        self._engines: "OrderedDict[str, ModelEngine]" = OrderedDict()
+        self._load_lock = threading.Lock()
+        self._loading: Dict[str, asyncio.Future] = {}
+        self._sizes: Dict[str, int] = {}  # model id -> bytes when last loaded
+        self.swapping: Dict[str, str] = {}
+
+    # ------------------------------------------------------------ lookup
+
+    def resolve(self, requested: Optional[str] = None, tier: Optional[str] = None) -> str:
+        """Alias serving this request: explicit model (alias or id), then tier route, then default."""
+        if requested:
+            if requested in self.routes:
+                return requested
+            for alias, model_id in self.routes.items():
+                if model_id == requested:
+                    return alias
+            raise UnknownModel(requested)
+        alias = self.tier_routes.get(tier) if tier else None
+        return alias if alias in self.routes else DEFAULT_ALIAS
+
+    def engine(self, model_id: str) -> ModelEngine:
+        """The engine object for a model id, created (not loaded) on first sight."""
+        engine = self._engines.get(model_id)
+        if engine is None:
+            engine = self._engines[model_id] = self.engine_factory(model_id)
+        return engine
+
+    @property
+    def default_engine(self) -> ModelEngine:
+        return self.engine(self.routes[DEFAULT_ALIAS])
+
+    @property
+    def ready(self) -> bool:
+        return self.default_engine.ready
+
+    def model_hashes(self) -> Set[str]:
+        """Cache namespaces of every routed model (compaction keeps these)."""
+        return {self.engine(model_id).get_model_hash() for model_id in set(self.routes.values())}
+
+    def describe(self) -> List[dict]:
+        return [{
+            "model": alias,
+            "model_id": model_id,
+            "loaded": self.engine(model_id).ready,
+            "swapping_to": self.swapping.get(alias),
+        } for alias, model_id in self.routes.items()]
+
+    # ------------------------------------------------------------ loading
+
+    async def aroute(self, requested: Optional[str] = None, tier: Optional[str] = None) -> ModelEngine:
+        """
+        Loaded engine serving a request (see resolve), acquired: the caller
+        release()s it once the response is done, and until then it is neither
+        evicted nor retired by a swap.
+        """
+        alias = self.resolve(requested, tier)
+        while True:
+            engine = await self.aget(alias)
+            if engine.acquire():
+                return engine
+            # Evicted between load and acquire: load it again
+
+    async def aget(self, alias: str) -> ModelEngine:
+        """Loaded engine for an alias; concurrent first requests share one load."""
+        model_id = self.routes[alias]
+        engine = self.engine(model_id)
+        if engine.ready:
+            self._engines.move_to_end(model_id)
+            return engine
+        return await self._aload(model_id)
+
+    async def _aload(self, model_id: str) -> ModelEngine:
+        pending = self._loading.get(model_id)
+        if pending is None:
+            pending = self._loading[model_id] = asyncio.ensure_future(asyncio.to_thread(self.load, model_id))
+            pending.add_done_callback(lambda _: self._loading.pop(model_id, None))
+        # One impatient client must not cancel the load for everyone else
+        return await asyncio.shield(pending)
+
+    def load(self, model_id: str) -> ModelEngine:
+        """Blocking load (startup, worker threads). Loads are serialized to bound peak memory."""
+        with self._load_lock:
+            engine = self.engine(model_id)
+            if not engine.ready:
+                # Room first, so the budget also holds while loading. Sized from this model's
+                # previous load; a first load is only measured once done (see _evict below)
+                self._evict(keep=model_id, incoming=self._sizes.get(model_id, 0))
+                started = time.time()
+                engine.load_model()
+                if not engine.ready:
+                    MODEL_LOADS.labels(model=model_id, outcome="error").inc()
+                    raise ModelUnavailable(f"Model {model_id} failed to load")
+                MODEL_LOADS.labels(model=model_id, outcome="ok").inc()
+                self._sizes[model_id] = engine.memory_bytes
+                MODEL_MEMORY_BYTES.labels(model=model_id).set(engine.memory_bytes)
+                print(f"Registry: {model_id} ready in {time.time() - started:.1f}s ({engine.memory_bytes / 2**20:.0f} MB).")
+            self._engines.move_to_end(model_id)
+            self._evict(keep=model_id)
+            return engine
+
+    def _evict(self, keep: str, incoming: int = 0):
+        """Unloads LRU idle models until loaded weights (plus `incoming` bytes) fit the budget."""
+        if self.memory_budget <= 0:
+            return
+        routed_default = self.routes[DEFAULT_ALIAS]
+        for model_id, engine in list(self._engines.items()):
+            if self._loaded_bytes() + incoming <= self.memory_budget:
+                return
+            if model_id in (keep, routed_default) or not engine.ready:
+                continue
+            if engine.unload_if_idle():
+                MODEL_MEMORY_BYTES.labels(model=model_id).set(0)
+                MODEL_EVICTIONS.inc()
+
+    def _loaded_bytes(self) -> int:
+        return sum(engine.memory_bytes for engine in self._engines.values() if engine.ready)
+
+    def _unload(self, model_id: str):
+        self._engines[model_id].unload()
+        MODEL_MEMORY_BYTES.labels(model=model_id).set(0)
+
+    # ------------------------------------------------------------ hot swap
+
+    async def swap(self, alias: str, model_id: str) -> bool:
+        """
+        Loads `model_id` (warmup included) while the alias keeps serving its
+        current model, then flips the alias. The replaced model is unloaded
+        once idle or after MODEL_SWAP_DRAIN_SECONDS.
+        """
+        previous = self.routes.get(alias)
+        if previous == model_id:
+            return True
+        self.swapping[alias] = model_id
+        try:
+            await self._aload(model_id)
+        except Exception as e:
+            print(f"Hot-swap of '{alias}' to {model_id} failed, still serving {previous}: {e}")
+            return False
+        finally:
+            self.swapping.pop(alias, None)
+
+        self.routes[alias] = model_id
+        print(f"Hot-swap: '{alias}' now serves {model_id} (was {previous}).")
+        if previous and previous not in self.routes.values():
+            await self._retire(previous)
+        return True
+
+    async def _retire(self, model_id: str):
+        engine = self._engines.get(model_id)
+        deadline = time.monotonic() + config.MODEL_SWAP_DRAIN_SECONDS
+        while engine is not None and engine.ready and not engine.idle and time.monotonic() < deadline:
+            await asyncio.sleep(0.5)
+        # Re-routed back while draining: keep it
+        if engine is not None and engine.ready and model_id not in self.routes.values():
+            await asyncio.to_thread(self.unload, model_id)
+
+    def unload(self, model_id: str):
+        with self._load_lock:
+            if model_id in self._engines and self._engines[model_id].ready:
+                self._unload(model_id)
@@ -0,0 +1,419 @@
+"""
+Model Server Client: what an HTTP worker uses when MODEL_SERVER_SOCKET is set.
+
+RemoteRegistry, RemoteEngine and RemoteEmbedder stand in for ModelRegistry,
+ModelEngine and EmbeddingService. Each call is forwarded over one Unix
+socket to the model server (modelserver.py), which holds the only copy of
+the weights. Replies are matched to callers by request id, so a worker can
+have many generations in flight on the same connection.
+
+Wire format (pickled tuples, multiprocessing.connection):
+    -> ("call" | "stream", rid, method, args, kwargs)   ("cancel", rid)
+    <- (rid, "ok", value) (rid, "error", exception)
+       (rid, "accepted", None) (rid, "token", text) (rid, "end", result)
+
+A stream is "accepted" once the server has admitted and queued the
+generation, so rejections (SchedulerFull, ContextOverflow) reach the worker
+before it starts an HTTP response. Token counting runs in the worker with
+its own copy of the tokenizer; the rest of the sync API is for startup and
+threads, never the event loop.
+"""
+import asyncio
+import itertools
+import os
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from multiprocessing.connection import Client, Connection
+from typing import AsyncIterator, Callable, Dict, List, Optional, Set
+import numpy as np
+from config import config
+from brain import model_hash
+from generation import GenerationBudget
+from registry import DEFAULT_ALIAS, ModelUnavailable
+from snapshot import find_snapshot
+
+
+class _Stream:
+    """Tokens of one remote generation, handed from the reader thread to the event loop."""
+    def __init__(self):
+        self.loop = asyncio.get_running_loop()
+        self.queue: "asyncio.Queue[tuple]" = asyncio.Queue()
+
+    def push(self, kind: str, value):
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, (kind, value))
+
+
+class RemoteStream:
+    """Tokens of an accepted remote generation. Closing it early cancels the generation on the server."""
+    def __init__(self, client: "ModelClient", rid: int, stream: _Stream, on_end: Optional[Callable]):
+        self._client = client
+        self._rid = rid
+        self._stream = stream
+        self._on_end = on_end
+        self._finished = False
+
+    def __aiter__(self) -> "RemoteStream":
+        return self
+
+    async def __anext__(self) -> str:
+        if self._finished:
+            raise StopAsyncIteration
+        kind, value = await self._stream.queue.get()
+        if kind == "token":
+            return value
+        self._finish()
+        if kind == "end":
+            if self._on_end is not None:
+                self._on_end(value)
+            raise StopAsyncIteration
+        raise value
+
+    async def aclose(self):
+        if not self._finished:
+            self._finish()
+            self._client._cancel(self._rid)
+
+    def _finish(self):
+        self._finished = True
+        self._client._pending.pop(self._rid, None)
+
+
+class ModelClient:
+    def __init__(self, address: Optional[str] = None, authkey: Optional[str] = None):
+        self.address = address or config.MODEL_SERVER_SOCKET
+        self.authkey = (authkey if authkey is not None else config.MODEL_SERVER_AUTHKEY).encode() or None
+        self._conn: Optional[Connection] = None
+        self._lock = threading.Lock()  # connect + send
+        self._pending: Dict[int, object] = {}  # rid -> Future | _Stream
+        self._ids = itertools.count()
+
+    def call(self, method: str, *args, **kwargs) -> Future:
+        """Cancelling the future (e.g. a cancelled acall) cancels the work on the server."""
+        future = Future()
+        future.rid = self._send("call", method, args, kwargs, future)
+        future.add_done_callback(self._forget_cancelled)
+        return future
+
+    def _forget_cancelled(self, future: Future):
+        if future.cancelled() and self._pending.pop(future.rid, None) is not None:
+            self._cancel(future.rid)
+
+    def request(self, method: str, *args, timeout: Optional[float] = None, **kwargs):
+        """Blocking call (startup, threads; never the event loop); raises what the server raised."""
+        future = self.call(method, *args, **kwargs)
+        timeout = config.MODEL_SERVER_TIMEOUT if timeout is None else timeout
+        try:
+            return future.result(timeout or None)
+        except FutureTimeout:
+            future.cancel()
+            raise ModelUnavailable(f"Model server did not answer '{method}' within {timeout}s") from None
+
+    async def acall(self, method: str, *args, **kwargs):
+        return await asyncio.wrap_future(self.call(method, *args, **kwargs))
+
+    async def aopen_stream(self, method: str, *args, on_end: Optional[Callable] = None, **kwargs) -> RemoteStream:
+        """Remote token stream, returned once the server accepted it; rejections raise here."""
+        stream = _Stream()
+        rid = self._send("stream", method, args, kwargs, stream)
+        try:
+            kind, value = await stream.queue.get()
+        except BaseException:
+            self._pending.pop(rid, None)
+            self._cancel(rid)
+            raise
+        if kind == "accepted":
+            return RemoteStream(self, rid, stream, on_end)
+        self._pending.pop(rid, None)
+        raise value
+
+    def close(self):
+        with self._lock:
+            conn, self._conn = self._conn, None
+        if conn is not None:
+            conn.close()
+
+    # ------------------------------------------------------------ transport
+
+    def _send(self, kind: str, method: str, args: tuple, kwargs: dict, waiter) -> int:
+        rid = next(self._ids)
+        self._pending[rid] = waiter
+        try:
+            with self._lock:
+                self._connection().send((kind, rid, method, args, kwargs))
+        except (OSError, EOFError) as e:
+            self._pending.pop(rid, None)
+            raise ModelUnavailable(f"Model server unreachable at {self.address}: {e}") from e
+        return rid
+
+    def _cancel(self, rid: int):
+        try:
+            with self._lock:
+                if self._conn is not None:
+                    self._conn.send(("cancel", rid))
+        except (OSError, EOFError):
+            pass
+
+    def _connection(self) -> Connection:
+        if self._conn is None:
+            self._conn = Client(self.address, family="AF_UNIX", authkey=self.authkey)
+            threading.Thread(target=self._read, args=(self._conn,), name="model-client-reader", daemon=True).start()
+        return self._conn
+
+    def _read(self, conn: Connection):
+        try:
+            while True:
+                rid, kind, value = conn.recv()
+                waiter = self._pending.get(rid)
+                if isinstance(waiter, _Stream):
+                    waiter.push(kind, value)
+                elif waiter is not None:
+                    self._pending.pop(rid, None)
+                    # False if the caller cancelled meanwhile: nobody wants the reply
+                    if not waiter.set_running_or_notify_cancel():
+                        continue
+                    if kind == "ok":
+                        waiter.set_result(value)
+                    else:
+                        waiter.set_exception(value)
+        except (OSError, EOFError):
+            pass
+        # Server restarted or went away: fail what was in flight, reconnect on the next call
+        with self._lock:
+            if self._conn is conn:
+                self._conn = None
+        lost = ModelUnavailable("Model server connection lost")
+        for rid in list(self._pending):
+            waiter = self._pending.pop(rid, None)
+            if isinstance(waiter, _Stream):
+                waiter.push("error", lost)
+            elif waiter is not None and waiter.set_running_or_notify_cancel():
+                waiter.set_exception(lost)
+
+
+class RemoteEngine:
+    """
+    ModelEngine stand-in: same calls, executed by the model server. Server
+    state (device, capacity...) is the last snapshot the server sent with a
+    load or route, so reading it never waits on the socket.
+    """
+    def __init__(self, client: ModelClient, model_id: str):
+        self.client = client
+        self.model_id = model_id
+        self.tokenizer = None
+        self._tokenizer_lock = threading.Lock()
+        self._tokenizer_tried = False
+        self._state: Optional[dict] = None
+
+    def get_model_hash(self) -> str:
+        return model_hash(self.model_id)
+
+    def _info(self) -> dict:
+        if self._state is None:
+            self._state = self.client.request("info", self.model_id)
+        return self._state
+
+    @property
+    def ready(self) -> bool:
+        try:
+            return self._info()["ready"]
+        except ModelUnavailable:
+            return False
+
+    @property
+    def device(self) -> str:
+        return self._info()["device"]
+
+    @property
+    def precision(self) -> str:
+        return self._info()["precision"]
+
+    @property
+    def idle(self) -> bool:
+        return self._info()["idle"]
+
+    @property
+    def memory_bytes(self) -> int:
+        return self._info()["memory_bytes"]
+
+    @property
+    def capacity(self) -> int:
+        """This worker's share of the server's decode batch (admission runs per worker)."""
+        return max(1, self._info()["capacity"] // max(1, config.WEB_CONCURRENCY))
+
+    def release(self):
+        """Hands back the hold the model server took when routing a request here (see RemoteRegistry.aroute)."""
+        try:
+            self.client.call("release", self.model_id)
+        except ModelUnavailable:
+            pass  # Server gone: its holds went with the connection
+
+    def load_model(self):
+        self._state = self.client.request("load", self.model_id)
+        self.load_tokenizer()
+
+    def unload(self):
+        self.client.request("unload", self.model_id)
+        self._state = None
+
+    def load_tokenizer(self):
+        """Worker-side copy of the tokenizer (no weights): RAG packing and memory count tokens without a round trip."""
+        with self._tokenizer_lock:
+            if self._tokenizer_tried:
+                return
+            self._tokenizer_tried = True
+            # The tokenizers library reads the same tokenizer.json as the server's fast tokenizer, without torch
+            try:
+                from tokenizers import Tokenizer
+                source = find_snapshot(self.model_id) or self.model_id
+                local = os.path.join(source, "tokenizer.json")
+                self.tokenizer = Tokenizer.from_file(local) if os.path.isfile(local) else Tokenizer.from_pretrained(source)
+            except Exception as e:
+                print(f"WARNING: Tokenizer for {self.model_id} unavailable in worker, estimating token counts: {e}")
+
+    def count_tokens(self, text: str) -> int:
+        if self.tokenizer is None:
+            return max(1, len(text) // 4)
+        return len(self.tokenizer.encode(text, add_special_tokens=False).ids)
+
+    # The budget travels to the server; why its copy stopped comes back with the answer
+
+    def predict(self, prompt: str, history: list = None, session_id: Optional[str] = None,
+                budget: Optional[GenerationBudget] = None) -> str:
+        text, reason = self.client.request("predict", self.model_id, prompt, history or [], session_id=session_id, budget=budget, timeout=0)
+        _report(budget, reason)
+        return text
+
+    async def apredict(self, prompt: str, history: list = None, session_id: Optional[str] = None,
+                       budget: Optional[GenerationBudget] = None) -> str:
+        text, reason = await self.client.acall("predict", self.model_id, prompt, history or [], session_id=session_id, budget=budget)
+        _report(budget, reason)
+        return text
+
+    async def aopen_stream(self, prompt: str, history: list = None, session_id: Optional[str] = None,
+                           budget: Optional[GenerationBudget] = None) -> AsyncIterator[str]:
+        """Returns once the server has queued the generation: SchedulerFull / ContextOverflow raise here."""
+        return await self.client.aopen_stream("stream", self.model_id, prompt, history or [], session_id=session_id,
+                                              budget=budget, on_end=lambda reason: _report(budget, reason))
+
+    async def astream_predict(self, prompt: str, history: list = None, session_id: Optional[str] = None,
+                              budget: Optional[GenerationBudget] = None) -> AsyncIterator[str]:
+        """Lazy variant: rejections surface on the first iteration. Request paths use aopen_stream."""
+        tokens = await self.aopen_stream(prompt, history, session_id=session_id, budget=budget)
+        try:
+            async for token in tokens:
+                yield token
+        finally:
+            await tokens.aclose()
+
+
+def _report(budget: Optional[GenerationBudget], reason: Optional[str]):
+    if budget is not None:
+        budget.finish_reason = reason
+
+
+class RemoteRegistry:
+    """
+    ModelRegistry stand-in. Routing, loading, eviction and hot-swaps happen
+    in the model server, so a swap requested on any worker applies to all.
+    `routes` mirrors the server's, refreshed whenever a request is routed.
+    """
+    def __init__(self, client: ModelClient):
+        self.client = client
+        self.routes: Dict[str, str] = {DEFAULT_ALIAS: config.MODEL_ID}
+        self._engines: Dict[str, RemoteEngine] = {}
+
+    def engine(self, model_id: str) -> RemoteEngine:
+        engine = self._engines.get(model_id)
+        if engine is None:
+            engine = self._engines[model_id] = RemoteEngine(self.client, model_id)
+        return engine
+
+    @property
+    def default_engine(self) -> RemoteEngine:
+        return self.engine(self.routes[DEFAULT_ALIAS])
+
+    @property
+    def ready(self) -> bool:
+        try:
+            return self.client.request("ready", timeout=5)
+        except Exception:
+            return False
+
+    @property
+    def swapping(self) -> Dict[str, str]:
+        return self.client.request("swapping")
+
+    async def aroute(self, requested: Optional[str] = None, tier: Optional[str] = None) -> RemoteEngine:
+        """Routed engine, held by the server for this worker until release()d."""
+        route = asyncio.ensure_future(self.client.acall("route", requested, tier))
+        try:
+            alias, model_id, state = await asyncio.shield(route)
+        except asyncio.CancelledError:
+            # The server may hold the model for us by now: hand it back once the answer arrives
+            route.add_done_callback(lambda r: r.cancelled() or r.exception() or self.engine(r.result()[1]).release())
+            raise
+        self.routes[alias] = model_id
+        engine = self.engine(model_id)
+        engine._state = state
+        if not engine._tokenizer_tried:
+            # First request for a model this worker did not load at startup (tier route, hot-swap)
+            await asyncio.to_thread(engine.load_tokenizer)
+        return engine
+
+    def load(self, model_id: str) -> RemoteEngine:
+        engine = self.engine(model_id)
+        engine.load_model()
+        return engine
+
+    def model_hashes(self) -> Set[str]:
+        return self.client.request("model_hashes")
+
+    def describe(self) -> List[dict]:
+        models = self.client.request("describe")
+        self.routes = {m["model"]: m["model_id"] for m in models}
+        return models
+
+    async def swap(self, alias: str, model_id: str) -> bool:
+        return await self.client.acall("swap", alias, model_id)
+
+
+class RemoteEmbedder:
+    """EmbeddingService stand-in: every worker's prompts share the server's micro-batcher."""
+    def __init__(self, client: ModelClient):
+        self.client = client
+        self.ready = False
+        self._dimension: Optional[int] = None
+
+    @property
+    def dimension(self) -> int:
+        if self._dimension is None:
+            self._dimension = self.client.request("embedding_dimension")
+        return self._dimension
+
+    def warmup(self):
+        self.client.request("embedding_warmup")
+        self.ready = True
+
+    def encode(self, texts, batch_size: int = 32) -> np.ndarray:
+        return self.client.request("encode", list(texts), batch_size)
+
+    def submit(self, text: str) -> Future:
+        return self.client.call("encode_one", text)
+
+    def encode_one(self, text: str) -> np.ndarray:
+        return self.submit(text).result()
+
+    async def aencode_one(self, text: str) -> np.ndarray:
+        return await asyncio.wrap_future(self.submit(text))
+
+    def stop(self):
+        self.client.close()
+
+
+class RemoteReranker:
+    """CrossEncoder stand-in for Retriever: scores are computed by the server's re-ranker."""
+    def __init__(self, client: ModelClient):
+        self.client = client
+
+    def predict(self, pairs) -> List[float]:
+        return self.client.request("rerank", [tuple(pair) for pair in pairs])
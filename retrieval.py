@@ -0,0 +1,202 @@
+"""
+Hybrid Retrieval: grounding passages for RAG.
+
+1. Candidates from two retrievers over `coconut_idx`: vector KNN (meaning)
+   and BM25 on the indexed `content` TEXT field (exact terms, names, codes).
+2. Reciprocal Rank Fusion merges both rankings without comparing their
+   incompatible scores: score(d) = sum(1 / (RAG_RRF_K + rank)).
+3. Optional cross-encoder re-ranking of the fused candidates.
+4. Passages are packed best-first into RAG_CONTEXT_TOKENS, so a long
+   document no longer inflates prefill for every request.
+"""
+import asyncio
+import re
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+from config import config
+from tracing import span
+
+Passage = Tuple[str, str]  # (redis key, content)
+
+# Words only: punctuation would be parsed as RediSearch query syntax. `\w` alone
+# splits Devanagari words at their vowel signs and anusvara, so the block's
+# letters and marks are added (dandas U+0964/U+0965 stay separators).
+_WORD = re.compile(r"[\w\u0900-\u0963\u0966-\u097F]+", re.UNICODE)
+# RediSearch query syntax, escaped inside terms
+_QUERY_SYNTAX = re.compile(r"([,.<>{}\[\]\"':;!@#$%^&*()\-+=~|/\\\s])")
+
+
+def approx_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+def bm25_query(prompt: str) -> Optional[str]:
+    """Prompt words OR'd together on the content field, None when nothing is searchable.
+
+    >>> bm25_query('कोंकणी भाषा काय?')
+    '@content:(कोंकणी|भाषा|काय)'
+    >>> bm25_query('गोंयचो इतिहास सांग।')
+    '@content:(गोंयचो|इतिहास|सांग)'
+    >>> bm25_query('Error E-42: what?')
+    '@content:(error|42|what)'
+    """
+    terms = []
+    for word in _WORD.findall(prompt.lower()):
+        word = _QUERY_SYNTAX.sub(r"\\\1", word)
+        if len(word) > 1 and word not in terms:
+            terms.append(word)
+    if not terms:
+        return None
+    return "@content:(" + "|".join(terms[:32]) + ")"
+
+
+def rrf(rankings: List[List[Passage]], k: int) -> List[Passage]:
+    """Reciprocal Rank Fusion of several best-first lists, best first."""
+    scores: Dict[str, float] = {}
+    passages: Dict[str, str] = {}
+    for ranking in rankings:
+        for rank, (key, content) in enumerate(ranking, 1):
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+            passages.setdefault(key, content)
+    return [(key, passages[key]) for key in sorted(scores, key=scores.get, reverse=True)]
+
+
+def pack(passages: List[Passage], budget: int, count_tokens: Callable[[str], int]) -> Optional[str]:
+    """Best-first passages that fit the token budget; the top one is trimmed if it alone is too long."""
+    chosen, used = [], 0
+    for _, content in passages:
+        tokens = count_tokens(content)
+        if used + tokens <= budget:
+            chosen.append(content)
+            used += tokens
+        elif not chosen:
+            # Character cut proportional to the overflow, close enough for a prompt budget
+            chosen.append(content[:max(1, len(content) * budget // tokens)])
+            break
+    return "\n\n".join(chosen) if chosen else None
+
+
+def parse_hits(res) -> List[Passage]:
+    """FT.SEARCH reply -> [(key, content)] in reply order."""
+    hits = []
+    if not res:
+        return hits
+    for i in range(1, len(res) - 1, 2):
+        fields = res[i + 1]
+        field_dict = {fields[j]: fields[j + 1] for j in range(0, len(fields), 2)}
+        if field_dict.get("content"):
+            hits.append((res[i], field_dict["content"]))
+    return hits
+
+
+class Retriever:
+    def __init__(
+        self,
+        mapper,
+        index: str,
+        count_tokens: Optional[Callable[[str], int]] = None,
+        reranker_id: Optional[str] = None,
+        reranker=None,
+    ):
+        self.mapper = mapper  # SemanticMapper: Redis clients, index checks, prompt embedding
+        self.index = index
+        self.count_tokens = count_tokens or approx_tokens
+        self.reranker_id = config.RERANKER_MODEL_ID if reranker_id is None else reranker_id
+        self._reranker = reranker  # anything with CrossEncoder.predict, e.g. a model server proxy
+        self._reranker_lock = threading.Lock()
+
+    @property
+    def reranker(self):
+        if self._reranker is None and self.reranker_id:
+            with self._reranker_lock:
+                if self._reranker is None:
+                    from sentence_transformers import CrossEncoder
+                    print(f"Loading Re-Ranker: {self.reranker_id}...")
+                    self._reranker = CrossEncoder(self.reranker_id, device="cpu")
+        return self._reranker
+
+    def warmup(self):
+        if self.reranker is not None:
+            self.reranker.predict([("warmup", "warmup")])
+
+    # ------------------------------------------------------------ retrieval
+
+    def retrieve(self, prompt: str, ctx, top_k: Optional[int] = None) -> Optional[str]:
+        if not self.mapper._index_exists(self.index):
+            return None
+        candidates = config.RAG_CANDIDATES
+        rankings = [self._run(self._knn_command(ctx.vector, candidates), "Vector search")]
+        query = bm25_query(prompt) if config.RAG_HYBRID else None
+        if query:
+            rankings.append(self._run(self._bm25_command(query, candidates), "BM25 search"))
+        return self._finish(prompt, rankings, top_k)
+
+    async def aretrieve(self, prompt: str, ctx, top_k: Optional[int] = None) -> Optional[str]:
+        if not await self.mapper._aindex_exists(self.index):
+            return None
+        candidates = config.RAG_CANDIDATES
+        query = bm25_query(prompt) if config.RAG_HYBRID else None
+        knn = self._arun(self._knn_command(await ctx.avector(), candidates), "Vector search")
+        if query:
+            rankings = list(await asyncio.gather(knn, self._arun(self._bm25_command(query, candidates), "BM25 search")))
+        else:
+            rankings = [await knn]
+        fused = rrf(rankings, config.RAG_RRF_K)
+        if self.reranker_id and len(fused) > 1:
+            fused = await asyncio.to_thread(self._rerank, prompt, fused[:candidates])
+        return self._pack(fused, top_k)
+
+    def _finish(self, prompt: str, rankings: List[List[Passage]], top_k: Optional[int]) -> Optional[str]:
+        fused = rrf(rankings, config.RAG_RRF_K)
+        if self.reranker_id and len(fused) > 1:
+            # Cross-encoding is the expensive step: only the fused head is scored
+            fused = self._rerank(prompt, fused[:config.RAG_CANDIDATES])
+        return self._pack(fused, top_k)
+
+    def _pack(self, fused: List[Passage], top_k: Optional[int]) -> Optional[str]:
+        return pack(fused[:top_k or config.RAG_TOP_K], config.RAG_CONTEXT_TOKENS, self.count_tokens)
+
+    def _rerank(self, prompt: str, passages: List[Passage]) -> List[Passage]:
+        with span("rerank"):
+            scores = self.reranker.predict([(prompt, content) for _, content in passages])
+        order = sorted(range(len(passages)), key=lambda i: float(scores[i]), reverse=True)
+        return [passages[i] for i in order]
+
+    # ------------------------------------------------------------ redis
+
+    def _knn_command(self, vector: bytes, top_k: int) -> tuple:
+        return (
+            "FT.SEARCH", self.index,
+            f"*=>[KNN {top_k} @vector $vec AS score]",
+            "PARAMS", "2", "vec", vector,
+            "SORTBY", "score",
+            "LIMIT", "0", str(top_k),
+            "RETURN", "1", "content",
+            "DIALECT", "2",
+        )
+
+    def _bm25_command(self, query: str, top_k: int) -> tuple:
+        return (
+            "FT.SEARCH", self.index, query,
+            "SCORER", "BM25",
+            "LIMIT", "0", str(top_k),
+            "RETURN", "1", "content",
+            "DIALECT", "2",
+        )
+
+    def _run(self, command: tuple, label: str) -> List[Passage]:
+        try:
+            return parse_hits(self.mapper.redis.execute_command(*command))
+        except Exception as e:
+            # Index may have been dropped underneath us: re-check on next call
+            self.mapper._known_indexes.discard(self.index)
+            print(f"{label} error: {e}")
+            return []
+
+    async def _arun(self, command: tuple, label: str) -> List[Passage]:
+        try:
+            return parse_hits(await self.mapper.aredis.execute_command(*command))
+        except Exception as e:
+            self.mapper._known_indexes.discard(self.index)
+            print(f"{label} error: {e}")
+            return []
@@ -0,0 +1,428 @@
+"""
+Continuous Batching Scheduler for the Gonyai ModelEngine.
+
+Concurrent requests share one left-padded decode batch. Newcomers are
+prefilled and merged in between decode steps, finished sequences are retired
+immediately so their slot goes to the next request in the queue.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import List, Optional
+from metrics import QUEUE_WAIT, OUTPUT_TOKENS
+from generation import cut_at_stop, holdback, record_finish
+
+# Imported when the first scheduler is built (after the model load), not with this module
+torch = F = None
+
+def _import_torch():
+    global torch, F
+    import torch
+    import torch.nn.functional as F
+
+
+class SchedulerFull(Exception):
+    """Raised when the pending queue is at its configured depth."""
+
+
+class SchedulerStopped(Exception):
+    """The scheduler was stopped (model unloaded) before it could finish the request."""
+
+
+class GenerationRequest:
+    """A single sequence travelling through the scheduler."""
+
+    def __init__(
+        self,
+        input_ids: List[int],
+        max_new_tokens: int = 256,
+        temperature: float = 0.3,
+        repetition_penalty: float = 1.2,
+        stream: Optional[queue.Queue] = None,
+        session_id: Optional[str] = None,
+        stop: Optional[List[str]] = None,
+        deadline: Optional[float] = None,
+    ):
+        self.input_ids = input_ids
+        self.session_id = session_id
+        self.max_new_tokens = max_new_tokens
+        self.stop = stop or []
+        self.deadline = deadline  # time.monotonic() past which decoding stops
+        self.temperature = temperature
+        self.repetition_penalty = repetition_penalty
+        # Streaming sink: receives text deltas, then None once finished
+        self.stream = stream
+        self.future: Future = Future()
+        self.cancelled = threading.Event()
+        self.generated: List[int] = []
+        self.enqueued_at = time.time()
+        self.finish_reason: Optional[str] = None
+        self._emitted = ""
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def expired(self) -> bool:
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+
+class _Batch:
+    """Decode state shared by all active rows (KV cache in legacy tuple layout)."""
+
+    def __init__(self, rows, past, attention_mask, next_logits):
+        self.rows = rows
+        self.past = past
+        self.attention_mask = attention_mask
+        self.next_logits = next_logits
+
+
+def _to_legacy(past):
+    """Cache object -> tuple of (key, value) per layer, each [batch, heads, seq, dim]."""
+    if hasattr(past, "to_legacy_cache"):
+        return past.to_legacy_cache()
+    if hasattr(past, "layers"):
+        return tuple((layer.keys, layer.values) for layer in past.layers)
+    return tuple((layer[0], layer[1]) for layer in past)
+
+
+def _from_legacy(past):
+    from transformers import DynamicCache
+    if hasattr(DynamicCache, "from_legacy_cache"):
+        return DynamicCache.from_legacy_cache(past)
+    cache = DynamicCache()
+    for layer_idx, (key, value) in enumerate(past):
+        cache.update(key, value, layer_idx)
+    return cache
+
+
+def _left_pad(tensor, length: int, dim: int):
+    missing = length - tensor.shape[dim]
+    if missing <= 0:
+        return tensor
+    shape = list(tensor.shape)
+    shape[dim] = missing
+    return torch.cat([tensor.new_zeros(shape), tensor], dim=dim)
+
+
+class BatchScheduler:
+    def __init__(self, engine, max_batch_size: int, max_wait_ms: int, max_queue_depth: int, prefix_cache=None):
+        _import_torch()
+        self.engine = engine
+        self.prefix_cache = prefix_cache
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000.0
+        self._pending: queue.Queue = queue.Queue(maxsize=max_queue_depth)
+        self._batch: Optional[_Batch] = None
+        self._prefilling = 0  # taken off the queue, not yet in the batch
+        self._running = False
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def depth(self) -> int:
+        return self._pending.qsize()
+
+    @property
+    def active(self) -> int:
+        return (len(self._batch.rows) if self._batch else 0) + self._prefilling
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="batch-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread:
+            self._thread.join(timeout=5)
+        if not (self._thread and self._thread.is_alive()):
+            # Otherwise the loop abandons them itself once its current step is done
+            self._abandon()
+
+    def submit(self, request: GenerationRequest) -> GenerationRequest:
+        if self._thread and not self._running:
+            raise SchedulerStopped("Model is being unloaded")
+        try:
+            self._pending.put_nowait(request)
+        except queue.Full:
+            raise SchedulerFull(f"Inference queue is full ({self._pending.maxsize} pending)")
+        if self._thread and not self._running and not self._thread.is_alive():
+            # stop() finished between the check above and the put
+            self._abandon()
+        return request
+
+    # ------------------------------------------------------------------ loop
+
+    def _run(self):
+        with torch.inference_mode():
+            while self._running:
+                admitted = self._admit()
+                if admitted:
+                    self._prefilling = len(admitted)
+                    try:
+                        self._prefill(admitted)
+                    except Exception as e:
+                        for req in admitted:
+                            self._fail(req, e)
+                    finally:
+                        self._prefilling = 0
+                if self._batch:
+                    try:
+                        self._step()
+                    except Exception as e:
+                        print(f"Batch decode error: {e}")
+                        rows, self._batch = self._batch.rows, None
+                        for req in rows:
+                            self._fail(req, e)
+            self._abandon()
+
+    def _abandon(self):
+        """Stopped: fails what is queued or decoding, so no caller waits forever."""
+        error = SchedulerStopped("Model was unloaded before the request finished")
+        rows, self._batch = (self._batch.rows if self._batch else []), None
+        for req in rows:
+            self._fail(req, error)
+        while True:
+            try:
+                self._fail(self._pending.get_nowait(), error)
+            except queue.Empty:
+                return
+
+    def _admit(self) -> List[GenerationRequest]:
+        admitted = []
+        if not self._batch:
+            # Idle: block for the first request, then give the batch a short window to fill
+            try:
+                admitted.append(self._pending.get(timeout=0.5))
+            except queue.Empty:
+                return admitted
+            deadline = time.monotonic() + self.max_wait
+            while len(admitted) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    admitted.append(self._pending.get(timeout=remaining))
+                except queue.Empty:
+                    break
+        else:
+            # Busy: only take what is already waiting, never stall active rows
+            while self.active + len(admitted) < self.max_batch_size:
+                try:
+                    admitted.append(self._pending.get_nowait())
+                except queue.Empty:
+                    break
+        live = []
+        now = time.time()
+        for req in admitted:
+            QUEUE_WAIT.observe(now - req.enqueued_at)
+            if req.cancelled.is_set() or req.expired():
+                # Cancelled or out of time while queued: skip the prefill
+                req.finish_reason = "cancelled" if req.cancelled.is_set() else "deadline"
+                self._finish(req)
+            else:
+                live.append(req)
+        return live
+
+    def _prefill(self, requests: List[GenerationRequest]):
+        fresh = []
+        for req in requests:
+            past, prefix = self.prefix_cache.lookup(req.session_id, req.input_ids) if self.prefix_cache else (None, 0)
+            if past is None:
+                fresh.append(req)
+            else:
+                self._prefill_cached(req, past, prefix)
+        if fresh:
+            self._prefill_fresh(fresh)
+
+    def _prefill_cached(self, req: GenerationRequest, past, prefix: int):
+        """Prefills only the new suffix on top of the session's cached prefix."""
+        device = self.engine.device
+        total = len(req.input_ids)
+        ids = torch.tensor([req.input_ids[prefix:]], dtype=torch.long, device=device)
+        mask = torch.ones((1, total), dtype=torch.long, device=device)
+        position_ids = torch.arange(prefix, total, device=device).unsqueeze(0)
+
+        out = self.engine.model(
+            input_ids=ids,
+            attention_mask=mask,
+            position_ids=position_ids,
+            past_key_values=_from_legacy(past),
+            use_cache=True,
+        )
+        incoming = _Batch([req], _to_legacy(out.past_key_values), mask, out.logits[:, -1, :])
+        self._batch = self._merge(self._batch, incoming) if self._batch else incoming
+
+    def _prefill_fresh(self, requests: List[GenerationRequest]):
+        device = self.engine.device
+        length = max(len(r.input_ids) for r in requests)
+        pad_id = self.engine.tokenizer.eos_token_id or 0
+        ids = torch.full((len(requests), length), pad_id, dtype=torch.long, device=device)
+        mask = torch.zeros((len(requests), length), dtype=torch.long, device=device)
+        for i, req in enumerate(requests):
+            n = len(req.input_ids)
+            ids[i, length - n:] = torch.tensor(req.input_ids, dtype=torch.long, device=device)
+            mask[i, length - n:] = 1
+        position_ids = (mask.cumsum(-1) - 1).clamp(min=0)
+
+        out = self.engine.model(
+            input_ids=ids,
+            attention_mask=mask,
+            position_ids=position_ids,
+            use_cache=True,
+        )
+        incoming = _Batch(list(requests), _to_legacy(out.past_key_values), mask, out.logits[:, -1, :])
+        self._batch = self._merge(self._batch, incoming) if self._batch else incoming
+
+    def _merge(self, a: _Batch, b: _Batch) -> _Batch:
+        length = max(a.attention_mask.shape[1], b.attention_mask.shape[1])
+        past = tuple(
+            (
+                torch.cat([_left_pad(ka, length, 2), _left_pad(kb, length, 2)], dim=0),
+                torch.cat([_left_pad(va, length, 2), _left_pad(vb, length, 2)], dim=0),
+            )
+            for (ka, va), (kb, vb) in zip(a.past, b.past)
+        )
+        mask = torch.cat([_left_pad(a.attention_mask, length, 1), _left_pad(b.attention_mask, length, 1)], dim=0)
+        logits = torch.cat([a.next_logits, b.next_logits], dim=0)
+        return _Batch(a.rows + b.rows, past, mask, logits)
+
+    def _step(self):
+        batch = self._batch
+        next_tokens = self._sample(batch)
+        eos_id = self.engine.tokenizer.eos_token_id
+
+        keep = []
+        for i, req in enumerate(batch.rows):
+            token = int(next_tokens[i])
+            if req.cancelled.is_set():
+                req.finish_reason = "cancelled"
+            elif token == eos_id:
+                req.finish_reason = "eos"
+            else:
+                req.generated.append(token)
+                if self._emit(req):
+                    req.finish_reason = "stop_sequence"
+                elif len(req.generated) >= req.max_new_tokens:
+                    req.finish_reason = "length"
+                elif req.expired():
+                    req.finish_reason = "deadline"
+            if req.finish_reason:
+                self._save_prefix(req, batch, i)
+                self._finish(req)
+            else:
+                keep.append(i)
+
+        if not keep:
+            self._batch = None
+            return
+        if len(keep) < len(batch.rows):
+            index = torch.tensor(keep, device=batch.attention_mask.device)
+            batch = _Batch(
+                [batch.rows[i] for i in keep],
+                tuple((k.index_select(0, index), v.index_select(0, index)) for k, v in batch.past),
+                batch.attention_mask.index_select(0, index),
+                None,
+            )
+            next_tokens = next_tokens.index_select(0, index)
+
+        mask = torch.cat([batch.attention_mask, batch.attention_mask.new_ones((len(keep), 1))], dim=1)
+        position_ids = (mask.sum(-1, keepdim=True) - 1)
+        out = self.engine.model(
+            input_ids=next_tokens.unsqueeze(-1),
+            attention_mask=mask,
+            position_ids=position_ids,
+            past_key_values=_from_legacy(batch.past),
+            use_cache=True,
+        )
+        self._batch = _Batch(batch.rows, _to_legacy(out.past_key_values), mask, out.logits[:, -1, :])
+
+    def _sample(self, batch: _Batch):
+        logits = batch.next_logits.float()
+        for i, req in enumerate(batch.rows):
+            if req.repetition_penalty != 1.0:
+                seen = torch.tensor(req.input_ids + req.generated, device=logits.device).unique()
+                scores = logits[i, seen]
+                logits[i, seen] = torch.where(
+                    scores < 0, scores * req.repetition_penalty, scores / req.repetition_penalty
+                )
+            if req.temperature > 0:
+                logits[i] = logits[i] / req.temperature
+        greedy = torch.tensor([r.temperature <= 0 for r in batch.rows], device=logits.device)
+        sampled = torch.multinomial(F.softmax(logits, dim=-1), num_samples=1).squeeze(-1)
+        return torch.where(greedy, logits.argmax(-1), sampled)
+
+    # --------------------------------------------------------------- results
+
+    def _save_prefix(self, req: GenerationRequest, batch: _Batch, row: int):
+        if not self.prefix_cache or req.session_id is None:
+            return
+        # Rows are [left padding | real tokens]; cache covers every token fed so far
+        length = int(batch.attention_mask[row].sum())
+        start = batch.attention_mask.shape[1] - length
+        # clone(): a view would pin the whole batch's KV memory
+        past = tuple(
+            (k[row:row + 1, :, start:].clone(), v[row:row + 1, :, start:].clone())
+            for k, v in batch.past
+        )
+        self.prefix_cache.store(req.session_id, (req.input_ids + req.generated)[:length], past)
+
+    def _emit(self, req: GenerationRequest) -> bool:
+        """Streams new text. True once a stop sequence has been generated."""
+        if req.stream is None and not req.stop:
+            return False
+        text = self.engine.tokenizer.decode(req.generated, skip_special_tokens=True)
+        # Hold back partial multi-byte characters until they are complete
+        if text.endswith("\ufffd"):
+            return False
+        text, stopped = cut_at_stop(text, req.stop)
+        if req.stream is not None:
+            # ...and a tail that may still turn into a stop sequence
+            visible = text if stopped else text[:len(text) - holdback(text, req.stop)]
+            delta = visible[len(req._emitted):]
+            if delta:
+                req._emitted = visible
+                req.stream.put(delta)
+        return stopped
+
+    def _finish(self, req: GenerationRequest):
+        OUTPUT_TOKENS.inc(len(req.generated))
+        text, _ = cut_at_stop(self.engine.tokenizer.decode(req.generated, skip_special_tokens=True), req.stop)
+        cancelled = req.cancelled.is_set()
+        if req.stream is not None:
+            delta = text[len(req._emitted):]
+            if delta and not cancelled:
+                req._emitted = text
+                req.stream.put(delta)
+            req.stream.put(None)
+        delivered = req._emitted if req.stream is not None else ("" if cancelled else text)
+        record_finish(req.finish_reason or "cancelled", self.engine.count_tokens(delivered) if delivered else 0)
+        if not req.future.done():
+            req.future.set_result(text.strip())
+
+    def _fail(self, req: GenerationRequest, error: Exception):
+        if req.future.done():
+            return
+        self._drop_row(req)
+        if req.stream is not None:
+            req.stream.put(None)
+        req.future.set_exception(error)
+
+    def _drop_row(self, req: GenerationRequest):
+        """Takes a failed row out of the batch (a cached prefill merges before its group can still fail)."""
+        batch = self._batch
+        if batch is None or not any(row is req for row in batch.rows):
+            return
+        keep = [i for i, row in enumerate(batch.rows) if row is not req]
+        if not keep:
+            self._batch = None
+            return
+        index = torch.tensor(keep, device=batch.attention_mask.device)
+        self._batch = _Batch(
+            [batch.rows[i] for i in keep],
+            tuple((k.index_select(0, index), v.index_select(0, index)) for k, v in batch.past),
+            batch.attention_mask.index_select(0, index),
+            batch.next_logits.index_select(0, index),
+        )
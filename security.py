@@ -3,12 +3,93 @@ import hashlib
 from fastapi import HTTPException, Security, status
 from fastapi.security import APIKeyHeader
 from redis import Redis
+from redis.asyncio import Redis as AsyncRedis
+from collections import OrderedDict
+from typing import Optional
+import math
+import threading
 import time
 
 from config import config
 
 API_KEY_HEADER = APIKeyHeader(name="X-API-Key", auto_error=False)
 
+# Auth + sliding-window rate limit in ONE round trip (EVALSHA).
+# Sliding window counter: the previous fixed window is weighted by how much of
+# it still overlaps the sliding window, so there is no 2x burst at the edges.
+#   KEYS[1] apikey:<hash>        KEYS[2] usage:<hash>:<window>   KEYS[3] usage:<hash>:<window - 1>
+#   ARGV    tier hint ('' = read the key record), free limit, pro limit,
+#           window seconds, ms elapsed in current window, cost
+# Returns {0} for unknown keys, else {1, tier, allowed, retry_after_ms, record}
+RATE_LIMIT_LUA = """
+local record = {}
+local tier = ARGV[1]
+if tier == '' then
+    record = redis.call('HGETALL', KEYS[1])
+    if #record == 0 then return {0} end
+    tier = 'free'
+    for i = 1, #record, 2 do
+        if record[i] == 'tier' then tier = record[i + 1] end
+    end
+end
+
+local limit = tonumber(tier == 'pro' and ARGV[3] or ARGV[2])
+local window_ms = tonumber(ARGV[4]) * 1000
+local elapsed = tonumber(ARGV[5])
+local cost = tonumber(ARGV[6])
+local current = tonumber(redis.call('GET', KEYS[2]) or '0')
+local previous = tonumber(redis.call('GET', KEYS[3]) or '0')
+
+if previous * (window_ms - elapsed) / window_ms + current + cost <= limit then
+    redis.call('INCRBY', KEYS[2], cost)
+    redis.call('PEXPIRE', KEYS[2], window_ms * 2)
+    return {1, tier, 1, 0, record}
+end
+
+-- Time until the weighted estimate leaves room for `cost`
+local retry_ms
+if cost > limit then
+    retry_ms = window_ms
+elseif current + cost > limit then
+    retry_ms = (window_ms - elapsed) + window_ms * (1 - (limit - cost) / current)
+else
+    retry_ms = window_ms * (1 - (limit - current - cost) / previous) - elapsed
+end
+return {1, tier, 0, math.ceil(math.max(retry_ms, 1000)), record}
+"""
+
+class _KeyMetadataCache:
+    """Short-TTL in-process cache of apikey records so hot keys skip HGETALL."""
+
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, hashed_key: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(hashed_key)
+            if entry is None:
+                return None
+            expires_at, key_data = entry
+            if expires_at < time.monotonic():
+                del self._entries[hashed_key]
+                return None
+            return key_data
+
+    def put(self, hashed_key: str, key_data: dict):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries[hashed_key] = (time.monotonic() + self.ttl, key_data)
+            self._entries.move_to_end(hashed_key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+_key_cache = _KeyMetadataCache(config.API_KEY_CACHE_TTL, config.API_KEY_CACHE_SIZE)
+_scripts = {}
+
 def generate_api_key(prefix: str = "cc_live_") -> str:
     """Generates a secure random API key."""
     return f"{prefix}{secrets.token_urlsafe(32)}"
@@ -17,10 +98,7 @@ def hash_api_key(api_key: str) -> str:
     """Hashes the API key using SHA-256."""
     return hashlib.sha256(api_key.encode()).hexdigest()
 
-def verify_api_key(
-    api_key: str = Security(API_KEY_HEADER), 
-    redis_client: Redis = None
-):
+def _check_key_present(api_key: str, redis_client) -> str:
     if not api_key:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -32,34 +110,75 @@ def verify_api_key(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
             detail="Security service unavailable"
         )
-        
-    hashed_key = hash_api_key(api_key)
-    key_data = redis_client.hgetall(f"apikey:{hashed_key}")
 
-    if not key_data:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid API Key"
-        )
+    return hash_api_key(api_key)
+
+def _invalid_key() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Invalid API Key"
+    )
+
+def _rate_limited(ttl: int) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail=f"Rate limit exceeded. Try again in {ttl} seconds.",
+        headers={"Retry-After": str(ttl)}
+    )
+
+def _script(redis_client):
+    # register_script gives EVALSHA with automatic SCRIPT LOAD on NOSCRIPT
+    script = _scripts.get(id(redis_client))
+    if script is None:
+        script = _scripts[id(redis_client)] = redis_client.register_script(RATE_LIMIT_LUA)
+    return script
 
-    # Use S-Tier Configuration for limits
-    tier = key_data.get("tier", "free")
-    limit = config.RATE_LIMIT_PRO if tier == "pro" else config.RATE_LIMIT_FREE
+def _script_call(hashed_key: str, key_data: Optional[dict], cost: int):
     window = config.RATE_WINDOW
-    
-    limit_key = f"usage:{hashed_key}"
-    request_count = redis_client.incr(limit_key)
+    now = time.time()
+    current = int(now // window)
+    keys = [f"apikey:{hashed_key}", f"usage:{hashed_key}:{current}", f"usage:{hashed_key}:{current - 1}"]
+    args = [
+        key_data.get("tier", "free") if key_data else "",
+        config.RATE_LIMIT_FREE,
+        config.RATE_LIMIT_PRO,
+        window,
+        int((now % window) * 1000),
+        cost,
+    ]
+    return keys, args
 
-    if request_count == 1:
-        redis_client.expire(limit_key, window)
+def _apply_result(hashed_key: str, key_data: Optional[dict], result) -> dict:
+    if not result or not int(result[0]):
+        raise _invalid_key()
 
-    if request_count > limit:
-        ttl = redis_client.ttl(limit_key)
-        raise HTTPException(
-            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-            detail=f"Rate limit exceeded. Try again in {ttl} seconds."
-        )
+    _, tier, allowed, retry_after_ms, record = result
+    if key_data is None:
+        key_data = {record[i]: record[i + 1] for i in range(0, len(record), 2)}
+        _key_cache.put(hashed_key, key_data)
 
-    return key_data
+    if not int(allowed):
+        raise _rate_limited(math.ceil(int(retry_after_ms) / 1000))
 
     return key_data
+
+def verify_api_key(
+    api_key: str = Security(API_KEY_HEADER), 
+    redis_client: Redis = None,
+    cost: int = 1
+):
+    hashed_key = _check_key_present(api_key, redis_client)
+    key_data = _key_cache.get(hashed_key)
+
+    keys, args = _script_call(hashed_key, key_data, cost)
+    result = _script(redis_client)(keys=keys, args=args)
+    return _apply_result(hashed_key, key_data, result)
+
+async def averify_api_key(api_key: str, redis_client: AsyncRedis = None, cost: int = 1):
+    """asyncio twin of verify_api_key for the async endpoints."""
+    hashed_key = _check_key_present(api_key, redis_client)
+    key_data = _key_cache.get(hashed_key)
+
+    keys, args = _script_call(hashed_key, key_data, cost)
+    result = await _script(redis_client)(keys=keys, args=args)
+    return _apply_result(hashed_key, key_data, result)
@@ -0,0 +1,91 @@
+"""
+Model Snapshots: preconverted local copies of the serving models.
+
+Hub checkpoints are often pickled .bin files in a different dtype than we
+serve, so every boot parses, converts and copies the full weights. A
+snapshot stores the LLM (already in the serving dtype), its tokenizer and
+the embedding model as safetensors under SNAPSHOT_DIR. Boots with
+SNAPSHOT_DIR set load from there: safetensors are memory-mapped, so the
+weights are paged in from the local disk instead of being copied.
+
+    python3 snapshot.py --output /models/snapshots
+    python3 snapshot.py --model omdeep22/Gonyai-v1 --dtype bfloat16 --skip-embedding
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from typing import List, Optional
+from config import config
+
+MANIFEST = "snapshot.json"
+
+
+def snapshot_dir(model_id: str, root: Optional[str] = None) -> str:
+    return os.path.join(root or config.SNAPSHOT_DIR, model_id.strip("/").replace("/", "--"))
+
+
+def find_snapshot(model_id: str) -> Optional[str]:
+    """Local snapshot path for a model id, None when snapshots are off or it was never taken."""
+    if not config.SNAPSHOT_DIR:
+        return None
+    path = snapshot_dir(model_id)
+    return path if os.path.exists(os.path.join(path, MANIFEST)) else None
+
+
+def snapshot_dtype(path: str) -> Optional[str]:
+    with open(os.path.join(path, MANIFEST)) as f:
+        return json.load(f).get("dtype")
+
+
+def _write_manifest(path: str, **fields):
+    fields["created_at"] = time.time()
+    with open(os.path.join(path, MANIFEST), "w") as f:
+        json.dump(fields, f, indent=2)
+
+
+def snapshot_llm(model_id: str, root: str, dtype: str) -> str:
+    import torch
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+    path = snapshot_dir(model_id, root)
+    print(f"Snapshotting {model_id} ({dtype}) -> {path}...")
+    tokenizer = AutoTokenizer.from_pretrained(model_id)
+    model = AutoModelForCausalLM.from_pretrained(model_id, trust_remote_code=True, torch_dtype=getattr(torch, dtype))
+    model.save_pretrained(path, safe_serialization=True)
+    tokenizer.save_pretrained(path)
+    _write_manifest(path, model_id=model_id, kind="causal_lm", dtype=dtype)
+    return path
+
+
+def snapshot_embedding(model_id: str, root: str) -> str:
+    from sentence_transformers import SentenceTransformer
+    path = snapshot_dir(model_id, root)
+    print(f"Snapshotting embedding model {model_id} -> {path}...")
+    SentenceTransformer(model_id).save(path, safe_serialization=True)
+    _write_manifest(path, model_id=model_id, kind="sentence_transformer")
+    return path
+
+
+def main(argv: List[str]):
+    parser = argparse.ArgumentParser(description="Write preconverted safetensors snapshots for fast boots.")
+    parser.add_argument("--output", default=config.SNAPSHOT_DIR or None, help="Snapshot root (what SNAPSHOT_DIR will point at)")
+    parser.add_argument("--model", default=config.MODEL_ID)
+    parser.add_argument("--embedding-model", default=config.EMBEDDING_MODEL_ID)
+    parser.add_argument("--dtype", choices=["float32", "bfloat16", "float16"],
+                        default="bfloat16" if config.CPU_PRECISION == "bf16" else "float32",
+                        help="Serving dtype (match what the pods load: float32/bfloat16 on CPU, bfloat16/float16 on GPU)")
+    parser.add_argument("--skip-embedding", action="store_true")
+    args = parser.parse_args(argv)
+    if not args.output:
+        parser.error("--output (or SNAPSHOT_DIR) is required")
+
+    started = time.time()
+    snapshot_llm(args.model, args.output, args.dtype)
+    if not args.skip_embedding:
+        snapshot_embedding(args.embedding_model, args.output)
+    print(f"Snapshots written to {args.output} in {time.time() - started:.1f}s. Boot with SNAPSHOT_DIR={args.output}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
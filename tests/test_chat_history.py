@@ -0,0 +1,37 @@
+"""Which history turns ModelEngine drops when a prompt overflows the context window."""
+from brain import _oldest_turn
+
+
+def _messages(roles: str) -> list:
+    return [{"role": "user" if r == "u" else "assistant", "content": str(i)} for i, r in enumerate(roles)]
+
+
+def _trim_all(messages: list) -> list:
+    """Contents left after each drop, until only the prompt remains."""
+    steps = []
+    while len(messages) > 1:
+        del messages[slice(*_oldest_turn(messages))]
+        steps.append([m["content"] for m in messages])
+    return steps
+
+
+def test_drops_whole_turns_and_keeps_first_turn_longest():
+    # The first user message carries ConversationMemory's folded summary
+    assert _trim_all(_messages("uauauau")) == [
+        ["0", "1", "4", "5", "6"],
+        ["0", "1", "6"],
+        ["6"],
+    ]
+
+
+def test_roles_keep_alternating():
+    messages = _messages("uauauau")
+    while len(messages) > 1:
+        del messages[slice(*_oldest_turn(messages))]
+        roles = [m["role"] for m in messages]
+        assert roles[0] == "user"
+        assert all(a != b for a, b in zip(roles, roles[1:]))
+
+
+def test_never_drops_the_prompt():
+    assert _trim_all(_messages("uu")) == [["1"]]
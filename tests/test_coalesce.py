@@ -0,0 +1,121 @@
+"""Single-flight coalescing: one generation per key, shared with everyone who joins it."""
+import asyncio
+import fakeredis
+import pytest
+from coalesce import Coalescer
+
+
+class Source:
+    """Counts factory calls; yields `tokens` with a pause so others can join mid-flight."""
+    def __init__(self, tokens=("a", "b", "c"), error: Exception = None):
+        self.tokens = tokens
+        self.error = error
+        self.calls = 0
+        self.closed = False
+        self.finish_reason = None
+
+    def factory(self):
+        self.calls += 1
+        return self._run()
+
+    async def _run(self):
+        try:
+            for token in self.tokens:
+                await asyncio.sleep(0.01)
+                yield token
+            if self.error:
+                raise self.error
+            self.finish_reason = "length"
+        finally:
+            self.closed = True
+
+
+def test_identical_requests_share_one_generation_and_its_outcome():
+    source = Source()
+    completed = []
+
+    async def scenario():
+        coalescer = Coalescer()
+
+        async def store(text):
+            completed.append(text)
+
+        leader = await coalescer.join("k", source.factory, on_complete=store, outcome=lambda: source.finish_reason)
+        await asyncio.sleep(0.015)  # a late joiner replays what was already generated
+        follower = await coalescer.join("k", Source().factory)
+        texts = await asyncio.gather(leader.text(), follower.text())
+        return coalescer, leader, follower, texts
+
+    coalescer, leader, follower, texts = asyncio.run(scenario())
+    assert texts == ["abc", "abc"]
+    assert source.calls == 1
+    assert leader.leader and not follower.leader
+    assert follower.outcome == leader.outcome == "length"
+    assert completed == ["abc"]
+    assert coalescer.in_flight == 0
+
+
+def test_generation_error_reaches_every_subscriber():
+    source = Source(error=RuntimeError("scheduler gone"))
+
+    async def scenario():
+        coalescer = Coalescer()
+        leader = await coalescer.join("k", source.factory)
+        follower = await coalescer.join("k", source.factory)
+        return await asyncio.gather(leader.text(), follower.text(), return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    assert [str(r) for r in results] == ["scheduler gone", "scheduler gone"]
+    assert source.calls == 1
+
+
+def test_admission_error_is_raised_by_join():
+    async def rejected():
+        raise RuntimeError("queue full")
+
+    async def scenario():
+        coalescer = Coalescer()
+        with pytest.raises(RuntimeError, match="queue full"):
+            await coalescer.join("k", rejected)
+        return coalescer.in_flight
+
+    assert asyncio.run(scenario()) == 0
+
+
+def test_generation_stops_when_every_subscriber_leaves():
+    source = Source(tokens=["t"] * 1000)
+
+    async def scenario():
+        coalescer = Coalescer()
+        first = await coalescer.join("k", source.factory)
+        second = await coalescer.join("k", source.factory)
+        await asyncio.sleep(0.03)
+        await first.aclose()
+        await asyncio.sleep(0.03)
+        alive_with_one = not source.closed
+        await second.aclose()
+        await asyncio.sleep(0.03)
+        return alive_with_one, coalescer.in_flight
+
+    alive_with_one, in_flight = asyncio.run(scenario())
+    assert alive_with_one
+    assert source.closed and in_flight == 0
+
+
+def test_replicas_share_a_flight_through_redis():
+    server = fakeredis.FakeServer()
+    source = Source()
+
+    async def scenario():
+        leader_replica = Coalescer(fakeredis.aioredis.FakeRedis(server=server, decode_responses=True))
+        other_replica = Coalescer(fakeredis.aioredis.FakeRedis(server=server, decode_responses=True))
+        leader = await leader_replica.join("k", source.factory, outcome=lambda: source.finish_reason)
+        follower = await other_replica.join("k", Source().factory)
+        texts = await asyncio.gather(leader.text(), follower.text())
+        return leader, follower, texts
+
+    leader, follower, texts = asyncio.run(scenario())
+    assert texts == ["abc", "abc"]
+    assert source.calls == 1
+    assert not follower.leader
+    assert follower.outcome == "length"
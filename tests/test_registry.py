@@ -0,0 +1,106 @@
+"""ModelRegistry eviction and hot-swap against engines that only pretend to hold weights."""
+import asyncio
+from brain import ModelEngine
+from config import config
+from registry import ModelRegistry
+
+MB = 1024 * 1024
+
+
+class FakeEngine(ModelEngine):
+    loaded_bytes_at_load = {}  # model id -> registry bytes in memory when its load started
+
+    def __init__(self, model_id: str, registry_ref: list):
+        super().__init__(model_id)
+        self._registry_ref = registry_ref
+
+    @property
+    def memory_bytes(self) -> int:
+        return MB
+
+    def load_model(self):
+        self.loaded_bytes_at_load[self.model_id] = self._registry_ref[0]._loaded_bytes()
+        self.model = object()
+
+    def unload(self):
+        self.model = None
+
+
+def _registry(budget_mb: int = 2) -> ModelRegistry:
+    ref = []
+    registry = ModelRegistry(
+        default_model_id="default-model",
+        routes={"a": "model-a", "b": "model-b", "c": "model-c"},
+        tier_routes={},
+        memory_budget_mb=budget_mb,
+        engine_factory=lambda model_id: FakeEngine(model_id, ref),
+    )
+    ref.append(registry)
+    return registry
+
+
+def test_routed_engine_is_not_evicted_until_released():
+    registry = _registry()
+
+    async def scenario():
+        await registry.aroute("default")
+        held = await registry.aroute("a")
+        # Over budget, but "a" is still serving a request
+        b = await registry.aroute("b")
+        assert held.ready and b.ready
+        b.release()
+        held.release()
+        c = await registry.aroute("c")
+        c.release()
+        return held, b, c
+
+    held, b, c = asyncio.run(scenario())
+    # Released: both are idle now and go, least recently used first, until the budget holds
+    assert c.ready and not held.ready and not b.ready
+    assert registry._loaded_bytes() <= registry.memory_budget
+
+
+def test_acquire_fails_after_eviction():
+    registry = _registry()
+    engine = registry.load("model-a")
+    assert engine.unload_if_idle()
+    assert not engine.acquire()
+    assert engine.idle
+
+
+def test_unload_if_idle_refuses_held_engine():
+    registry = _registry()
+    engine = registry.load("model-a")
+    assert engine.acquire()
+    assert not engine.unload_if_idle()
+    engine.release()
+    assert engine.unload_if_idle()
+
+
+def test_reload_evicts_before_loading():
+    registry = _registry()
+    registry.load("default-model")
+    registry.load("model-a")
+    registry.load("model-b")  # first load of b: measured after, then a is evicted
+    assert not registry.engine("model-a").ready
+    registry.load("model-a")  # size known now: b makes room before a loads
+    assert FakeEngine.loaded_bytes_at_load["model-a"] + MB <= registry.memory_budget
+
+
+def test_swap_waits_for_requests_on_the_old_model(monkeypatch):
+    monkeypatch.setattr(config, "MODEL_SWAP_DRAIN_SECONDS", 30)
+    registry = _registry(budget_mb=0)
+
+    async def scenario():
+        old = await registry.aroute("a")
+        swap = asyncio.create_task(registry.swap("a", "model-a2"))
+        await asyncio.sleep(1.0)
+        assert registry.routes["a"] == "model-a2"
+        still_loaded = old.ready
+        old.release()
+        await asyncio.wait_for(swap, 5)
+        return still_loaded, old
+
+    still_loaded, old = asyncio.run(scenario())
+    assert still_loaded
+    assert not old.ready
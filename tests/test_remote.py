@@ -0,0 +1,128 @@
+"""ModelClient against a stub model server speaking the remote.py wire format."""
+import asyncio
+import os
+import tempfile
+import threading
+import time
+from multiprocessing.connection import Listener
+import pytest
+from registry import ModelUnavailable
+from remote import ModelClient
+
+
+class StubServer:
+    """
+    call "echo"  -> ok(arg)
+    call "slow"  -> ok(arg) after 0.2s, even if the caller cancelled meanwhile
+    call "hang"  -> never answers
+    stream "tokens" -> accepted, a token per arg, end("eos")
+    stream "reject" -> error(ValueError)
+    """
+    def __init__(self):
+        self.address = os.path.join(tempfile.mkdtemp(), "model.sock")
+        self.listener = Listener(self.address, family="AF_UNIX", authkey=b"k")
+        self.received = []
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def cancelled(self):
+        return [m[1] for m in self.received if m[0] == "cancel"]
+
+    def _serve(self):
+        conn = self.listener.accept()
+        while True:
+            try:
+                message = conn.recv()
+            except (OSError, EOFError):
+                return
+            self.received.append(message)
+            if message[0] == "cancel":
+                continue
+            kind, rid, method, args, _ = message
+            if method == "echo":
+                conn.send((rid, "ok", args[0]))
+            elif method == "slow":
+                threading.Timer(0.2, conn.send, args=((rid, "ok", args[0]),)).start()
+            elif method == "tokens":
+                conn.send((rid, "accepted", None))
+                for token in args:
+                    conn.send((rid, "token", token))
+                conn.send((rid, "end", "eos"))
+            elif method == "reject":
+                conn.send((rid, "error", ValueError("prompt too long")))
+
+
+@pytest.fixture
+def server():
+    stub = StubServer()
+    yield stub
+    stub.listener.close()
+
+
+@pytest.fixture
+def client(server):
+    client = ModelClient(server.address, authkey="k")
+    yield client
+    client.close()
+
+
+def _wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_cancelled_acall_is_cancelled_on_server_and_client_keeps_working(server, client):
+    async def scenario():
+        task = asyncio.create_task(client.acall("slow", 1))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        # The late reply to the cancelled call must not take the reader thread down
+        await asyncio.sleep(0.3)
+        return await asyncio.wait_for(client.acall("echo", 2), 2)
+
+    assert asyncio.run(scenario()) == 2
+    assert _wait_for(lambda: server.cancelled() == [0])
+    assert client._pending == {}
+
+
+def test_request_timeout_raises_model_unavailable_and_cancels(server, client):
+    with pytest.raises(ModelUnavailable):
+        client.request("hang", timeout=0.1)
+    assert _wait_for(lambda: len(server.cancelled()) == 1)
+    assert client.request("echo", 3) == 3
+
+
+def test_stream_rejection_raises_on_open(server, client):
+    async def scenario():
+        with pytest.raises(ValueError):
+            await client.aopen_stream("reject")
+
+    asyncio.run(scenario())
+    assert client._pending == {}
+
+
+def test_stream_delivers_tokens_and_end(server, client):
+    ended = []
+
+    async def scenario():
+        tokens = await client.aopen_stream("tokens", "a", "b", on_end=ended.append)
+        return [token async for token in tokens]
+
+    assert asyncio.run(scenario()) == ["a", "b"]
+    assert ended == ["eos"]
+    assert server.cancelled() == []
+
+
+def test_closing_stream_early_cancels_on_server(server, client):
+    async def scenario():
+        tokens = await client.aopen_stream("tokens", "a", "b", "c")
+        first = await tokens.__anext__()
+        await tokens.aclose()
+        return first
+
+    assert asyncio.run(scenario()) == "a"
+    assert _wait_for(lambda: server.cancelled() == [0])
+    assert client._pending == {}
@@ -0,0 +1,155 @@
+"""BatchScheduler admit / finish / fail against a tiny randomly initialised Llama."""
+import threading
+import pytest
+
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+
+from scheduler import BatchScheduler, GenerationRequest, SchedulerFull, SchedulerStopped  # noqa: E402
+
+
+class _Tokenizer:
+    eos_token_id = None  # never stop early: every row runs to its token budget
+
+    def decode(self, ids, skip_special_tokens=True):
+        return " ".join(str(i) for i in ids)
+
+
+class FakeEngine:
+    device = "cpu"
+
+    def __init__(self):
+        torch.manual_seed(0)
+        config = transformers.LlamaConfig(
+            vocab_size=64, hidden_size=16, intermediate_size=32,
+            num_hidden_layers=1, num_attention_heads=2, num_key_value_heads=2,
+        )
+        self.model = transformers.LlamaForCausalLM(config).eval()
+        self.tokenizer = _Tokenizer()
+
+    def count_tokens(self, text: str) -> int:
+        return len(text.split())
+
+
+class _PrefixCache:
+    """Returns a real cached prefix for session "cached", nothing for the rest."""
+
+    def __init__(self, past, length: int):
+        self.past, self.length = past, length
+
+    def lookup(self, session_id, input_ids):
+        return (self.past, self.length) if session_id == "cached" else (None, 0)
+
+    def store(self, session_id, ids, past):
+        pass
+
+
+@pytest.fixture
+def engine():
+    return FakeEngine()
+
+
+def _scheduler(engine, **kwargs) -> BatchScheduler:
+    options = dict(max_batch_size=4, max_wait_ms=20, max_queue_depth=8)
+    options.update(kwargs)
+    return BatchScheduler(engine, **options)
+
+
+def _request(tokens: int = 3, **kwargs) -> GenerationRequest:
+    return GenerationRequest([1, 5, 7, 9], max_new_tokens=tokens, temperature=0.0, **kwargs)
+
+
+def test_submit_runs_to_length(engine):
+    scheduler = _scheduler(engine)
+    scheduler.start()
+    try:
+        request = scheduler.submit(_request(tokens=4))
+        text = request.future.result(timeout=30)
+    finally:
+        scheduler.stop()
+    assert request.finish_reason == "length"
+    assert len(request.generated) == 4
+    assert text == engine.tokenizer.decode(request.generated)
+
+
+def test_concurrent_rows_finish_independently(engine):
+    scheduler = _scheduler(engine, max_wait_ms=200)
+    scheduler.start()
+    try:
+        short, long = _request(tokens=2), _request(tokens=6)
+        scheduler.submit(short)
+        scheduler.submit(long)
+        long.future.result(timeout=30)
+        short.future.result(timeout=30)
+    finally:
+        scheduler.stop()
+    assert (len(short.generated), len(long.generated)) == (2, 6)
+    assert scheduler.active == 0
+
+
+def test_cancelled_while_queued_skips_prefill(engine):
+    scheduler = _scheduler(engine)
+    request = _request()
+    request.cancel()
+    scheduler.submit(request)
+    scheduler.start()
+    try:
+        assert request.future.result(timeout=30) == ""
+    finally:
+        scheduler.stop()
+    assert request.finish_reason == "cancelled"
+
+
+def test_full_queue_rejects(engine):
+    scheduler = _scheduler(engine, max_queue_depth=1)  # not started: nothing drains the queue
+    scheduler.submit(_request())
+    with pytest.raises(SchedulerFull):
+        scheduler.submit(_request())
+
+
+def test_failed_prefill_leaves_no_rows_behind(engine):
+    prompt = [1, 5, 7]
+    with torch.inference_mode():
+        out = engine.model(input_ids=torch.tensor([prompt]), use_cache=True)
+    from scheduler import _to_legacy
+    scheduler = _scheduler(engine, max_wait_ms=200, prefix_cache=_PrefixCache(_to_legacy(out.past_key_values), len(prompt)))
+
+    cached = GenerationRequest(prompt + [9], max_new_tokens=3, temperature=0.0, session_id="cached")
+    poisoned = GenerationRequest([1, 999], max_new_tokens=3, temperature=0.0)  # out of vocab: the fresh prefill raises
+    scheduler.submit(cached)
+    scheduler.submit(poisoned)
+    scheduler.start()
+    try:
+        for request in (cached, poisoned):
+            with pytest.raises(Exception):
+                request.future.result(timeout=30)
+        assert scheduler.active == 0
+
+        # The loop keeps serving afterwards
+        assert scheduler.submit(_request(tokens=2)).future.result(timeout=30)
+    finally:
+        scheduler.stop()
+
+
+def test_stop_fails_queued_and_running_requests(engine):
+    started = threading.Event()
+    forward = engine.model.forward
+
+    def slow_forward(*args, **kwargs):
+        started.set()
+        return forward(*args, **kwargs)
+
+    engine.model.forward = slow_forward
+    scheduler = _scheduler(engine, max_batch_size=1)
+    running, queued = _request(tokens=10_000), _request()
+    scheduler.submit(running)
+    scheduler.submit(queued)
+    scheduler.start()
+    assert started.wait(timeout=30)
+    scheduler.stop()
+
+    for request in (running, queued):
+        with pytest.raises(SchedulerStopped):
+            request.future.result(timeout=10)
+    with pytest.raises(SchedulerStopped):
+        scheduler.submit(_request())
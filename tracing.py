@@ -0,0 +1,98 @@
+"""
+Request Tracing: per-stage timing for the chat pipeline.
+
+Every span feeds the `gonyai_stage_latency_seconds{stage=...}` histogram.
+With ENABLE_TRACING and OpenTelemetry installed, the same spans are also
+exported as OTel spans (OTLP when opentelemetry-exporter-otlp is present and
+OTEL_EXPORTER_OTLP_ENDPOINT is set, console otherwise), nested per request.
+
+    with span("rag"):
+        context = await mapper.aget_context(prompt)
+"""
+import os
+import time
+from contextlib import contextmanager
+from typing import Awaitable, TypeVar
+from config import config
+from metrics import STAGE_LATENCY
+
+try:
+    from opentelemetry import trace
+    OTEL_AVAILABLE = True
+except ImportError:
+    OTEL_AVAILABLE = False
+
+T = TypeVar("T")
+
+_tracer = None
+
+def setup_tracing():
+    """Installs a tracer provider when tracing is enabled. Safe to call more than once."""
+    global _tracer
+    if not config.ENABLE_TRACING or _tracer is not None:
+        return
+    if not OTEL_AVAILABLE:
+        print("WARNING: ENABLE_TRACING=True but opentelemetry is not installed. Stage metrics only.")
+        return
+    try:
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+        provider = TracerProvider(resource=Resource.create({"service.name": config.TRACING_SERVICE_NAME}))
+        exporter = None
+        if os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT"):
+            try:
+                from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+                exporter = OTLPSpanExporter()
+            except ImportError:
+                print("WARNING: OTEL_EXPORTER_OTLP_ENDPOINT set but opentelemetry-exporter-otlp is not installed.")
+        provider.add_span_processor(BatchSpanProcessor(exporter or ConsoleSpanExporter()))
+        trace.set_tracer_provider(provider)
+    except ImportError:
+        # API only (e.g. auto-instrumentation supplies the provider)
+        pass
+    _tracer = trace.get_tracer("gonyai")
+    print("OpenTelemetry tracing enabled.")
+
+class Span:
+    """A pipeline stage. Prefer span(); use this directly when a stage outlives one block (streaming)."""
+    def __init__(self, name: str, **attributes):
+        self.name = name
+        self.started = time.perf_counter()
+        self._otel = _tracer.start_span(name, attributes=attributes) if _tracer else None
+        self._ended = False
+
+    @contextmanager
+    def activate(self):
+        """Makes this span the parent of spans opened inside the block."""
+        if self._otel is None:
+            yield self
+            return
+        with trace.use_span(self._otel, end_on_exit=False, record_exception=True, set_status_on_exception=True):
+            yield self
+
+    def set(self, **attributes):
+        if self._otel is not None:
+            self._otel.set_attributes(attributes)
+
+    def end(self):
+        if self._ended:
+            return
+        self._ended = True
+        STAGE_LATENCY.labels(stage=self.name).observe(time.perf_counter() - self.started)
+        if self._otel is not None:
+            self._otel.end()
+
+@contextmanager
+def span(name: str, **attributes):
+    stage = Span(name, **attributes)
+    try:
+        with stage.activate():
+            yield stage
+    finally:
+        stage.end()
+
+async def traced(name: str, awaitable: Awaitable[T], **attributes) -> T:
+    """Times an awaitable as its own stage, e.g. one branch of an asyncio.gather."""
+    with span(name, **attributes):
+        return await awaitable
@@ -0,0 +1,203 @@
+"""
+Vector index management for RediSearch.
+
+Indexes are addressed through an alias (e.g. `coconut_idx`) pointing at a
+physical index whose name encodes its algorithm and parameters. Moving to
+new parameters builds a second physical index over the same key prefix,
+waits for the background indexing to finish and flips the alias, so
+queries never see a half-built index.
+
+    python3 vector_index.py info --index coconut_idx
+    python3 vector_index.py migrate --index coconut_idx --algorithm HNSW --m 32
+"""
+import argparse
+import hashlib
+import sys
+import time
+from typing import Dict, List, Optional
+from config import config
+
+# Known index families: alias -> (key prefix, TEXT fields)
+RAG_INDEX = ("coconut_idx", "doc:", ["content"])
+CACHE_PREFIX = "cache:"  # every model's entries (compaction, legacy un-namespaced keys)
+CACHE_TEXT_FIELDS = ["response"]
+
+def cache_prefix(model_hash: str) -> str:
+    """Key prefix of one model's cache entries, so its index never covers another model's."""
+    return f"{CACHE_PREFIX}{model_hash}:"
+
+def embedding_dim(model) -> int:
+    """Vector size straight from the embedding model instead of a hardcoded 384."""
+    getter = getattr(model, "get_embedding_dimension", None) or model.get_sentence_embedding_dimension
+    return int(getter())
+
+def vector_field_args(
+    dim: int,
+    algorithm: Optional[str] = None,
+    m: Optional[int] = None,
+    ef_construction: Optional[int] = None,
+    ef_runtime: Optional[int] = None,
+) -> List[str]:
+    algorithm = (algorithm or config.VECTOR_ALGORITHM).upper()
+    attrs = ["TYPE", "FLOAT32", "DIM", str(dim), "DISTANCE_METRIC", "COSINE"]
+    if algorithm == "HNSW":
+        attrs += [
+            "M", str(m or config.HNSW_M),
+            "EF_CONSTRUCTION", str(ef_construction or config.HNSW_EF_CONSTRUCTION),
+            "EF_RUNTIME", str(ef_runtime or config.HNSW_EF_RUNTIME),
+        ]
+    elif algorithm != "FLAT":
+        raise ValueError(f"Unsupported vector algorithm: {algorithm}")
+    return ["VECTOR", algorithm, str(len(attrs))] + attrs
+
+def physical_name(alias: str, vector_args: List[str], prefix: str = "") -> str:
+    # Deterministic: replicas racing to create the same index collide instead of duplicating it.
+    # The prefix is part of the identity: re-prefixing an index is a migration like new parameters.
+    digest = hashlib.md5(" ".join([prefix, *vector_args]).encode()).hexdigest()[:6]
+    return f"{alias}-{vector_args[1].lower()}-{digest}"
+
+def create_commands(alias: str, prefix: str, text_fields: List[str], dim: int, **vector_kwargs) -> List[tuple]:
+    vector_args = vector_field_args(dim, **vector_kwargs)
+    name = physical_name(alias, vector_args, prefix)
+    schema = []
+    for field in text_fields:
+        schema += [field, "TEXT"]
+    return [
+        ("FT.CREATE", name, "ON", "HASH", "PREFIX", "1", prefix, "SCHEMA", *schema, "vector", *vector_args),
+        ("FT.ALIASADD", alias, name),
+    ]
+
+def ensure_index(r, alias: str, prefix: str, text_fields: List[str], dim: int) -> bool:
+    """Creates alias + physical index if missing. Returns True when it created one."""
+    try:
+        r.execute_command("FT.INFO", alias)
+        return False
+    except Exception:
+        pass
+    print(f"Creating {config.VECTOR_ALGORITHM} vector index for '{alias}' (dim={dim})...")
+    for command in create_commands(alias, prefix, text_fields, dim):
+        try:
+            r.execute_command(*command)
+        except Exception as e:
+            # Another replica won the race: its index/alias is identical
+            if "exists" not in str(e).lower():
+                raise
+    return True
+
+async def aensure_index(r, alias: str, prefix: str, text_fields: List[str], dim: int) -> bool:
+    try:
+        await r.execute_command("FT.INFO", alias)
+        return False
+    except Exception:
+        pass
+    print(f"Creating {config.VECTOR_ALGORITHM} vector index for '{alias}' (dim={dim})...")
+    for command in create_commands(alias, prefix, text_fields, dim):
+        try:
+            await r.execute_command(*command)
+        except Exception as e:
+            if "exists" not in str(e).lower():
+                raise
+    return True
+
+def index_info(r, name: str) -> Dict[str, object]:
+    res = r.execute_command("FT.INFO", name)
+    if isinstance(res, dict):
+        return res
+    return {res[i]: res[i + 1] for i in range(0, len(res), 2)}
+
+def migrate(
+    r,
+    alias: str,
+    prefix: str,
+    text_fields: List[str],
+    dim: int,
+    poll_seconds: float = 2.0,
+    keep_old: bool = False,
+    **vector_kwargs,
+) -> str:
+    """Builds the new index next to the live one, then swaps the alias. Returns the new index name."""
+    old = index_info(r, alias)["index_name"]
+    create_index, _ = create_commands(alias, prefix, text_fields, dim, **vector_kwargs)
+    new = create_index[1]
+    if new == old:
+        print(f"'{alias}' already points at {new}; nothing to do.")
+        return new
+
+    print(f"Building {new} alongside {old}...")
+    r.execute_command(*create_index)
+    while True:
+        info = index_info(r, new)
+        percent = float(info.get("percent_indexed", 1))
+        print(f"  indexed {percent * 100:.1f}% ({info.get('num_docs')} docs)")
+        if int(info.get("indexing", 0)) == 0 and percent >= 1.0:
+            break
+        time.sleep(poll_seconds)
+
+    if old == alias:
+        # Legacy index created under the alias name itself: it must go before
+        # the name can become an alias (documents are kept, only the index drops)
+        r.execute_command("FT.DROPINDEX", old)
+        r.execute_command("FT.ALIASADD", alias, new)
+    else:
+        r.execute_command("FT.ALIASUPDATE", alias, new)
+        if not keep_old:
+            r.execute_command("FT.DROPINDEX", old)
+    print(f"'{alias}' now serves from {new}.")
+    return new
+
+def _family(alias: str):
+    if alias == RAG_INDEX[0]:
+        return RAG_INDEX[1], RAG_INDEX[2]
+    if alias.startswith("cache_idx_"):
+        return cache_prefix(alias[len("cache_idx_"):]), CACHE_TEXT_FIELDS
+    return None, None
+
+def main(argv: List[str]):
+    parser = argparse.ArgumentParser(description="Inspect and migrate Gonyai vector indexes.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    info_cmd = sub.add_parser("info", help="Show the physical index behind an alias")
+    info_cmd.add_argument("--index", default=RAG_INDEX[0])
+
+    mig = sub.add_parser("migrate", help="Rebuild an index with new parameters and swap the alias")
+    mig.add_argument("--index", default=RAG_INDEX[0], help="Alias to migrate (coconut_idx or cache_idx_<hash>)")
+    mig.add_argument("--prefix", help="Key prefix (defaults from the index family)")
+    mig.add_argument("--text-field", action="append", help="TEXT fields (defaults from the index family)")
+    mig.add_argument("--algorithm", default=config.VECTOR_ALGORITHM, choices=["FLAT", "HNSW"])
+    mig.add_argument("--m", type=int, default=config.HNSW_M)
+    mig.add_argument("--ef-construction", type=int, default=config.HNSW_EF_CONSTRUCTION)
+    mig.add_argument("--ef-runtime", type=int, default=config.HNSW_EF_RUNTIME)
+    mig.add_argument("--dim", type=int, help="Vector size (defaults to the embedding model's)")
+    mig.add_argument("--keep-old", action="store_true", help="Keep the previous physical index for rollback")
+    args = parser.parse_args(argv)
+
+    from datastore import RedisStore
+    r = RedisStore().sync
+
+    if args.command == "info":
+        info = index_info(r, args.index)
+        print(f"{args.index} -> {info['index_name']} ({info.get('num_docs')} docs)")
+        return
+
+    prefix, fields = _family(args.index)
+    prefix = args.prefix or prefix
+    fields = args.text_field or fields
+    if not prefix or not fields:
+        parser.error("Unknown index family: pass --prefix and --text-field")
+
+    dim = args.dim
+    if dim is None:
+        from embeddings import load_model
+        dim = embedding_dim(load_model())
+
+    migrate(
+        r, args.index, prefix, fields, dim,
+        keep_old=args.keep_old,
+        algorithm=args.algorithm,
+        m=args.m,
+        ef_construction=args.ef_construction,
+        ef_runtime=args.ef_runtime,
+    )
+
+if __name__ == "__main__":
+    main(sys.argv[1:])